@@ -126,6 +126,35 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_URL = 'static/'
 django_heroku.settings(locals())
 
+# Team allocation engine: "greedy", "flow" or "search"
+# (see bot/utils/allocation_utils.py)
+
+ALLOCATION_ENGINE = env.str('ALLOCATION_ENGINE', 'greedy')
+
+# "search" engine: number of randomized attempts and wall-clock budget,
+# keep the budget below the gunicorn worker timeout (30 s by default)
+
+ALLOCATION_SEARCH_ATTEMPTS = env.int('ALLOCATION_SEARCH_ATTEMPTS', 32)
+ALLOCATION_SEARCH_SECONDS = env.float('ALLOCATION_SEARCH_SECONDS', 20)
+
+# Local search over the allocated teams (level mix, far east grouping,
+# constraints, PM load), seconds; 0 disables it
+
+ALLOCATION_OPTIMIZE_SECONDS = env.float('ALLOCATION_OPTIMIZE_SECONDS', 0)
+
+# Bot handlers and admin actions instrumentation: wall time, SQL query
+# count and SQL time per call are saved as CallMetric rows, calls slower
+# than INSTRUMENTATION_SLOW_MS are logged (see `manage.py call_metrics`)
+
+INSTRUMENTATION = env.bool('INSTRUMENTATION', False)
+INSTRUMENTATION_SLOW_MS = env.float('INSTRUMENTATION_SLOW_MS', 500)
+
+# Notifications are sent by a pool of NOTIFY_WORKERS threads, at most
+# NOTIFY_RATE messages per second for the whole bot (Telegram allows ~30)
+
+NOTIFY_WORKERS = env.int('NOTIFY_WORKERS', 8)
+NOTIFY_RATE = env.float('NOTIFY_RATE', 25)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
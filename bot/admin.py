@@ -1,15 +1,36 @@
-from django.contrib import admin
-from django.http import HttpResponseRedirect
-from django.urls import re_path
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import re_path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
 
-from .models import Constraint, Participant, Project, TeamProject, TimeSlot
+from .models import (
+    AllocationBatch,
+    AvailabilityInterval,
+    CallMetric,
+    Cohort,
+    Constraint,
+    Job,
+    OutboxMessage,
+    Participant,
+    Project,
+    RosterSnapshot,
+    TeamProject,
+    TimeSlot,
+)
+from .utils.roster_utils import refresh_rosters
 from .utils.timeslots_utils import (
-    cancel_distribution,
-    make_teams,
-    get_teams,
-    get_unallocated_students,
+    cancel_batch,
+    refresh_free_slots_masks,
+    update_free_slots_masks,
 )
-from .utils.notification_utils import notify_free_students, notify_teams
+from .utils.instrumentation_utils import instrumented
+from .utils.job_utils import JobAlreadyActive, enqueue_job, job_progress
+
+PREVIEW_JOB_SESSION_KEY = "distribution_preview_job_id"
+# Поля участника, которые копируются в снимки составов команд
+ROSTER_PARTICIPANT_FIELDS = {"name", "tg_username", "level", "utc_offset"}
 
 
 class TimeSlotInline(admin.TabularInline):
@@ -24,6 +45,8 @@ class ParticipantAdmin(admin.ModelAdmin):
         "tg_username",
         "level",
         "is_far_east",
+        "utc_offset",
+        "cohort",
     )
     list_filter = list_display
 
@@ -33,6 +56,24 @@ class ParticipantAdmin(admin.ModelAdmin):
         TimeSlotInline,
     ]
 
+    def save_model(self, request, participant, form, change):
+        # Пояс, не заданный явно, следует за признаком «Из ДВ?»
+        if "is_far_east" in form.changed_data and "utc_offset" not in form.changed_data:
+            participant.utc_offset = Participant.default_utc_offset(
+                participant.is_far_east
+            )
+            form.changed_data.append("utc_offset")
+        super().save_model(request, participant, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_free_slots_masks([form.instance.id])
+        if change and ROSTER_PARTICIPANT_FIELDS.intersection(form.changed_data):
+            team_project_ids = form.instance.timeslots.exclude(
+                team_project=None
+            ).values_list("team_project_id", flat=True)
+            refresh_rosters(list(team_project_ids))
+
 
 @admin.register(TimeSlot)
 class TimeSlotAdmin(admin.ModelAdmin):
@@ -54,67 +95,160 @@ class TimeSlotAdmin(admin.ModelAdmin):
         roles = dict(Participant.PARTICIPANT_ROLES_CHOICES)
         return roles[timeslot.participant.role]
 
+    def save_model(self, request, timeslot, form, change):
+        participant_ids = {timeslot.participant_id}
+        if change and "participant" in form.changed_data:
+            participant_ids.add(form.initial["participant"])
+        super().save_model(request, timeslot, form, change)
+        refresh_free_slots_masks(participant_ids)
+
+    def delete_model(self, request, timeslot):
+        super().delete_model(request, timeslot)
+        refresh_free_slots_masks([timeslot.participant_id])
+
+    def delete_queryset(self, request, queryset):
+        participant_ids = set(queryset.values_list("participant_id", flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_free_slots_masks(participant_ids)
+
+    def start_job(self, request, action, payload=None):
+        """Ставит action в очередь воркера run_jobs и сообщает номер задачи
+        со ссылкой на ее ход. Возвращает задачу или None, если задача
+        с тем же замком еще не завершилась."""
+        try:
+            job = enqueue_job(action, payload)
+        except JobAlreadyActive as error:
+            self.message_user(
+                request,
+                format_html(
+                    '{}, дождитесь ее завершения: <a href="{}">ход выполнения</a>.',
+                    error,
+                    reverse("admin:bot_job_change", args=[error.job.id]),
+                ),
+                level=messages.WARNING,
+            )
+            return None
+
+        self.message_user(
+            request,
+            format_html(
+                'Задача #{} поставлена в очередь: <a href="{}">ход выполнения</a>.',
+                job.id,
+                reverse("admin:bot_job_change", args=[job.id]),
+            ),
+        )
+        return job
+
     def get_urls(self):
         urls = super(TimeSlotAdmin, self).get_urls()
         custom_urls = [
             re_path(
                 "^distribute/$",
-                self.process_distribute_students,
+                self.admin_site.admin_view(self.process_distribute_students),
                 name="process_distribute_students",
             ),
+            re_path(
+                "^preview_distribution/$",
+                self.admin_site.admin_view(self.process_preview_distribution),
+                name="process_preview_distribution",
+            ),
+            re_path(
+                "^apply_distribution/$",
+                self.admin_site.admin_view(self.process_apply_distribution),
+                name="process_apply_distribution",
+            ),
+            re_path(
+                "^distribute_late/$",
+                self.admin_site.admin_view(self.process_distribute_late_students),
+                name="process_distribute_late_students",
+            ),
             re_path(
                 "^cancel_distribution/$",
-                self.process_cancel_distribution_students,
+                self.admin_site.admin_view(self.process_cancel_distribution_students),
                 name="process_cancel_distribution_students",
             ),
             re_path(
                 "^notify_teams/$",
-                self.process_notify_teams,
+                self.admin_site.admin_view(self.process_notify_teams),
                 name="process_notify_teams",
             ),
             re_path(
                 "^notify_free_students/$",
-                self.process_notify_free_students,
+                self.admin_site.admin_view(self.process_notify_free_students),
                 name="process_notify_free_students",
             ),
         ]
         return custom_urls + urls
 
+    @instrumented("admin.process_distribute_students")
     def process_distribute_students(self, request):
-        result_message = make_teams()
-        # TODO: использовать messages и level
-        self.message_user(request, result_message)
+        self.start_job(request, Job.DISTRIBUTE)
+        return HttpResponseRedirect("../")
 
-        self.process_notify_teams(request)
-        self.process_notify_free_students(request)
+    @instrumented("admin.process_preview_distribution")
+    def process_preview_distribution(self, request):
+        # Планирование идет в воркере, план применяется по номеру задачи
+        job = self.start_job(request, Job.PREVIEW_DISTRIBUTION)
+        if job:
+            request.session[PREVIEW_JOB_SESSION_KEY] = job.id
+        return HttpResponseRedirect("../")
+
+    @instrumented("admin.process_apply_distribution")
+    def process_apply_distribution(self, request):
+        preview_job = Job.objects.filter(
+            id=request.session.get(PREVIEW_JOB_SESSION_KEY)
+        ).first()
+        if preview_job is None:
+            error = "Нет сохраненного плана, сначала выполните предпросмотр."
+        elif preview_job.is_active:
+            error = "Предпросмотр еще выполняется, дождитесь его завершения."
+        elif "plans" not in preview_job.result:
+            error = "Предпросмотр завершился ошибкой, выполните его снова."
+        else:
+            error = None
+        if error:
+            self.message_user(request, error, level=messages.ERROR)
+            return HttpResponseRedirect("../")
 
+        # Номер предпросмотра остается в сессии, если задачу поставить не удалось
+        payload = {"preview_job_id": preview_job.id}
+        if self.start_job(request, Job.APPLY_DISTRIBUTION, payload):
+            request.session.pop(PREVIEW_JOB_SESSION_KEY)
         return HttpResponseRedirect("../")
 
-    def process_cancel_distribution_students(self, request):
-        result_message = cancel_distribution()
-        # TODO: использовать messages и level
-        self.message_user(request, result_message)
+    @instrumented("admin.process_distribute_late_students")
+    def process_distribute_late_students(self, request):
+        self.start_job(request, Job.DISTRIBUTE_LATE)
+        return HttpResponseRedirect("../")
 
+    @instrumented("admin.process_cancel_distribution_students")
+    def process_cancel_distribution_students(self, request):
+        self.start_job(request, Job.CANCEL_DISTRIBUTION)
         return HttpResponseRedirect("../")
 
+    @instrumented("admin.process_notify_teams")
     def process_notify_teams(self, request):
-        # TODO: использовать messages и level
-        notify_teams(get_teams())
-        self.message_user(request, "Команды и ПМы оповещены.")
-
+        self.start_job(request, Job.NOTIFY_TEAMS)
         return HttpResponseRedirect("../")
 
+    @instrumented("admin.process_notify_free_students")
     def process_notify_free_students(self, request):
-        # TODO: использовать messages и level
-        notify_free_students(get_unallocated_students())
-        self.message_user(request, "Нераспределенные ученики оповещены.")
-
+        self.start_job(request, Job.NOTIFY_FREE_STUDENTS)
         return HttpResponseRedirect("../")
 
 
 @admin.register(TeamProject)
 class TeamProjectAdmin(admin.ModelAdmin):
-    pass
+    # Слоты удаленной команды освобождаются (SET_NULL)
+    def delete_model(self, request, team_project):
+        update_free_slots_masks(team_project.timeslots.all(), free=True)
+        super().delete_model(request, team_project)
+
+    def delete_queryset(self, request, queryset):
+        update_free_slots_masks(
+            TimeSlot.objects.filter(team_project__in=queryset), free=True
+        )
+        super().delete_queryset(request, queryset)
 
 
 @admin.register(Project)
@@ -125,3 +259,235 @@ class ProjectAdmin(admin.ModelAdmin):
 @admin.register(Constraint)
 class ConstraintAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(RosterSnapshot)
+class RosterSnapshotAdmin(admin.ModelAdmin):
+    list_display = (
+        "project_name",
+        "time_slot",
+        "pm_name",
+        "students_names",
+        "date_start",
+    )
+    list_filter = (
+        "time_slot",
+        "date_start",
+    )
+
+    def students_names(self, roster):
+        return ", ".join(student["name"] for student in roster.students)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, roster=None):
+        return False
+
+
+@admin.register(AllocationBatch)
+class AllocationBatchAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "engine",
+        "cohort",
+        "date_start",
+        "created_at",
+        "cancelled_at",
+        "teams_count",
+        "placed_students_count",
+    )
+    list_filter = (
+        "engine",
+        "cohort",
+        "cancelled_at",
+    )
+    readonly_fields = (
+        "engine",
+        "cohort",
+        "date_start",
+        "date_end",
+        "created_at",
+        "cancelled_at",
+        "stats",
+        "plan",
+    )
+    actions = ["cancel_batches"]
+
+    def teams_count(self, batch):
+        return batch.stats.get("teams")
+
+    def placed_students_count(self, batch):
+        return batch.stats.get("placed_students")
+
+    @admin.action(description="Откатить выбранные запуски")
+    def cancel_batches(self, request, queryset):
+        batches = queryset.filter(cancelled_at=None).order_by("-id")
+        for batch in batches:
+            cancel_batch(batch)
+        self.message_user(request, f"Откачено запусков: {len(batches)}.")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Cohort)
+class CohortAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "date_start",
+        "date_end",
+    )
+
+
+@admin.register(AvailabilityInterval)
+class AvailabilityIntervalAdmin(admin.ModelAdmin):
+    """Периоды пишет бот вместе со свободными слотами, поэтому здесь
+    они только просматриваются."""
+
+    list_display = (
+        "participant",
+        "start",
+        "end",
+    )
+    list_filter = ("participant",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, interval=None):
+        return False
+
+
+@admin.register(CallMetric)
+class CallMetricAdmin(admin.ModelAdmin):
+    """Замеры пишет instrumented, здесь они только просматриваются.
+    Процентили по обработчикам — команда call_metrics."""
+
+    list_display = (
+        "name",
+        "created_at",
+        "seconds",
+        "queries",
+        "sql_seconds",
+        "failed",
+    )
+    list_filter = (
+        "name",
+        "failed",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, metric=None):
+        return False
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    """Оповещения ставит в очередь рассылка, отправляет send_outbox,
+    здесь их можно только просмотреть и поставить заново."""
+
+    list_display = (
+        "chat_id",
+        "template",
+        "team_project",
+        "status",
+        "attempts",
+        "created_at",
+        "sent_at",
+    )
+    list_filter = (
+        "status",
+        "template",
+    )
+    actions = ["requeue_messages"]
+
+    @admin.action(description="Поставить в очередь заново")
+    def requeue_messages(self, request, queryset):
+        requeued = queryset.exclude(status=OutboxMessage.SENDING).update(
+            status=OutboxMessage.PENDING, error=""
+        )
+        self.message_user(request, f"Поставлено в очередь заново: {requeued}.")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, message=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Задачи ставят кнопки распределения и оповещений, выполняет run_jobs,
+    здесь их ход только просматривается. Для опроса из скриптов
+    ход отдается в JSON по адресу <id>/progress/."""
+
+    list_display = (
+        "id",
+        "action",
+        "status",
+        "percent",
+        "created_at",
+        "started_at",
+        "finished_at",
+    )
+    list_filter = (
+        "action",
+        "status",
+    )
+    readonly_fields = (
+        "action",
+        "status",
+        "percent",
+        "done",
+        "total",
+        "counts",
+        "messages",
+        "errors",
+        "created_at",
+        "started_at",
+        "heartbeat_at",
+        "finished_at",
+    )
+    exclude = ("lock", "payload", "result")
+    change_form_template = "admin/job_change_form.html"
+    actions = ["cancel_pending_jobs"]
+
+    @admin.display(description="Выполнено, %")
+    def percent(self, job):
+        return job.percent
+
+    def get_urls(self):
+        urls = super(JobAdmin, self).get_urls()
+        custom_urls = [
+            re_path(
+                r"^(?P<job_id>\d+)/progress/$",
+                self.admin_site.admin_view(self.process_job_progress),
+                name="bot_job_progress",
+            ),
+        ]
+        return custom_urls + urls
+
+    def process_job_progress(self, request, job_id):
+        job = get_object_or_404(Job, id=job_id)
+        return JsonResponse(
+            job_progress(job), json_dumps_params={"ensure_ascii": False}
+        )
+
+    @admin.action(description="Снять с очереди ожидающие задачи")
+    def cancel_pending_jobs(self, request, queryset):
+        cancelled = 0
+        for job in queryset.filter(status=Job.PENDING):
+            job.errors.append("Снята с очереди в админке.")
+            cancelled += Job.objects.filter(id=job.id, status=Job.PENDING).update(
+                status=Job.FAILED, errors=job.errors, finished_at=timezone.now()
+            )
+        self.message_user(request, f"Снято с очереди задач: {cancelled}.")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, job=None):
+        return False
@@ -1,5 +1,5 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from telegram import (
     InlineKeyboardButton,
@@ -18,6 +18,14 @@ from telegram.ext import (
     Updater,
 )
 
+from bot.models import AvailabilityInterval, Participant
+from bot.utils.interval_utils import mask_intervals, set_availability_intervals
+from bot.utils.timeslots_utils import (
+    PROJECTS_END_DATE,
+    PROJECTS_START_DATE,
+    local_timezone,
+)
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
@@ -54,6 +62,74 @@ def delete_time_period_pm(context, time_key):
         time_period.pop(time_key)
 
 
+def _project_days(participant):
+    if participant.cohort:
+        date_start = participant.cohort.date_start
+        date_end = participant.cohort.date_end
+    else:
+        date_start = date.fromisoformat(PROJECTS_START_DATE)
+        date_end = date.fromisoformat(PROJECTS_END_DATE)
+    return [
+        date_start + timedelta(days=day)
+        for day in range((date_end - date_start).days + 1)
+    ]
+
+
+def save_periods_pm(user_id, context):
+    """Записывает периоды менеджера, заданные в его поясе, интервалами
+    на каждый день проекта, по ним пересчитываются его свободные слоты."""
+    try:
+        pm = Participant.objects.select_related("cohort").get(tg_id=user_id)
+    except Participant.DoesNotExist:
+        return
+    pm_timezone = local_timezone(pm.utc_offset)
+    intervals = []
+    for day in _project_days(pm):
+        for start_time, end_time in context.user_data["time_period"].values():
+            start = datetime.combine(day, start_time.time(), tzinfo=pm_timezone)
+            end = datetime.combine(day, end_time.time(), tzinfo=pm_timezone)
+            if end <= start:
+                # период через полночь
+                end += timedelta(days=1)
+            intervals.append((start, end))
+    set_availability_intervals(pm, intervals)
+
+
+def load_periods_pm(user_id):
+    """Сохраненные периоды менеджера в его поясе в формате
+    context.user_data["time_period"]. Если периодов еще нет, а свободные
+    слоты заданы в админке или импортом, периоды строятся по слотам:
+    иначе первое сохранение периодов удалило бы эти слоты."""
+    time_period = {}
+    intervals = list(
+        AvailabilityInterval.objects.filter(participant__tg_id=user_id).values_list(
+            "start", "end", "participant__utc_offset"
+        )
+    )
+    if not intervals:
+        pm = (
+            Participant.objects.filter(tg_id=user_id)
+            .values_list("free_slots_mask", "utc_offset")
+            .first()
+        )
+        if pm:
+            free_slots_mask, utc_offset = pm
+            intervals = [
+                (start, end, utc_offset)
+                for start, end in mask_intervals(free_slots_mask)
+            ]
+    for start, end, utc_offset in intervals:
+        pm_timezone = local_timezone(utc_offset)
+        start_time = datetime.combine(
+            date(1970, 1, 1), start.astimezone(pm_timezone).time()
+        )
+        end_time = datetime.combine(
+            date(1970, 1, 1), end.astimezone(pm_timezone).time()
+        )
+        time_period[get_time_period_key(start_time, end_time)] = [start_time, end_time]
+    return time_period
+
+
 def get_array_time_period(context):
     time_period = context.user_data["time_period"]
     list_period = []
@@ -84,7 +160,7 @@ def show_period_pm(update: Update, context: CallbackContext):
     logger.info("update.message.text: %s", update.effective_message.text)
 
     if "time_period" not in context.user_data:
-        context.user_data["time_period"] = dict()
+        context.user_data["time_period"] = load_periods_pm(update.effective_user.id)
 
     reply_keyboard = list(keyboard_row_divider(get_array_time_period(context), 1))
 
@@ -165,6 +241,7 @@ def question_change_or_delete_period(update: Update, context: CallbackContext):
         return edit_period_pm(update, context)
     elif update.message.text == "Удалить":
         delete_time_period_pm(context, context.user_data["time_key"])
+        save_periods_pm(update.effective_user.id, context)
         return show_period_pm(update, context)
 
 
@@ -216,6 +293,7 @@ def inline_button_change_time(update: Update, context: CallbackContext):
         save_time_period_pm(
             context, context.user_data["time_key"], start_time, end_time
         )
+        save_periods_pm(update.effective_user.id, context)
         return show_period_pm(update, context)
 
     context.user_data["start_time"] = start_time
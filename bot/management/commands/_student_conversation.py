@@ -1,13 +1,15 @@
-import datetime
 import logging
-from datetime import timedelta
 from enum import Enum, auto
 
+from django.db import transaction
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import CallbackContext, CallbackQueryHandler, ConversationHandler
 
-from bot.models import Participant, TimeSlot
-from bot.utils.timeslots_utils import CALL_TIME_MINUTES, make_timeslots
+from bot.models import Participant
+from bot.utils.availability_utils import load_free_pm_times
+from bot.utils.instrumentation_utils import instrumented
+from bot.utils.roster_utils import refresh_rosters
+from bot.utils.timeslots_utils import set_free_timeslots, to_local_key, to_utc_time
 
 logger = logging.getLogger("student")
 
@@ -67,26 +69,30 @@ def keyboard_generator(context, keys=None):
     return InlineKeyboardMarkup(key_buttons)
 
 
+@instrumented("bot.select_time")
 def select_time(update: Update, context: CallbackContext):
-    empty_slots = (
-        TimeSlot.objects.filter(
-            participant__role=Participant.PRODUCT_MANAGER,
-            team_project__isnull=True,
-        )
-        .values("time_slot")
-        .distinct()
-    )
     user_id = update.callback_query.from_user.id
     student_time = []
+    utc_offset = Participant.MOSCOW_UTC_OFFSET
+    cohort_id = None
     try:
         student = Participant.objects.get(tg_id=user_id)
         logger.info(student)
+        utc_offset = student.utc_offset
+        cohort_id = student.cohort_id
         student_slots = student.timeslots.values("time_slot").distinct()
-        student_time = [slot["time_slot"].strftime("%H:%M") for slot in student_slots]
+        student_time = [
+            to_local_key(slot["time_slot"], utc_offset) for slot in student_slots
+        ]
     except Participant.DoesNotExist:
         pass
+    # Ученика распределят только к менеджерам его потока
+    free_pm_times = load_free_pm_times(cohort_id)
 
-    empty_time = [slot["time_slot"].strftime("%H:%M") for slot in empty_slots]
+    # Слоты в сетке UTC, ученику — по порядку в его поясе
+    empty_time = sorted(
+        to_local_key(time_slot, utc_offset) for time_slot in free_pm_times
+    )
     prepare_time = []
     for time in empty_time:
         new_time = time
@@ -104,6 +110,7 @@ def select_time(update: Update, context: CallbackContext):
     return States.SELECT_TIME
 
 
+@instrumented("bot.time_handler")
 def time_handler(update, context):
     query = update.callback_query
     _, choosing_time = separate_callback_data(query.data)
@@ -161,18 +168,34 @@ def collect_time(context: CallbackContext):
 
 def clear_time(user_id):
     student = Participant.objects.get(tg_id=user_id)
-    student.timeslots.all().delete()
+    with transaction.atomic():
+        team_project_ids = list(
+            student.timeslots.exclude(team_project=None).values_list(
+                "team_project_id", flat=True
+            )
+        )
+        student.timeslots.all().delete()
+        # Без таймслотов ученик выбывает и из команды
+        student.allocations.all().delete()
+        refresh_rosters(team_project_ids)
+        Participant.objects.filter(id=student.id).update(free_slots_mask=0)
 
 
 def save_time(user_id, time_keys):
-    clear_time(user_id)
-    time_delta = timedelta(minutes=CALL_TIME_MINUTES - 1)
-    for key in time_keys:
-        start_time = datetime.datetime.strptime(key, "%H:%M")
-        fin_time = start_time + time_delta
-        make_timeslots(start_time, fin_time, user_id)
+    """Сохраняет выбранное время (ключи "ЧЧ:ММ" в поясе ученика) в сетке
+    UTC. Пустой выбор — отказ от участия, иначе меняются только свободные
+    слоты, команда ученика остается."""
+    if not time_keys:
+        clear_time(user_id)
+        return
+    student = Participant.objects.get(tg_id=user_id)
+    set_free_timeslots(
+        student,
+        [to_utc_time(key, student.utc_offset) for key in time_keys],
+    )
 
 
+@instrumented("bot.finer")
 def finer(update: Update, context: CallbackContext):
     update.callback_query.answer()
     user_id = update.callback_query.from_user.id
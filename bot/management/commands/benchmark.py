@@ -0,0 +1,395 @@
+import json
+import random
+import re
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bot.models import (
+    AllocationBatch,
+    Cohort,
+    Participant,
+    Project,
+    RosterSnapshot,
+    TeamProject,
+    TimeSlot,
+)
+from bot.utils.allocation_utils import ALLOCATION_ENGINES, BULK_BATCH_SIZE, make_teams
+from bot.utils.timeslots_utils import (
+    CALL_TIME_MINUTES,
+    STUDENTS_LEVELS,
+    cancel_distribution,
+    get_teams,
+    get_unallocated_students,
+    refresh_free_slots_masks,
+)
+
+DAY_START = time(8, 0)
+DAY_END = time(22, 0)
+# доли уровней учеников в порядке STUDENTS_LEVELS
+LEVEL_WEIGHTS = (0.4, 0.35, 0.25)
+FAR_EAST_SHARE = 0.1
+PROJECTS_COUNT = 5
+
+# Имена индексов в планах SQLite (EXPLAIN QUERY PLAN) и PostgreSQL (EXPLAIN)
+PLAN_INDEX_RE = re.compile(
+    r"(?:USING (?:COVERING )?INDEX|Index (?:Only )?Scan using|Bitmap Index Scan on)"
+    r" (\w+)"
+)
+PLAN_FULL_SCAN_RE = re.compile(r"(?:\bSCAN (\w+)$|Seq Scan on (\w+))")
+# Индекс, под который построен каждый горячий запрос. Имена заданы
+# в моделях явно, поэтому совпадают на SQLite и PostgreSQL
+EXPECTED_INDEXES = {
+    "free_timeslots_of_cohort": "unique_free_timeslot",
+    "free_student_timeslots": "unique_free_timeslot",
+    "free_pm_timeslots_at_times": "participant_role_level_idx",
+    "free_pm_timeslots": "unique_free_timeslot",
+    "unallocated_students": "allocation_date_start_idx",
+    "team_timeslots": "timeslot_team_idx",
+    "batch_team_timeslots": "timeslot_team_idx",
+}
+# Большие таблицы, которые горячие запросы не должны просматривать целиком
+NO_FULL_SCAN_TABLES = ("bot_timeslot", "bot_participant")
+# На меньших потоках полный просмотр дешевле индекса, и PostgreSQL
+# выбирает его законно, поэтому планы проверяются с этого размера
+PLAN_CHECK_MIN_STUDENTS = 1000
+
+
+def _day_timestamps():
+    timestamps = []
+    current = datetime.combine(date.today(), DAY_START)
+    day_end = datetime.combine(date.today(), DAY_END)
+    while current <= day_end:
+        timestamps.append(current.time())
+        current += timedelta(minutes=CALL_TIME_MINUTES)
+    return timestamps
+
+
+def _slots_range(rnd, timestamps, min_count, max_count, peak):
+    """Непрерывный диапазон слотов, как при выборе времени в боте,
+    с началом около peak."""
+    count = rnd.randint(min_count, max_count)
+    center = min(max(int(rnd.gauss(peak, len(timestamps) / 6)), 0), len(timestamps))
+    start = min(max(center - count // 2, 0), len(timestamps) - count)
+    return timestamps[start : start + count]
+
+
+def generate_cohort(students_count, pm_count, seed):
+    """Воспроизводимый синтетический поток: ученики выбирают 1-4 слота
+    подряд, чаще вечером (ученики с ДВ — раньше), менеджеры — 3-8 часов
+    подряд в течение дня. Поток начинается через неделю, чтобы команды
+    считались актуальными."""
+    rnd = random.Random(seed)
+    timestamps = _day_timestamps()
+    date_start = date.today() + timedelta(days=7)
+    cohort = Cohort.objects.create(
+        name=f"benchmark-{seed}",
+        date_start=date_start,
+        date_end=date_start + timedelta(days=7),
+    )
+    Project.objects.bulk_create(
+        [Project(name=f"Проект {number}") for number in range(PROJECTS_COUNT)]
+    )
+
+    participants = []
+    for number in range(students_count):
+        is_far_east = rnd.random() < FAR_EAST_SHARE
+        participants.append(
+            Participant(
+                name=f"Ученик {number}",
+                tg_username=f"student_{number}",
+                role=Participant.STUDENT,
+                level=rnd.choices(STUDENTS_LEVELS, LEVEL_WEIGHTS)[0],
+                is_far_east=is_far_east,
+                utc_offset=Participant.default_utc_offset(is_far_east),
+                cohort=cohort,
+            )
+        )
+    for number in range(pm_count):
+        participants.append(
+            Participant(
+                name=f"ПМ {number}",
+                tg_username=f"pm_{number}",
+                role=Participant.PRODUCT_MANAGER,
+                cohort=cohort,
+            )
+        )
+    participants = Participant.objects.bulk_create(
+        participants, batch_size=BULK_BATCH_SIZE
+    )
+
+    evening = len(timestamps) * 3 // 4
+    morning = len(timestamps) // 4
+    timeslots = []
+    for participant in participants:
+        if participant.role == Participant.PRODUCT_MANAGER:
+            time_slots = _slots_range(rnd, timestamps, 6, 16, len(timestamps) // 2)
+        elif participant.is_far_east:
+            time_slots = _slots_range(rnd, timestamps, 1, 4, morning)
+        else:
+            time_slots = _slots_range(rnd, timestamps, 1, 4, evening)
+        for time_slot in time_slots:
+            timeslots.append(TimeSlot(participant=participant, time_slot=time_slot))
+    TimeSlot.objects.bulk_create(timeslots, batch_size=BULK_BATCH_SIZE)
+    refresh_free_slots_masks([participant.id for participant in participants])
+    return len(timeslots)
+
+
+def clear_data():
+    """Удаляет все данные бота."""
+    TeamProject.objects.all().delete()
+    AllocationBatch.objects.all().delete()
+    Participant.objects.all().delete()
+    Project.objects.all().delete()
+    Cohort.objects.all().delete()
+
+
+class QueriesCounter:
+    """Обертка выполнения запросов, считающая их число. В отличие от
+    connection.queries не ограничена 9000 последними запросами."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, trace_memory=False):
+    """Выполняет func и возвращает (результат, замеры): время и число
+    запросов или, если trace_memory, пиковую память Python. tracemalloc
+    сильно замедляет код, поэтому память замеряется отдельным прогоном."""
+    if trace_memory:
+        tracemalloc.start()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, {"peak_memory_kb": peak // 1024}
+
+    counter = QueriesCounter()
+    with connection.execute_wrapper(counter):
+        started_at = perf_counter()
+        result = func()
+        seconds = perf_counter() - started_at
+    return result, {"seconds": round(seconds, 4), "queries": counter.count}
+
+
+def _read_teams():
+    """Команды так, как их читает рассылка: менеджер и ученики каждой."""
+    return [(team.pm, team.students) for team in get_teams(datetime.now())]
+
+
+def _hot_querysets():
+    """Запросы распределения и чтения команд в том виде, в каком их
+    строят allocation_utils, availability_utils и roster_utils."""
+    unallocated_students = get_unallocated_students()
+    times = set(
+        TimeSlot.objects.filter(
+            team_project=None,
+            participant__in=unallocated_students,
+        ).values_list("time_slot", flat=True)
+    )
+    team_project_ids = list(
+        RosterSnapshot.objects.values_list("team_project_id", flat=True)[:100]
+    )
+    batch = AllocationBatch.objects.order_by("-id").first()
+    return {
+        "free_timeslots_of_cohort": TimeSlot.objects.filter(
+            team_project=None,
+            participant__cohort=Cohort.objects.first(),
+        ).order_by("id"),
+        "free_student_timeslots": TimeSlot.objects.filter(
+            team_project=None,
+            participant__in=unallocated_students,
+        ).order_by("id"),
+        "free_pm_timeslots_at_times": TimeSlot.objects.filter(
+            team_project=None,
+            participant__role=Participant.PRODUCT_MANAGER,
+            time_slot__in=times,
+        ).order_by("id"),
+        "free_pm_timeslots": TimeSlot.objects.filter(
+            team_project=None,
+            participant__role=Participant.PRODUCT_MANAGER,
+        ).order_by("id"),
+        "unallocated_students": unallocated_students,
+        "team_timeslots": TimeSlot.objects.filter(
+            team_project_id__in=team_project_ids
+        ).order_by("team_project_id", "id"),
+        "batch_team_timeslots": TimeSlot.objects.filter(team_project__batch=batch),
+    }
+
+
+def explain_queries():
+    """Планы горячих запросов: использованные индексы, полные просмотры
+    таблиц и нарушения (problems) — полный просмотр NO_FULL_SCAN_TABLES
+    или отсутствие индекса из EXPECTED_INDEXES. На PostgreSQL перед этим
+    собирается статистика, иначе планировщик не знает размеров свежих
+    таблиц."""
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    plans = {}
+    for name, queryset in _hot_querysets().items():
+        plan = queryset.explain().splitlines()
+        full_scans = []
+        for line in plan:
+            match = PLAN_FULL_SCAN_RE.search(line.strip())
+            if match:
+                full_scans.append(match.group(1) or match.group(2))
+        indexes = sorted(set(PLAN_INDEX_RE.findall("\n".join(plan))))
+        problems = [
+            f"полный просмотр {table}"
+            for table in full_scans
+            if table in NO_FULL_SCAN_TABLES
+        ]
+        if EXPECTED_INDEXES[name] not in indexes:
+            problems.append(f"не использован индекс {EXPECTED_INDEXES[name]}")
+        plans[name] = {
+            "indexes": indexes,
+            "full_scans": full_scans,
+            "problems": problems,
+            "plan": plan,
+        }
+    return plans
+
+
+def plan_problems(scenario):
+    """Нарушения в планах запросов сценария в виде строк отчета."""
+    if scenario["students"] < PLAN_CHECK_MIN_STUDENTS:
+        return []
+    return [
+        f"{scenario['students']} учеников, {engine}, {name}: {problem}"
+        for engine, results in scenario["engines"].items()
+        for name, plan in results["query_plans"].items()
+        for problem in plan["problems"]
+    ]
+
+
+def _run_steps(engine, trace_memory):
+    """Распределение движком engine, чтение команд и нераспределенных
+    учеников, затем отмена распределения."""
+    results = {}
+    _, results["make_teams"] = measure(lambda: make_teams(engine), trace_memory)
+    results["make_teams"]["teams"] = TeamProject.objects.filter(
+        batch__cancelled_at=None
+    ).count()
+    if not trace_memory:
+        results["query_plans"] = explain_queries()
+
+    teams, results["get_teams"] = measure(_read_teams, trace_memory)
+    results["get_teams"]["teams"] = len(teams)
+
+    students, results["get_unallocated_students"] = measure(
+        lambda: list(get_unallocated_students()), trace_memory
+    )
+    results["get_unallocated_students"]["students"] = len(students)
+
+    _, results["cancel_distribution"] = measure(
+        lambda: cancel_distribution(datetime.now()), trace_memory
+    )
+    return results
+
+
+def run_scenario(engines):
+    """Замеры для данных в БД по каждому движку: прогон на время и число
+    запросов и прогон на память."""
+    results = {}
+    for engine in engines:
+        results[engine] = _run_steps(engine, trace_memory=False)
+        for step, memory in _run_steps(engine, trace_memory=True).items():
+            results[engine][step].update(memory)
+    return results
+
+
+class Command(BaseCommand):
+    """Бенчмарк распределения и запросов команд на синтетических данных."""
+
+    help = (
+        "Генерирует синтетические потоки заданных размеров и замеряет "
+        "make_teams, get_teams, get_unallocated_students и cancel_distribution, "
+        "а также проверяет по EXPLAIN, что горячие запросы идут по индексам: "
+        "при нарушении команда завершается ошибкой после записи отчета. "
+        "Запускать на пустой базе: после замеров все данные бота удаляются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--students",
+            nargs="+",
+            type=int,
+            default=[100, 1000, 10000],
+            help="Размеры потоков (число учеников)",
+        )
+        parser.add_argument(
+            "-p",
+            "--pms",
+            nargs="+",
+            type=int,
+            help="Число менеджеров для каждого размера, "
+            "по умолчанию ученики / 33 в пределах 10-300",
+        )
+        parser.add_argument(
+            "-e",
+            "--engines",
+            nargs="+",
+            choices=list(ALLOCATION_ENGINES),
+            default=["greedy", "flow"],
+            help="Сравниваемые алгоритмы распределения",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("-o", "--output", help="Файл для JSON отчета")
+
+    def handle(self, *args, **options):
+        sizes = options["students"]
+        pm_counts = options["pms"] or [
+            min(max(students_count // 33, 10), 300) for students_count in sizes
+        ]
+        if len(pm_counts) != len(sizes):
+            raise CommandError("Число значений --pms должно совпадать с --students.")
+        if Participant.objects.exists() or Project.objects.exists():
+            raise CommandError(
+                "База не пуста. Бенчмарк удаляет все данные бота, "
+                "запустите его на отдельной базе."
+            )
+
+        report = {
+            "database": connection.vendor,
+            "seed": options["seed"],
+            "scenarios": [],
+        }
+        try:
+            for students_count, pm_count in zip(sizes, pm_counts):
+                slots_count = generate_cohort(students_count, pm_count, options["seed"])
+                report["scenarios"].append(
+                    {
+                        "students": students_count,
+                        "pms": pm_count,
+                        "timeslots": slots_count,
+                        "engines": run_scenario(options["engines"]),
+                    }
+                )
+                clear_data()
+        finally:
+            clear_data()
+
+        report_json = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(report_json)
+        self.stdout.write(report_json)
+
+        problems = [
+            problem
+            for scenario in report["scenarios"]
+            for problem in plan_problems(scenario)
+        ]
+        if problems:
+            raise CommandError(
+                "Горячие запросы идут не по индексам:\n" + "\n".join(problems)
+            )
@@ -17,10 +17,20 @@ from telegram.utils.request import Request
 
 import bot.management.commands._pm_conversation as pc
 import bot.management.commands._student_conversation as sc
-from bot.models import Participant
+from bot.models import Participant, RosterSnapshot
+from bot.utils.instrumentation_utils import instrumented
+from bot.utils.message_utils import MessageTemplate
+from bot.utils.timeslots_utils import to_local_key
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
+STUDENT_PROJECT_TEMPLATE = MessageTemplate(
+    "На неделе с *{start_date} - {end_date}* вы участвуете в проекте\n"
+    "Ваш ПМ: *{pm}*\n"
+    "Проект: *{project_name}*\n"
+    "Созвон в: *{call_time}*"
+)
+
 request = Request(connect_timeout=0.5, read_timeout=1.0)
 bot = Bot(
     request=request,
@@ -45,15 +55,7 @@ def keyboard_row_divider(full_list, row_width=2):
         yield full_list[i : i + row_width]
 
 
-def escape_characters(text: str) -> str:
-    """Screen characters for Markdown V2"""
-    text = text.replace("\\", "")
-    characters = [".", "+", "(", ")", "-", "!", "=", "_"]
-    for character in characters:
-        text = text.replace(character, f"\{character}")
-    return text
-
-
+@instrumented("bot.start")
 def start(update: Update, context: CallbackContext):
     user = update.message.from_user
     update.message.reply_text(
@@ -106,33 +108,37 @@ def send_first_step_pm(update: Update, context: CallbackContext) -> States:
 
 
 def student_project(user_id):
-    try:
-        student = Participant.objects.get(tg_id=user_id)
-        student.timeslots.filter(
-            team_project__isnull=False,
-            team_project__date_start__gte=datetime.now(),
-        ).first()
-    except Participant.DoesNotExist:
-        return None
+    """Снимок состава актуальной команды ученика или None. Снимок
+    находится по Participant.roster: поиск по уникальному tg_id и одно
+    соединение по первичному ключу."""
+    return RosterSnapshot.objects.filter(
+        members__tg_id=user_id,
+        date_start__gte=datetime.now(),
+    ).first()
 
 
 def send_first_step_student(update: Update, context: CallbackContext) -> States:
     user = update.message.from_user
-    slot = student_project(user.id)
-    if slot:
-        project_name = slot.team_project.project.name
-        call_time = slot.time_slot.strftime("%H:%M")
-        pm = slot.product_manager
-        start_date = slot.team_project.date_start.strftime("%d.%m.%Y")
-        fin_date = slot.team_project.date_end.strftime("%d.%m.%Y")
-        text = (
-            f"На неделе с *{start_date} - {fin_date}* вы участвуете в проекте\n"
-            f"Ваш ПМ: *{pm}*\n"
-            f"Проект: *{project_name}*\n"
-            f"Созвон в: *{call_time}*"
+    roster = student_project(user.id)
+    if roster:
+        utc_offset = next(
+            (
+                student.get("utc_offset", Participant.MOSCOW_UTC_OFFSET)
+                for student in roster.students
+                if student["tg_id"] == user.id
+            ),
+            Participant.MOSCOW_UTC_OFFSET,
+        )
+        call_time = to_local_key(roster.time_slot, utc_offset)
+        text = STUDENT_PROJECT_TEMPLATE.render(
+            start_date=roster.date_start.strftime("%d.%m.%Y"),
+            end_date=roster.date_end.strftime("%d.%m.%Y"),
+            pm=f"{roster.pm_name} (@{roster.pm_tg_username})",
+            project_name=roster.project_name,
+            call_time=call_time,
         )
         update.message.reply_text(
-            text=escape_characters(text),
+            text=text,
             parse_mode=ParseMode.MARKDOWN_V2,
         )
         return ConversationHandler.END
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bot.models import CallMetric
+from bot.utils.instrumentation_utils import PERCENTILES, summarize_metrics
+
+
+class Command(BaseCommand):
+    """Процентили замеров обработчиков бота и действий админки."""
+
+    help = (
+        "Выводит по каждому обработчику число вызовов, медленных и "
+        "завершившихся ошибкой, а также процентили времени, числа запросов "
+        "и времени запросов. Замеры пишутся при INSTRUMENTATION=true."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            help="Только замеры за последние часы, по умолчанию все",
+        )
+        parser.add_argument(
+            "-n",
+            "--name",
+            nargs="+",
+            help="Только указанные обработчики",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Удалить выбранные замеры после вывода",
+        )
+
+    def handle(self, *args, **options):
+        metrics = CallMetric.objects.all()
+        if options["hours"] is not None:
+            since = timezone.now() - timedelta(hours=options["hours"])
+            metrics = metrics.filter(created_at__gte=since)
+        if options["name"]:
+            metrics = metrics.filter(name__in=options["name"])
+
+        summary = summarize_metrics(metrics)
+        if not summary:
+            self.stdout.write("Замеров нет.")
+            return
+
+        percents = "/".join(f"p{percent}" for percent in PERCENTILES)
+        self.stdout.write(
+            f"{'Обработчик':<36} {'вызовов':>8} {'медл.':>6} {'ошиб.':>6}  "
+            f"мс ({percents})  запросов ({percents})  мс SQL ({percents})"
+        )
+        for name, stats in summary.items():
+            seconds = "/".join(
+                f"{stats['seconds'][percent] * 1000:.0f}" for percent in PERCENTILES
+            )
+            queries = "/".join(
+                str(stats["queries"][percent]) for percent in PERCENTILES
+            )
+            sql_seconds = "/".join(
+                f"{stats['sql_seconds'][percent] * 1000:.0f}" for percent in PERCENTILES
+            )
+            self.stdout.write(
+                f"{name:<36} {stats['calls']:>8} {stats['slow']:>6} "
+                f"{stats['failed']:>6}  {seconds}  {queries}  {sql_seconds}"
+            )
+
+        if options["clear"]:
+            deleted, _ = metrics.delete()
+            self.stdout.write(f"Удалено замеров: {deleted}.")
@@ -1,4 +1,3 @@
-import datetime
 import json
 import logging
 
@@ -6,7 +5,8 @@ from django.core.management.base import BaseCommand
 from pydantic import BaseModel
 from pydantic.error_wrappers import ValidationError
 
-from bot.models import ProductManager, Student, TimeSlot
+from bot.models import Participant, TimeSlot
+from bot.utils.timeslots_utils import refresh_free_slots_masks, to_utc_time
 
 logging.basicConfig(
     level=logging.INFO,
@@ -41,18 +41,20 @@ def save_student(student: dict):
     """Save one student to DB"""
     student = StudentModel.parse_obj(student)
     if student.level == "novice":
-        student.level = Student.BEGINNER
+        student.level = Participant.BEGINNER
     elif student.level == "novice+":
-        student.level = Student.BEGINNER_PLUS
+        student.level = Participant.BEGINNER_PLUS
     else:
-        student.level = Student.JUNIOR
+        student.level = Participant.JUNIOR
 
-    new_student = Student(
+    new_student = Participant(
+        role=Participant.STUDENT,
         tg_username=student.tg_username,
         name=student.name,
         level=student.level,
         discord_username=student.discord_username,
         is_far_east=student.is_far_east,
+        utc_offset=Participant.default_utc_offset(student.is_far_east),
     )
     new_student.save()
 
@@ -61,34 +63,41 @@ def save_manager(pm: dict):
     """Save one student to DB"""
     manager = ManagerModel.parse_obj(pm)
 
-    new_manager = ProductManager(name=manager.name, tg_username=manager.tg_username)
+    new_manager = Participant(
+        role=Participant.PRODUCT_MANAGER,
+        name=manager.name,
+        tg_username=manager.tg_username,
+    )
     new_manager.save()
 
 
+def save_timeslot(participant, local_key):
+    """Save free timeslot given in participant's local time, in UTC grid"""
+    timeslot = TimeSlot.objects.get_or_create(
+        time_slot=to_utc_time(local_key, participant.utc_offset),
+        participant=participant,
+        team_project=None,
+    )
+    refresh_free_slots_masks([participant.id])
+    return timeslot
+
+
 def save_manager_timeslot(pm_slot: dict):
     """Save timeslot for manager in DB"""
     slot = ManagerTimeSlotModel.parse_obj(pm_slot)
-    manager = ProductManager.objects.get(tg_username=slot.tg_username)
-    start_time = datetime.datetime.strptime(slot.timeslot, "%H:%M")
-    return TimeSlot.objects.get_or_create(
-        time_slot=start_time,
-        student=None,
-        product_manager=manager,
-        team_project=None,
+    manager = Participant.objects.get(
+        role=Participant.PRODUCT_MANAGER, tg_username=slot.tg_username
     )
+    return save_timeslot(manager, slot.timeslot)
 
 
 def save_student_timeslot(student_slot: dict):
     """Save timeslot for student in DB"""
     slot = StudentTimeSlotModel.parse_obj(student_slot)
-    student = Student.objects.get(tg_username=slot.tg_username)
-    start_time = datetime.datetime.strptime(slot.timeslot, "%H:%M")
-    return TimeSlot.objects.get_or_create(
-        time_slot=start_time,
-        student=student,
-        product_manager=None,
-        team_project=None,
+    student = Participant.objects.get(
+        role=Participant.STUDENT, tg_username=slot.tg_username
     )
+    return save_timeslot(student, slot.timeslot)
 
 
 def load_json(json_path: str, save_func: callable):
@@ -101,7 +110,7 @@ def load_json(json_path: str, save_func: callable):
             save_func(elem)
         except ValidationError:
             err_cnt += 1
-        except ProductManager.DoesNotExist:
+        except Participant.DoesNotExist:
             err_cnt += 1
 
     if err_cnt > 0:
@@ -0,0 +1,44 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from bot.utils.job_utils import claim_job, fail_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    """Воркер задач админки."""
+
+    help = (
+        "Выполняет поставленные из админки распределения и оповещения "
+        "по одной в порядке постановки и записывает их ход в Job."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить очередь и завершиться, а не ждать новых задач",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Пауза в секундах между проверками пустой очереди",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            failed = fail_stale_jobs()
+            if failed:
+                self.stdout.write(f"Завершено зависших задач: {failed}.")
+
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    break
+                sleep(options["interval"])
+                continue
+
+            self.stdout.write(f"Задача {job}: начата.")
+            job = run_job(job)
+            self.stdout.write(f"Задача {job}: {job.percent}%.")
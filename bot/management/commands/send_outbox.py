@@ -0,0 +1,72 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+from telegram import ParseMode
+
+from bot.models import OutboxMessage
+from bot.utils.dispatch_utils import Dispatcher, delivery_summary
+from bot.utils.notification_utils import bot
+from bot.utils.outbox_utils import (
+    OUTBOX_BATCH_SIZE,
+    claim_messages,
+    deliver_messages,
+    release_stale_messages,
+)
+
+
+class Command(BaseCommand):
+    """Воркер очереди оповещений."""
+
+    help = (
+        "Отправляет оповещения из очереди OutboxMessage пачками и отмечает "
+        "каждое отправленным или недоставленным. После падения продолжает "
+        "с неотправленных."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help="Сообщений в пачке",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Отправить очередь и завершиться, а не ждать новых сообщений",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Пауза в секундах между проверками пустой очереди",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Поставить недоставленные сообщения в очередь заново",
+        )
+
+    def handle(self, *args, **options):
+        if options["retry_failed"]:
+            retried = OutboxMessage.objects.filter(status=OutboxMessage.FAILED).update(
+                status=OutboxMessage.PENDING, error=""
+            )
+            self.stdout.write(f"Поставлено заново: {retried}.")
+
+        dispatcher = Dispatcher(bot, parse_mode=ParseMode.MARKDOWN_V2)
+        while True:
+            released = release_stale_messages()
+            if released:
+                self.stdout.write(f"Возвращено в очередь зависших: {released}.")
+
+            messages = claim_messages(options["batch_size"])
+            if not messages:
+                if options["once"]:
+                    break
+                sleep(options["interval"])
+                continue
+
+            deliveries = deliver_messages(messages, dispatcher)
+            self.stdout.write(f"Оповещения: {delivery_summary(deliveries)}.")
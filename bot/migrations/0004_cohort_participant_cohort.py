@@ -0,0 +1,32 @@
+# Generated by Django 4.0.1 on 2026-10-18 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_alter_participant_options_alter_project_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cohort',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, verbose_name='Название потока')),
+                ('date_start', models.DateField(verbose_name='Дата начала проекта')),
+                ('date_end', models.DateField(verbose_name='Дата окончания проекта')),
+            ],
+            options={
+                'verbose_name': 'Поток',
+                'verbose_name_plural': 'Потоки',
+            },
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='cohort',
+            field=models.ForeignKey(blank=True, help_text='без потока участник распределяется на даты по умолчанию', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='participants', to='bot.cohort', verbose_name='Поток'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.0.1 on 2026-10-18 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_rosters(apps, schema_editor):
+    """Снимки составов для команд, распределенных до появления модели."""
+    TimeSlot = apps.get_model('bot', 'TimeSlot')
+    RosterSnapshot = apps.get_model('bot', 'RosterSnapshot')
+
+    rosters = {}
+    students = {}
+    timeslots = (
+        TimeSlot.objects.filter(team_project__isnull=False)
+        .select_related('participant', 'team_project__project')
+        .order_by('team_project_id', 'id')
+    )
+    for timeslot in timeslots:
+        participant = timeslot.participant
+        if participant.role != 'PM':
+            students.setdefault(timeslot.team_project_id, []).append({
+                'id': participant.id,
+                'name': participant.name,
+                'tg_id': participant.tg_id,
+                'tg_username': participant.tg_username,
+                'level': participant.level,
+            })
+            continue
+        if timeslot.team_project_id in rosters:
+            continue
+        team_project = timeslot.team_project
+        rosters[timeslot.team_project_id] = RosterSnapshot(
+            team_project=team_project,
+            project_name=team_project.project.name if team_project.project else '',
+            date_start=team_project.date_start,
+            date_end=team_project.date_end,
+            time_slot=timeslot.time_slot,
+            pm=participant,
+            pm_name=participant.name,
+            pm_tg_id=participant.tg_id,
+            pm_tg_username=participant.tg_username,
+        )
+
+    for team_project_id, roster in rosters.items():
+        roster.students = students.get(team_project_id, [])
+    RosterSnapshot.objects.bulk_create(rosters.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_cohort_participant_cohort'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RosterSnapshot',
+            fields=[
+                ('team_project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='roster', serialize=False, to='bot.teamproject', verbose_name='Проект команды')),
+                ('project_name', models.CharField(blank=True, max_length=256, verbose_name='Название проекта')),
+                ('date_start', models.DateTimeField(verbose_name='Дата и время начала проекта')),
+                ('date_end', models.DateTimeField(verbose_name='Дата и время окончания проекта')),
+                ('time_slot', models.TimeField(verbose_name='Время начала созвона')),
+                ('pm_name', models.CharField(max_length=32, verbose_name='Имя ПМа')),
+                ('pm_tg_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='Telegram id ПМа')),
+                ('pm_tg_username', models.CharField(max_length=32, verbose_name='Ник ПМа в Telegram')),
+                ('students', models.JSONField(default=list, help_text='id, name, tg_id, tg_username и level каждого ученика', verbose_name='Ученики')),
+                ('pm', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rosters', to='bot.participant', verbose_name='ПМ')),
+            ],
+            options={
+                'verbose_name': 'Состав команды',
+                'verbose_name_plural': 'Составы команд',
+            },
+        ),
+        migrations.RunPython(fill_rosters, migrations.RunPython.noop),
+    ]
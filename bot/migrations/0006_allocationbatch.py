@@ -0,0 +1,42 @@
+# Generated by Django 4.0.1 on 2026-10-18 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_rostersnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('engine', models.CharField(max_length=32, verbose_name='Алгоритм распределения')),
+                ('date_start', models.DateTimeField(verbose_name='Дата и время начала проекта')),
+                ('date_end', models.DateTimeField(verbose_name='Дата и время окончания проекта')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время распределения')),
+                ('cancelled_at', models.DateTimeField(blank=True, null=True, verbose_name='Время отката')),
+                ('stats', models.JSONField(default=dict, verbose_name='Статистика')),
+                ('plan', models.JSONField(default=dict, verbose_name='План распределения')),
+                ('cohort', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batches', to='bot.cohort', verbose_name='Поток')),
+            ],
+            options={
+                'verbose_name': 'Запуск распределения',
+                'verbose_name_plural': 'Запуски распределения',
+            },
+        ),
+        migrations.AddField(
+            model_name='teamproject',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='teamprojects', to='bot.allocationbatch', verbose_name='Запуск распределения'),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='timeslots', to='bot.allocationbatch', verbose_name='Запуск распределения'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.0.1 on 2026-10-18 08:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_statuses(apps, schema_editor):
+    """Статусы для учеников, распределенных до появления модели: по одному
+    на ученика и поток, по самой поздней команде."""
+    TimeSlot = apps.get_model('bot', 'TimeSlot')
+    AllocationStatus = apps.get_model('bot', 'AllocationStatus')
+
+    statuses = {}
+    timeslots = (
+        TimeSlot.objects.filter(team_project__isnull=False, participant__role='ST')
+        .order_by('team_project__date_start', 'id')
+        .values_list(
+            'participant_id',
+            'participant__cohort_id',
+            'team_project_id',
+            'batch_id',
+            'team_project__batch_id',
+            'team_project__date_start',
+        )
+    )
+    for (
+        participant_id,
+        cohort_id,
+        team_project_id,
+        batch_id,
+        team_batch_id,
+        date_start,
+    ) in timeslots:
+        statuses[(participant_id, cohort_id)] = AllocationStatus(
+            participant_id=participant_id,
+            cohort_id=cohort_id,
+            team_project_id=team_project_id,
+            batch_id=batch_id or team_batch_id,
+            date_start=date_start,
+        )
+    AllocationStatus.objects.bulk_create(statuses.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_allocationbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_start', models.DateTimeField(verbose_name='Дата и время начала проекта')),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='bot.allocationbatch', verbose_name='Запуск распределения')),
+                ('cohort', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='bot.cohort', verbose_name='Поток')),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='bot.participant', verbose_name='Участник')),
+                ('team_project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='bot.teamproject', verbose_name='Проект команды')),
+            ],
+            options={
+                'verbose_name': 'Распределение участника',
+                'verbose_name_plural': 'Распределения участников',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='allocationstatus',
+            index=models.Index(fields=['date_start', 'participant'], name='allocation_date_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='allocationstatus',
+            constraint=models.UniqueConstraint(fields=('participant', 'cohort'), name='unique_allocation_per_cohort'),
+        ),
+        migrations.AddConstraint(
+            model_name='allocationstatus',
+            constraint=models.UniqueConstraint(condition=models.Q(('cohort', None)), fields=('participant',), name='unique_allocation_without_cohort'),
+        ),
+        migrations.RunPython(fill_statuses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+import django.db.models.deletion
+
+
+def remove_duplicate_timeslots(apps, schema_editor):
+    """Оставляет по одному слоту на участника, время и команду: раньше
+    get_or_create не защищал от повторной записи при гонке."""
+    TimeSlot = apps.get_model('bot', 'TimeSlot')
+
+    duplicates = (
+        TimeSlot.objects.values('participant_id', 'time_slot', 'team_project_id')
+        .annotate(first_id=Min('id'), slots_count=Count('id'))
+        .filter(slots_count__gt=1)
+    )
+    for duplicate in duplicates:
+        TimeSlot.objects.filter(
+            participant_id=duplicate['participant_id'],
+            time_slot=duplicate['time_slot'],
+            team_project_id=duplicate['team_project_id'],
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_allocationstatus'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_timeslots, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='participant',
+            name='cohort',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='без потока участник распределяется на даты по умолчанию', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='participants', to='bot.cohort', verbose_name='Поток'),
+        ),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='participant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeslots', to='bot.participant', verbose_name='Участник'),
+        ),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='team_project',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='timeslots', to='bot.teamproject', verbose_name='Проект команды'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['cohort', 'role', 'level'], name='participant_cohort_role_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['role', 'level'], name='participant_role_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('team_project__isnull', False)), fields=['team_project', 'participant'], name='timeslot_team_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('participant', 'time_slot', 'team_project'), name='unique_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('team_project', None)), fields=('participant', 'time_slot'), name='unique_free_timeslot'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:07
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_masks(apps, schema_editor):
+    """Маски по свободным слотам, записанным до появления поля. Слоты
+    идут через 30 минут (CALL_TIME_MINUTES)."""
+    Participant = apps.get_model('bot', 'Participant')
+    TimeSlot = apps.get_model('bot', 'TimeSlot')
+
+    masks = defaultdict(int)
+    free_timeslots = TimeSlot.objects.filter(team_project=None).values_list(
+        'participant_id', 'time_slot'
+    )
+    for participant_id, time_slot in free_timeslots:
+        masks[participant_id] |= 1 << (time_slot.hour * 60 + time_slot.minute) // 30
+    Participant.objects.bulk_update(
+        [
+            Participant(id=participant_id, free_slots_mask=mask)
+            for participant_id, mask in masks.items()
+        ],
+        ['free_slots_mask'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_timeslot_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='free_slots_mask',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='бит i — свободный слот в i-е получасие дня, пересчитывается по слотам времени', verbose_name='Маска свободных слотов'),
+        ),
+        migrations.RunPython(fill_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_participant_free_slots_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(verbose_name='Начало')),
+                ('end', models.DateTimeField(verbose_name='Окончание')),
+                ('participant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='intervals', to='bot.participant', verbose_name='Участник')),
+            ],
+            options={
+                'verbose_name': 'Период доступности',
+                'verbose_name_plural': 'Периоды доступности',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='availabilityinterval',
+            index=models.Index(fields=['participant', 'start'], name='interval_participant_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='availabilityinterval',
+            constraint=models.CheckConstraint(check=models.Q(('end__gt', django.db.models.expressions.F('start'))), name='interval_end_after_start'),
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:17
+
+from datetime import date, datetime, timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+MOSCOW_UTC_OFFSET = 3
+
+
+def _to_utc(time_slot):
+    moment = datetime.combine(date(2000, 1, 1), time_slot)
+    return (moment - timedelta(hours=MOSCOW_UTC_OFFSET)).time()
+
+
+def shift_to_utc(apps, schema_editor):
+    """Слоты, периоды и снимки записаны в московском времени, переводятся
+    в сетку UTC. Маски свободных слотов сдвигаются циклически на то же
+    число получасий (CALL_TIME_MINUTES = 30, 48 слотов в сутках)."""
+    Participant = apps.get_model('bot', 'Participant')
+    TimeSlot = apps.get_model('bot', 'TimeSlot')
+    RosterSnapshot = apps.get_model('bot', 'RosterSnapshot')
+    AvailabilityInterval = apps.get_model('bot', 'AvailabilityInterval')
+
+    timeslots = list(TimeSlot.objects.only('id', 'time_slot'))
+    for timeslot in timeslots:
+        timeslot.time_slot = _to_utc(timeslot.time_slot)
+    TimeSlot.objects.bulk_update(timeslots, ['time_slot'], batch_size=500)
+
+    rosters = list(RosterSnapshot.objects.only('team_project_id', 'time_slot'))
+    for roster in rosters:
+        roster.time_slot = _to_utc(roster.time_slot)
+    RosterSnapshot.objects.bulk_update(rosters, ['time_slot'], batch_size=500)
+
+    AvailabilityInterval.objects.update(
+        start=F('start') - timedelta(hours=MOSCOW_UTC_OFFSET),
+        end=F('end') - timedelta(hours=MOSCOW_UTC_OFFSET),
+    )
+
+    shift = MOSCOW_UTC_OFFSET * 2
+    all_slots_mask = (1 << 48) - 1
+    participants = list(
+        Participant.objects.exclude(free_slots_mask=0).only('id', 'free_slots_mask')
+    )
+    for participant in participants:
+        mask = participant.free_slots_mask
+        participant.free_slots_mask = (mask >> shift | mask << 48 - shift) & all_slots_mask
+    Participant.objects.bulk_update(participants, ['free_slots_mask'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_availabilityinterval'),
+    ]
+
+    operations = [
+        # Сдвиг слотов участника временно нарушает уникальность времени
+        migrations.RemoveConstraint(
+            model_name='timeslot',
+            name='unique_free_timeslot',
+        ),
+        migrations.RemoveConstraint(
+            model_name='timeslot',
+            name='unique_timeslot',
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='utc_offset',
+            field=models.SmallIntegerField(default=3, help_text='смещение местного времени от UTC в часах', verbose_name='Часовой пояс (UTC+)'),
+        ),
+        migrations.AddField(
+            model_name='rostersnapshot',
+            name='pm_utc_offset',
+            field=models.SmallIntegerField(default=3, verbose_name='Часовой пояс ПМа (UTC+)'),
+        ),
+        migrations.AlterField(
+            model_name='rostersnapshot',
+            name='students',
+            field=models.JSONField(default=list, help_text='id, name, tg_id, tg_username, level и utc_offset каждого ученика', verbose_name='Ученики'),
+        ),
+        migrations.AlterField(
+            model_name='rostersnapshot',
+            name='time_slot',
+            field=models.TimeField(verbose_name='Время начала созвона (UTC)'),
+        ),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='time_slot',
+            field=models.TimeField(verbose_name='Время начала созвона (UTC)'),
+        ),
+        migrations.AddConstraint(
+            model_name='participant',
+            constraint=models.CheckConstraint(check=models.Q(('utc_offset__gte', -12), ('utc_offset__lte', 14)), name='participant_utc_offset_range'),
+        ),
+        migrations.RunPython(shift_to_utc, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('participant', 'time_slot', 'team_project'), name='unique_timeslot'),
+        ),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('team_project', None)), fields=('participant', 'time_slot'), name='unique_free_timeslot'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_utc_slot_grid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, verbose_name='Обработчик')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время вызова')),
+                ('seconds', models.FloatField(verbose_name='Длительность, с')),
+                ('queries', models.PositiveIntegerField(verbose_name='Запросов к БД')),
+                ('sql_seconds', models.FloatField(verbose_name='Время запросов к БД, с')),
+                ('failed', models.BooleanField(default=False, verbose_name='Завершился ошибкой')),
+            ],
+            options={
+                'verbose_name': 'Замер вызова',
+                'verbose_name_plural': 'Замеры вызовов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='callmetric',
+            index=models.Index(fields=['name', 'created_at'], name='callmetric_name_created_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_callmetric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.PositiveBigIntegerField(verbose_name='Telegram id получателя')),
+                ('template', models.CharField(choices=[('team_pm', 'Состав команды ПМу'), ('team_student', 'Состав команды ученику'), ('free_student', 'Свободное время нераспределенному ученику')], max_length=16, verbose_name='Шаблон')),
+                ('text', models.TextField(help_text='экранирован для Markdown V2', verbose_name='Текст')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Не доставлено')], default='pending', max_length=8, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Поставлено в очередь')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='Взято на отправку')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+                ('team_project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='outbox_messages', to='bot.teamproject', verbose_name='Проект команды')),
+            ],
+            options={
+                'verbose_name': 'Оповещение',
+                'verbose_name_plural': 'Очередь оповещений',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'id'], name='outbox_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='outboxmessage',
+            constraint=models.UniqueConstraint(fields=('chat_id', 'team_project', 'template'), name='unique_outbox_message'),
+        ),
+        migrations.AddConstraint(
+            model_name='outboxmessage',
+            constraint=models.UniqueConstraint(condition=models.Q(('team_project', None)), fields=('chat_id', 'template'), name='unique_outbox_message_without_team'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('distribute', 'Распределение учеников'), ('apply_distribution', 'Применение предпросмотренного распределения'), ('distribute_late', 'Распределение новых учеников'), ('cancel_distribution', 'Отмена распределения'), ('notify_teams', 'Оповещение команд'), ('notify_free_students', 'Оповещение нераспределенных учеников')], max_length=32, verbose_name='Действие')),
+                ('lock', models.CharField(max_length=32, verbose_name='Замок')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Завершилась ошибкой')], default='pending', max_length=8, verbose_name='Статус')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('done', models.PositiveIntegerField(default=0, verbose_name='Выполнено шагов')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Всего шагов')),
+                ('counts', models.JSONField(blank=True, default=dict, verbose_name='Счетчики')),
+                ('messages', models.JSONField(blank=True, default=list, verbose_name='Сообщения')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Поставлена')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний шаг')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'Задача',
+                'verbose_name_plural': 'Задачи админки',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'id'], name='job_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('lock',), name='unique_active_job_lock'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+MOSCOW_UTC_OFFSET = 3
+FAR_EAST_UTC_OFFSET = 10
+
+
+def set_far_east_offset(apps, schema_editor):
+    """Участникам с ДВ, оставшимся в московском поясе, ставится пояс ДВ,
+    в снимках составов их пояс обновляется так же. Слоты уже в UTC
+    и не сдвигаются: меняется только время, которое видит участник."""
+    Participant = apps.get_model('bot', 'Participant')
+    RosterSnapshot = apps.get_model('bot', 'RosterSnapshot')
+
+    far_east = Participant.objects.filter(
+        is_far_east=True, utc_offset=MOSCOW_UTC_OFFSET
+    )
+    far_east_ids = set(far_east.values_list('id', flat=True))
+    if not far_east_ids:
+        return
+    far_east.update(utc_offset=FAR_EAST_UTC_OFFSET)
+
+    RosterSnapshot.objects.filter(pm_id__in=far_east_ids).update(
+        pm_utc_offset=FAR_EAST_UTC_OFFSET
+    )
+    rosters = []
+    for roster in RosterSnapshot.objects.only('team_project_id', 'students'):
+        changed = False
+        for student in roster.students:
+            if student['id'] in far_east_ids:
+                student['utc_offset'] = FAR_EAST_UTC_OFFSET
+                changed = True
+        if changed:
+            rosters.append(roster)
+    RosterSnapshot.objects.bulk_update(rosters, ['students'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_far_east_offset, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0015_far_east_utc_offset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='claim_token',
+            field=models.UUIDField(blank=True, editable=False, help_text='отличает пачку одного отправителя от пачек других', null=True, verbose_name='Метка отправителя'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_participant_rosters(apps, schema_editor):
+    """Ученикам ставится снимок их команды. Если команд несколько,
+    остается самая поздняя: прошедшие бот все равно не показывает."""
+    Participant = apps.get_model('bot', 'Participant')
+    RosterSnapshot = apps.get_model('bot', 'RosterSnapshot')
+
+    roster_of = {}
+    rosters = RosterSnapshot.objects.order_by('date_start').only(
+        'team_project_id', 'students'
+    )
+    for roster in rosters:
+        for student in roster.students:
+            roster_of[student['id']] = roster.team_project_id
+    participants = [
+        Participant(id=participant_id, roster_id=team_project_id)
+        for participant_id, team_project_id in roster_of.items()
+    ]
+    Participant.objects.bulk_update(participants, ['roster'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0016_outboxmessage_claim_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='roster',
+            field=models.ForeignKey(blank=True, editable=False, help_text='ставится при записи состава команды ученика', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='bot.rostersnapshot', verbose_name='Состав актуальной команды'),
+        ),
+        migrations.RunPython(fill_participant_rosters, migrations.RunPython.noop),
+    ]
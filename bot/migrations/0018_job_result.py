@@ -0,0 +1,23 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0017_participant_roster'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='result',
+            field=models.JSONField(blank=True, default=dict, help_text='например, планы предпросмотра для применения', verbose_name='Результат'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='action',
+            field=models.CharField(choices=[('distribute', 'Распределение учеников'), ('preview_distribution', 'Предпросмотр распределения'), ('apply_distribution', 'Применение предпросмотренного распределения'), ('distribute_late', 'Распределение новых учеников'), ('cancel_distribution', 'Отмена распределения'), ('notify_teams', 'Оповещение команд'), ('notify_free_students', 'Оповещение нераспределенных учеников')], max_length=32, verbose_name='Действие'),
+        ),
+    ]
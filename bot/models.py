@@ -1,6 +1,37 @@
 from django.db import models
 
 
+class Cohort(models.Model):
+    """Поток: проектная неделя со своими участниками и датами проекта."""
+
+    name = models.CharField(
+        verbose_name="Название потока",
+        max_length=64,
+        blank=False,
+        null=False,
+    )
+    date_start = models.DateField(
+        verbose_name="Дата начала проекта",
+        blank=False,
+        null=False,
+    )
+    date_end = models.DateField(
+        verbose_name="Дата окончания проекта",
+        blank=False,
+        null=False,
+    )
+
+    def __str__(self):
+        return (
+            f"{self.name} / {self.date_start.strftime('%d.%m.%Y')}"
+            f" - {self.date_end.strftime('%d.%m.%Y')}"
+        )
+
+    class Meta:
+        verbose_name = "Поток"
+        verbose_name_plural = "Потоки"
+
+
 class Participant(models.Model):
     """Участник проекта."""
 
@@ -23,6 +54,12 @@ class Participant(models.Model):
         (JUNIOR, "Джуниор"),
         (NOT_AVAIBLE, "Не применимо"),
     )
+
+    # Слоты хранятся в сетке UTC, участникам показываются в их поясе
+    MOSCOW_UTC_OFFSET = 3
+    # Пояс участников с ДВ (is_far_east), Владивосток
+    FAR_EAST_UTC_OFFSET = 10
+
     name = models.CharField(
         verbose_name="Имя (и фамилия)",
         max_length=32,
@@ -68,6 +105,44 @@ class Participant(models.Model):
         blank=True,
         null=True,
     )
+    cohort = models.ForeignKey(
+        verbose_name="Поток",
+        related_name="participants",
+        to="Cohort",
+        help_text="без потока участник распределяется на даты по умолчанию",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        # индекс дает participant_cohort_role_idx
+        db_index=False,
+    )
+    utc_offset = models.SmallIntegerField(
+        verbose_name="Часовой пояс (UTC+)",
+        help_text="смещение местного времени от UTC в часах",
+        default=MOSCOW_UTC_OFFSET,
+    )
+    free_slots_mask = models.PositiveBigIntegerField(
+        verbose_name="Маска свободных слотов",
+        help_text="бит i — свободный слот в i-е получасие дня, "
+        "пересчитывается по слотам времени",
+        default=0,
+        editable=False,
+    )
+    roster = models.ForeignKey(
+        verbose_name="Состав актуальной команды",
+        related_name="members",
+        to="RosterSnapshot",
+        help_text="ставится при записи состава команды ученика",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        editable=False,
+    )
+
+    @classmethod
+    def default_utc_offset(cls, is_far_east):
+        """Пояс участника, если он не задан явно: по признаку «Из ДВ?»."""
+        return cls.FAR_EAST_UTC_OFFSET if is_far_east else cls.MOSCOW_UTC_OFFSET
 
     def __str__(self):
         levels = dict(self.STUDENT_LEVEL_CHOICES)
@@ -78,13 +153,28 @@ class Participant(models.Model):
     class Meta:
         verbose_name = "Участник проекта"
         verbose_name_plural = "Участники проектов"
+        indexes = [
+            # Выборки учеников и менеджеров потока при распределении
+            models.Index(
+                fields=["cohort", "role", "level"],
+                name="participant_cohort_role_idx",
+            ),
+            # Фильтры participant__role и participant__level без потока
+            models.Index(fields=["role", "level"], name="participant_role_level_idx"),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(utc_offset__gte=-12, utc_offset__lte=14),
+                name="participant_utc_offset_range",
+            ),
+        ]
 
 
 class TimeSlot(models.Model):
     """Слот времени. Время, участник и проект задают уникальность."""
 
     time_slot = models.TimeField(
-        verbose_name="Время начала созвона",
+        verbose_name="Время начала созвона (UTC)",
         blank=False,
         null=False,
     )
@@ -95,6 +185,8 @@ class TimeSlot(models.Model):
         blank=False,
         null=False,
         on_delete=models.CASCADE,
+        # индекс дает ограничение unique_timeslot
+        db_index=False,
     )
     team_project = models.ForeignKey(
         verbose_name="Проект команды",
@@ -103,6 +195,16 @@ class TimeSlot(models.Model):
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
+        # см. timeslot_team_idx
+        db_index=False,
+    )
+    batch = models.ForeignKey(
+        verbose_name="Запуск распределения",
+        related_name="timeslots",
+        to="AllocationBatch",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
     )
 
     def __str__(self):
@@ -115,7 +217,28 @@ class TimeSlot(models.Model):
     class Meta:
         verbose_name = "Слот времени"
         verbose_name_plural = "Слоты времени"
-        # TODO: добавить ограничения
+        constraints = [
+            models.UniqueConstraint(
+                fields=["participant", "time_slot", "team_project"],
+                name="unique_timeslot",
+            ),
+            # NULL не равен NULL, поэтому свободные слоты ограничиваются отдельно
+            models.UniqueConstraint(
+                fields=["participant", "time_slot"],
+                condition=models.Q(team_project=None),
+                name="unique_free_timeslot",
+            ),
+        ]
+        indexes = [
+            # Вместо обычного индекса внешнего ключа: по нему SQLite искал
+            # свободные слоты (team_project IS NULL), а это большая часть
+            # таблицы. Свободные слоты ищутся по участнику через ограничения
+            models.Index(
+                fields=["team_project", "participant"],
+                condition=models.Q(team_project__isnull=False),
+                name="timeslot_team_idx",
+            ),
+        ]
 
 
 class Project(models.Model):
@@ -146,6 +269,65 @@ class Project(models.Model):
         verbose_name_plural = "Типовые проекты"
 
 
+class AllocationBatch(models.Model):
+    """Запуск распределения: записанный план и его статистика.
+    Откат запуска отвязывает его слоты, но сам запуск и его команды
+    остаются в истории."""
+
+    engine = models.CharField(
+        verbose_name="Алгоритм распределения",
+        max_length=32,
+        blank=False,
+        null=False,
+    )
+    cohort = models.ForeignKey(
+        verbose_name="Поток",
+        related_name="batches",
+        to="Cohort",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+    )
+    date_start = models.DateTimeField(
+        verbose_name="Дата и время начала проекта",
+        blank=False,
+        null=False,
+    )
+    date_end = models.DateTimeField(
+        verbose_name="Дата и время окончания проекта",
+        blank=False,
+        null=False,
+    )
+    created_at = models.DateTimeField(
+        verbose_name="Время распределения",
+        auto_now_add=True,
+    )
+    cancelled_at = models.DateTimeField(
+        verbose_name="Время отката",
+        blank=True,
+        null=True,
+    )
+    stats = models.JSONField(
+        verbose_name="Статистика",
+        default=dict,
+    )
+    plan = models.JSONField(
+        verbose_name="План распределения",
+        default=dict,
+    )
+
+    def __str__(self):
+        status = "отменен" if self.cancelled_at else "действует"
+        return (
+            f"id{self.id} / {self.engine} / "
+            f"{self.created_at.strftime('%d.%m.%Y %H:%M')} / {status}"
+        )
+
+    class Meta:
+        verbose_name = "Запуск распределения"
+        verbose_name_plural = "Запуски распределения"
+
+
 class TeamProject(models.Model):
     """Конкретный проект конкретной команды
     с необходимой организационной информацией."""
@@ -178,6 +360,14 @@ class TeamProject(models.Model):
         blank=True,
         null=True,
     )
+    batch = models.ForeignKey(
+        verbose_name="Запуск распределения",
+        related_name="teamprojects",
+        to="AllocationBatch",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+    )
 
     def __str__(self):
         return (
@@ -232,3 +422,500 @@ class Constraint(models.Model):
     class Meta:
         verbose_name = "Ограничение на пары"
         verbose_name_plural = "Ограничения на пары"
+
+
+class RosterSnapshot(models.Model):
+    """Денормализованный состав команды для чтения одной строкой.
+    Записывается при распределении и удаляется вместе с командой."""
+
+    team_project = models.OneToOneField(
+        verbose_name="Проект команды",
+        related_name="roster",
+        to="TeamProject",
+        primary_key=True,
+        on_delete=models.CASCADE,
+    )
+    project_name = models.CharField(
+        verbose_name="Название проекта",
+        max_length=256,
+        blank=True,
+        null=False,
+    )
+    date_start = models.DateTimeField(
+        verbose_name="Дата и время начала проекта",
+        blank=False,
+        null=False,
+    )
+    date_end = models.DateTimeField(
+        verbose_name="Дата и время окончания проекта",
+        blank=False,
+        null=False,
+    )
+    time_slot = models.TimeField(
+        verbose_name="Время начала созвона (UTC)",
+        blank=False,
+        null=False,
+    )
+    pm = models.ForeignKey(
+        verbose_name="ПМ",
+        related_name="rosters",
+        to="Participant",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+    )
+    pm_name = models.CharField(
+        verbose_name="Имя ПМа",
+        max_length=32,
+        blank=False,
+        null=False,
+    )
+    pm_tg_id = models.PositiveIntegerField(
+        verbose_name="Telegram id ПМа",
+        blank=True,
+        null=True,
+    )
+    pm_tg_username = models.CharField(
+        verbose_name="Ник ПМа в Telegram",
+        max_length=32,
+        blank=False,
+        null=False,
+    )
+    pm_utc_offset = models.SmallIntegerField(
+        verbose_name="Часовой пояс ПМа (UTC+)",
+        default=Participant.MOSCOW_UTC_OFFSET,
+    )
+    students = models.JSONField(
+        verbose_name="Ученики",
+        help_text="id, name, tg_id, tg_username, level и utc_offset каждого ученика",
+        default=list,
+    )
+
+    def __str__(self):
+        return (
+            f"{self.project_name} / {self.time_slot.strftime('%H:%M')}"
+            f" / {self.pm_name}: {len(self.students)} уч."
+        )
+
+    class Meta:
+        verbose_name = "Состав команды"
+        verbose_name_plural = "Составы команд"
+
+
+class AllocationStatus(models.Model):
+    """Актуальное распределение ученика в потоке. Ведется распределением
+    и его отменой, чтобы нераспределенных учеников искать по индексу,
+    а не через таймслоты. Уникальность не дает распределить ученика
+    в потоке дважды, даже при одновременных запусках."""
+
+    participant = models.ForeignKey(
+        verbose_name="Участник",
+        related_name="allocations",
+        to="Participant",
+        on_delete=models.CASCADE,
+    )
+    cohort = models.ForeignKey(
+        verbose_name="Поток",
+        related_name="allocations",
+        to="Cohort",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+    team_project = models.ForeignKey(
+        verbose_name="Проект команды",
+        related_name="allocations",
+        to="TeamProject",
+        on_delete=models.CASCADE,
+    )
+    batch = models.ForeignKey(
+        verbose_name="Запуск распределения",
+        related_name="allocations",
+        to="AllocationBatch",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+    date_start = models.DateTimeField(
+        verbose_name="Дата и время начала проекта",
+        blank=False,
+        null=False,
+    )
+
+    def __str__(self):
+        return f"{self.participant} / {self.team_project}"
+
+    class Meta:
+        verbose_name = "Распределение участника"
+        verbose_name_plural = "Распределения участников"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["participant", "cohort"],
+                name="unique_allocation_per_cohort",
+            ),
+            # NULL в уникальных ограничениях не совпадает сам с собой
+            models.UniqueConstraint(
+                fields=["participant"],
+                condition=models.Q(cohort=None),
+                name="unique_allocation_without_cohort",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["date_start", "participant"],
+                name="allocation_date_start_idx",
+            ),
+        ]
+
+
+class AvailabilityInterval(models.Model):
+    """Период доступности участника [start, end). Периоды хранятся
+    так, как их задал участник, и могут пересекаться, переходить через
+    полночь и длиться несколько дней; объединяет их IntervalIndex."""
+
+    participant = models.ForeignKey(
+        verbose_name="Участник",
+        related_name="intervals",
+        to="Participant",
+        on_delete=models.CASCADE,
+        # индекс дает interval_participant_start_idx
+        db_index=False,
+    )
+    start = models.DateTimeField(
+        verbose_name="Начало",
+        blank=False,
+        null=False,
+    )
+    end = models.DateTimeField(
+        verbose_name="Окончание",
+        blank=False,
+        null=False,
+    )
+
+    def __str__(self):
+        return (
+            f"{self.participant} / {self.start.strftime('%d.%m.%Y %H:%M')}"
+            f" - {self.end.strftime('%d.%m.%Y %H:%M')}"
+        )
+
+    class Meta:
+        verbose_name = "Период доступности"
+        verbose_name_plural = "Периоды доступности"
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(end__gt=models.F("start")),
+                name="interval_end_after_start",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["participant", "start"],
+                name="interval_participant_start_idx",
+            ),
+        ]
+
+
+class CallMetric(models.Model):
+    """Замер одного вызова обработчика бота или действия админки.
+    Пишется, только если включено settings.INSTRUMENTATION."""
+
+    name = models.CharField(
+        verbose_name="Обработчик",
+        max_length=64,
+        blank=False,
+        null=False,
+    )
+    created_at = models.DateTimeField(
+        verbose_name="Время вызова",
+        auto_now_add=True,
+    )
+    seconds = models.FloatField(
+        verbose_name="Длительность, с",
+    )
+    queries = models.PositiveIntegerField(
+        verbose_name="Запросов к БД",
+    )
+    sql_seconds = models.FloatField(
+        verbose_name="Время запросов к БД, с",
+    )
+    failed = models.BooleanField(
+        verbose_name="Завершился ошибкой",
+        default=False,
+    )
+
+    def __str__(self):
+        return (
+            f"{self.name} / {self.created_at.strftime('%d.%m.%Y %H:%M')}"
+            f" / {self.seconds * 1000:.0f} мс, запросов {self.queries}"
+        )
+
+    class Meta:
+        verbose_name = "Замер вызова"
+        verbose_name_plural = "Замеры вызовов"
+        indexes = [
+            models.Index(
+                fields=["name", "created_at"],
+                name="callmetric_name_created_idx",
+            ),
+        ]
+
+
+class OutboxMessage(models.Model):
+    """Оповещение в очереди на отправку. Получатель, команда и шаблон
+    задают уникальность: повторное оповещение с тем же текстом не
+    отправляется, с измененным — отправляется заново."""
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (PENDING, "Ожидает отправки"),
+        (SENDING, "Отправляется"),
+        (SENT, "Отправлено"),
+        (FAILED, "Не доставлено"),
+    )
+
+    TEAM_PM = "team_pm"
+    TEAM_STUDENT = "team_student"
+    FREE_STUDENT = "free_student"
+
+    TEMPLATE_CHOICES = (
+        (TEAM_PM, "Состав команды ПМу"),
+        (TEAM_STUDENT, "Состав команды ученику"),
+        (FREE_STUDENT, "Свободное время нераспределенному ученику"),
+    )
+
+    chat_id = models.PositiveBigIntegerField(
+        verbose_name="Telegram id получателя",
+    )
+    team_project = models.ForeignKey(
+        verbose_name="Проект команды",
+        related_name="outbox_messages",
+        to="TeamProject",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+    template = models.CharField(
+        verbose_name="Шаблон",
+        max_length=16,
+        choices=TEMPLATE_CHOICES,
+    )
+    text = models.TextField(
+        verbose_name="Текст",
+        help_text="экранирован для Markdown V2",
+    )
+    status = models.CharField(
+        verbose_name="Статус",
+        max_length=8,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name="Попыток отправки",
+        default=0,
+    )
+    error = models.TextField(
+        verbose_name="Ошибка",
+        blank=True,
+        default="",
+    )
+    created_at = models.DateTimeField(
+        verbose_name="Поставлено в очередь",
+        auto_now_add=True,
+    )
+    claimed_at = models.DateTimeField(
+        verbose_name="Взято на отправку",
+        blank=True,
+        null=True,
+    )
+    claim_token = models.UUIDField(
+        verbose_name="Метка отправителя",
+        help_text="отличает пачку одного отправителя от пачек других",
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    sent_at = models.DateTimeField(
+        verbose_name="Отправлено",
+        blank=True,
+        null=True,
+    )
+
+    def __str__(self):
+        templates = dict(self.TEMPLATE_CHOICES)
+        statuses = dict(self.STATUS_CHOICES)
+        return f"{templates[self.template]} / {self.chat_id} / {statuses[self.status]}"
+
+    class Meta:
+        verbose_name = "Оповещение"
+        verbose_name_plural = "Очередь оповещений"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_id", "team_project", "template"],
+                name="unique_outbox_message",
+            ),
+            # NULL в team_project не участвует в уникальности
+            models.UniqueConstraint(
+                fields=["chat_id", "template"],
+                condition=models.Q(team_project=None),
+                name="unique_outbox_message_without_team",
+            ),
+        ]
+        indexes = [
+            # Выборка очереди отправки по статусу в порядке постановки
+            models.Index(fields=["status", "id"], name="outbox_status_idx"),
+        ]
+
+
+class Job(models.Model):
+    """Действие админки, которое выполняет воркер run_jobs вне запроса.
+    Действия с общим замком не выполняются одновременно: пока задача
+    ждет или выполняется, уникальность замка не дает поставить вторую."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (PENDING, "Ожидает"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Выполнена"),
+        (FAILED, "Завершилась ошибкой"),
+    )
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    DISTRIBUTE = "distribute"
+    PREVIEW_DISTRIBUTION = "preview_distribution"
+    APPLY_DISTRIBUTION = "apply_distribution"
+    DISTRIBUTE_LATE = "distribute_late"
+    CANCEL_DISTRIBUTION = "cancel_distribution"
+    NOTIFY_TEAMS = "notify_teams"
+    NOTIFY_FREE_STUDENTS = "notify_free_students"
+
+    ACTION_CHOICES = (
+        (DISTRIBUTE, "Распределение учеников"),
+        (PREVIEW_DISTRIBUTION, "Предпросмотр распределения"),
+        (APPLY_DISTRIBUTION, "Применение предпросмотренного распределения"),
+        (DISTRIBUTE_LATE, "Распределение новых учеников"),
+        (CANCEL_DISTRIBUTION, "Отмена распределения"),
+        (NOTIFY_TEAMS, "Оповещение команд"),
+        (NOTIFY_FREE_STUDENTS, "Оповещение нераспределенных учеников"),
+    )
+    # Распределение и его отмена меняют одни и те же слоты, поэтому
+    # делят замок, оповещения блокируют только повтор самих себя.
+    # Предпросмотр ничего не пишет, но план, построенный во время записи
+    # другого, сразу устарел бы
+    LOCKS = {
+        DISTRIBUTE: "distribution",
+        PREVIEW_DISTRIBUTION: "distribution",
+        APPLY_DISTRIBUTION: "distribution",
+        DISTRIBUTE_LATE: "distribution",
+        CANCEL_DISTRIBUTION: "distribution",
+        NOTIFY_TEAMS: NOTIFY_TEAMS,
+        NOTIFY_FREE_STUDENTS: NOTIFY_FREE_STUDENTS,
+    }
+
+    action = models.CharField(
+        verbose_name="Действие",
+        max_length=32,
+        choices=ACTION_CHOICES,
+    )
+    lock = models.CharField(
+        verbose_name="Замок",
+        max_length=32,
+    )
+    status = models.CharField(
+        verbose_name="Статус",
+        max_length=8,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+    )
+    payload = models.JSONField(
+        verbose_name="Параметры",
+        default=dict,
+        blank=True,
+    )
+    done = models.PositiveIntegerField(
+        verbose_name="Выполнено шагов",
+        default=0,
+    )
+    total = models.PositiveIntegerField(
+        verbose_name="Всего шагов",
+        default=0,
+    )
+    counts = models.JSONField(
+        verbose_name="Счетчики",
+        default=dict,
+        blank=True,
+    )
+    messages = models.JSONField(
+        verbose_name="Сообщения",
+        default=list,
+        blank=True,
+    )
+    errors = models.JSONField(
+        verbose_name="Ошибки",
+        default=list,
+        blank=True,
+    )
+    result = models.JSONField(
+        verbose_name="Результат",
+        help_text="например, планы предпросмотра для применения",
+        default=dict,
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        verbose_name="Поставлена",
+        auto_now_add=True,
+    )
+    started_at = models.DateTimeField(
+        verbose_name="Начата",
+        blank=True,
+        null=True,
+    )
+    heartbeat_at = models.DateTimeField(
+        verbose_name="Последний шаг",
+        blank=True,
+        null=True,
+    )
+    finished_at = models.DateTimeField(
+        verbose_name="Завершена",
+        blank=True,
+        null=True,
+    )
+
+    @property
+    def percent(self):
+        if self.status == self.DONE:
+            return 100
+        if not self.total:
+            return 0
+        return min(100, self.done * 100 // self.total)
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    def __str__(self):
+        actions = dict(self.ACTION_CHOICES)
+        statuses = dict(self.STATUS_CHOICES)
+        return f"#{self.id} {actions[self.action]} / {statuses[self.status]}"
+
+    class Meta:
+        verbose_name = "Задача"
+        verbose_name_plural = "Задачи админки"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lock"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="unique_active_job_lock",
+            ),
+        ]
+        indexes = [
+            # Выборка очереди воркером по статусу в порядке постановки
+            models.Index(fields=["status", "id"], name="job_status_idx"),
+        ]
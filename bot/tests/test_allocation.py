@@ -0,0 +1,166 @@
+import random
+from collections import Counter
+from datetime import time
+
+from django.test import SimpleTestCase
+
+from bot.models import Constraint
+from bot.utils.allocation_utils import (
+    AllocationSnapshot,
+    _max_teams_of_manager,
+    plan_greedy,
+    plan_max_flow,
+)
+from bot.utils.constraints_utils import ConstraintIndex
+from bot.utils.optimizer_utils import _TeamsState, optimize_teams
+from bot.utils.timeslots_utils import MAX_TEAM_MEMBERS, STUDENTS_LEVELS
+
+TIMES = [time(hour, minute) for hour in range(10, 14) for minute in (0, 30)]
+
+
+def make_snapshot(seed, students_count=90, pm_count=5, constraints=()):
+    """Случайный снимок в памяти: ученики выбирают 1-3 слота, менеджеры — 6."""
+    rnd = random.Random(seed)
+    slot_ids = iter(range(1, 10**6))
+    pm_ids = list(range(1, pm_count + 1))
+    student_ids = list(range(1000, 1000 + students_count))
+
+    pm_slots = {
+        pm_id: [(next(slot_ids), time_slot) for time_slot in rnd.sample(TIMES, 6)]
+        for pm_id in pm_ids
+    }
+    student_slots = {}
+    for student_id in student_ids:
+        level = rnd.choice(STUDENTS_LEVELS)
+        for time_slot in rnd.sample(TIMES, rnd.randint(1, 3)):
+            bucket = student_slots.setdefault((time_slot, level), {})
+            bucket[student_id] = next(slot_ids)
+
+    return AllocationSnapshot(
+        students_count=students_count,
+        pm_count=pm_count,
+        pm_ids=pm_ids,
+        pm_slots=pm_slots,
+        student_slots=student_slots,
+        unallocated=set(student_ids),
+        project_ids=[1, 2],
+        constraints=ConstraintIndex(constraints),
+    )
+
+
+class PlannerInvariantsMixin:
+    """Инварианты команд, общие для движков распределения."""
+
+    def plan(self, snapshot):
+        raise NotImplementedError
+
+    def assert_valid_teams(self, snapshot, teams, constraints=()):
+        pm_slot_times = {
+            slot_id: (pm_id, time_slot)
+            for pm_id, slots in snapshot.pm_slots.items()
+            for slot_id, time_slot in slots
+        }
+        placed = Counter()
+        used_slots = Counter()
+        pm_teams = Counter()
+        team_of = {}
+        for team in teams:
+            self.assertEqual(len(team.student_ids), MAX_TEAM_MEMBERS)
+            self.assertEqual(len(team.student_slot_ids), len(team.student_ids))
+            self.assertEqual(
+                pm_slot_times[team.pm_slot_id], (team.pm_id, team.time_slot)
+            )
+            bucket = snapshot.student_slots[(team.time_slot, team.level)]
+            for student_id, slot_id in zip(team.student_ids, team.student_slot_ids):
+                self.assertIn(student_id, snapshot.unallocated)
+                self.assertEqual(bucket[student_id], slot_id)
+                team_of[student_id] = team
+            placed.update(team.student_ids)
+            used_slots.update([team.pm_slot_id, *team.student_slot_ids])
+            pm_teams[team.pm_id] += 1
+
+        # Никто не распределен дважды и ни один слот не занят дважды
+        self.assertEqual([], [key for key, count in placed.items() if count > 1])
+        self.assertEqual([], [key for key, count in used_slots.items() if count > 1])
+        self.assertLessEqual(
+            max(pm_teams.values(), default=0), _max_teams_of_manager(snapshot)
+        )
+
+        for first_id, second_id, constraint_type in constraints:
+            first_team = team_of.get(first_id)
+            second_team = team_of.get(second_id)
+            if constraint_type == Constraint.SEPARATELY:
+                if first_team is not None:
+                    self.assertIsNot(first_team, second_team)
+                    self.assertNotEqual(first_team.pm_id, second_id)
+            elif constraint_type == Constraint.TOGHEDER:
+                self.assertIs(first_team, second_team)
+
+    def test_teams_are_valid(self):
+        for seed in range(5):
+            snapshot = make_snapshot(seed)
+            with self.subTest(seed=seed):
+                teams = self.plan(snapshot)
+                self.assertTrue(teams)
+                self.assert_valid_teams(snapshot, teams)
+
+    def test_constraints_are_honored(self):
+        for seed in range(5):
+            snapshot = make_snapshot(seed)
+            rnd = random.Random(seed)
+            students = sorted(snapshot.unallocated)
+            constraints = [
+                (*rnd.sample(students, 2), Constraint.SEPARATELY) for _ in range(30)
+            ]
+            constraints += [
+                (*rnd.sample(students, 2), Constraint.TOGHEDER) for _ in range(10)
+            ]
+            # Ученик, которому нельзя к первому менеджеру
+            constraints.append((students[0], 1, Constraint.SEPARATELY))
+            snapshot.constraints = ConstraintIndex(constraints)
+            with self.subTest(seed=seed):
+                self.assert_valid_teams(snapshot, self.plan(snapshot), constraints)
+
+    def test_nothing_to_plan(self):
+        snapshot = make_snapshot(0, students_count=2)
+        self.assertEqual([], self.plan(snapshot))
+
+
+class GreedyPlannerTests(PlannerInvariantsMixin, SimpleTestCase):
+    def plan(self, snapshot):
+        return plan_greedy(snapshot)
+
+
+class MaxFlowPlannerTests(PlannerInvariantsMixin, SimpleTestCase):
+    def plan(self, snapshot):
+        return plan_max_flow(snapshot)
+
+    def test_places_at_least_as_many_as_greedy(self):
+        for seed in range(5):
+            snapshot = make_snapshot(seed)
+            with self.subTest(seed=seed):
+                self.assertGreaterEqual(
+                    len(plan_max_flow(snapshot)), len(plan_greedy(snapshot))
+                )
+
+
+class OptimizeTeamsTests(SimpleTestCase):
+    def test_applies_best_state(self):
+        for seed in range(3):
+            snapshot = make_snapshot(seed)
+            snapshot.far_east = set(sorted(snapshot.unallocated)[::3])
+            teams = plan_greedy(snapshot)
+            max_teams = _max_teams_of_manager(snapshot)
+            placed = [student_id for team in teams for student_id in team.student_ids]
+            with self.subTest(seed=seed):
+                stats = optimize_teams(snapshot, teams, max_teams, 0.2, seed=seed)
+                self.assertLessEqual(stats["final_cost"], stats["initial_cost"])
+                # Итоговая оценка — это оценка примененных команд
+                state = _TeamsState(snapshot, teams, max_teams)
+                self.assertEqual(stats["final_cost"], state.total_cost())
+                # Состав меняется, но число размещенных и их уникальность — нет
+                placed_after = [
+                    student_id for team in teams for student_id in team.student_ids
+                ]
+                self.assertEqual(len(placed), len(placed_after))
+                self.assertEqual(len(placed_after), len(set(placed_after)))
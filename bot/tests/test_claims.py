@@ -0,0 +1,168 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from bot.models import Job, OutboxMessage
+from bot.utils import job_utils, outbox_utils
+from bot.utils.allocation_utils import AllocationPlan
+from bot.utils.dispatch_utils import Delivery
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, messages):
+        self.sent.extend(chat_id for chat_id, _ in messages)
+        return [
+            Delivery(chat_id=chat_id, delivered=True, attempts=1)
+            for chat_id, _ in messages
+        ]
+
+
+class OutboxClaimTests(TestCase):
+    def setUp(self):
+        outbox_utils.enqueue_messages(
+            [
+                (chat_id, None, OutboxMessage.FREE_STUDENT, f"текст {chat_id}")
+                for chat_id in range(1, 11)
+            ]
+        )
+
+    def test_concurrent_claims_do_not_overlap(self):
+        """Второй отправитель выбирает те же строки между выборкой
+        и обновлением первого, как на SQLite или при гонке."""
+        now = timezone.now
+        racing = {}
+
+        def claim_in_between():
+            if "claimed" not in racing:
+                racing["claimed"] = []
+                with mock.patch.object(outbox_utils.timezone, "now", now):
+                    racing["claimed"] = outbox_utils.claim_messages(5)
+            return now()
+
+        with mock.patch.object(outbox_utils.timezone, "now", claim_in_between):
+            first = outbox_utils.claim_messages(5)
+        second = racing["claimed"]
+
+        self.assertEqual(5, len(first) + len(second))
+        self.assertFalse(
+            {message.id for message in first} & {message.id for message in second}
+        )
+
+    def test_every_message_is_sent_once(self):
+        dispatcher = FakeDispatcher()
+        while True:
+            messages = outbox_utils.claim_messages(3)
+            if not messages:
+                break
+            outbox_utils.deliver_messages(messages, dispatcher)
+
+        self.assertEqual(sorted(dispatcher.sent), list(range(1, 11)))
+        self.assertEqual(
+            10, OutboxMessage.objects.filter(status=OutboxMessage.SENT).count()
+        )
+
+    def test_stale_claim_is_not_overwritten(self):
+        """Пачка упавшего отправителя возвращается в очередь, и его
+        поздний итог не затирает отправку другим."""
+        stale = outbox_utils.claim_messages(10)
+        OutboxMessage.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(10, outbox_utils.release_stale_messages())
+        fresh = outbox_utils.claim_messages(10)
+        outbox_utils.deliver_messages(fresh, FakeDispatcher())
+
+        class FailingDispatcher:
+            def send(self, messages):
+                return [
+                    Delivery(chat_id=chat_id, error="ошибка") for chat_id, _ in messages
+                ]
+
+        outbox_utils.deliver_messages(stale, FailingDispatcher())
+        self.assertEqual(
+            10, OutboxMessage.objects.filter(status=OutboxMessage.SENT).count()
+        )
+
+
+class JobClaimTests(TestCase):
+    def test_lock_prevents_duplicate_jobs(self):
+        job = job_utils.enqueue_job(Job.DISTRIBUTE)
+        with self.assertRaises(job_utils.JobAlreadyActive) as raised:
+            job_utils.enqueue_job(Job.CANCEL_DISTRIBUTION)
+        self.assertEqual(job.id, raised.exception.job.id)
+        # Оповещения держат свой замок
+        job_utils.enqueue_job(Job.NOTIFY_TEAMS)
+
+    def test_job_is_claimed_once(self):
+        job_utils.enqueue_job(Job.DISTRIBUTE)
+        job = job_utils.claim_job()
+        self.assertEqual(Job.RUNNING, job.status)
+        self.assertIsNone(job_utils.claim_job())
+
+    def test_finished_job_releases_lock(self):
+        job_utils.enqueue_job(Job.NOTIFY_TEAMS)
+        job = job_utils.claim_job()
+        handlers = {Job.NOTIFY_TEAMS: lambda job: job.messages.append("готово")}
+        with mock.patch.dict(job_utils.JOB_HANDLERS, handlers):
+            job_utils.run_job(job)
+
+        self.assertEqual(Job.DONE, Job.objects.get(id=job.id).status)
+        job_utils.enqueue_job(Job.NOTIFY_TEAMS)
+
+    def test_job_failed_by_another_worker_stops(self):
+        job_utils.enqueue_job(Job.DISTRIBUTE)
+        job = job_utils.claim_job()
+        continued = []
+
+        def handler(job):
+            job_utils.save_progress(job, total=2)
+            Job.objects.filter(id=job.id).update(
+                heartbeat_at=timezone.now() - job_utils.STALE_JOB_TIMEOUT * 2
+            )
+            self.assertEqual(1, job_utils.fail_stale_jobs())
+            # Замок свободен, задачу можно поставить заново
+            job_utils.enqueue_job(Job.DISTRIBUTE)
+            job_utils.save_progress(job, done=1)
+            continued.append(job)
+
+        with mock.patch.dict(job_utils.JOB_HANDLERS, {Job.DISTRIBUTE: handler}):
+            job_utils.run_job(job)
+
+        self.assertEqual([], continued)
+        self.assertEqual(Job.FAILED, Job.objects.get(id=job.id).status)
+
+    def test_final_write_keeps_failed_status(self):
+        job_utils.enqueue_job(Job.NOTIFY_TEAMS)
+        job = job_utils.claim_job()
+
+        def handler(job):
+            Job.objects.filter(id=job.id).update(status=Job.FAILED)
+            job.messages.append("готово")
+
+        with mock.patch.dict(job_utils.JOB_HANDLERS, {Job.NOTIFY_TEAMS: handler}):
+            job_utils.run_job(job)
+
+        self.assertEqual(Job.FAILED, Job.objects.get(id=job.id).status)
+
+    def test_apply_commits_plans_of_preview_job(self):
+        plan = AllocationPlan(engine="greedy", teams=[], unallocated=[1, 2])
+        job_utils.enqueue_job(Job.PREVIEW_DISTRIBUTION)
+        with mock.patch.object(
+            job_utils, "check_distribution", return_value=None
+        ), mock.patch.object(
+            job_utils, "plan_cohorts_distribution", return_value=[plan]
+        ):
+            preview_job = job_utils.run_job(job_utils.claim_job())
+        self.assertEqual(Job.DONE, preview_job.status)
+
+        job_utils.enqueue_job(
+            Job.APPLY_DISTRIBUTION, {"preview_job_id": preview_job.id}
+        )
+        with mock.patch.object(
+            job_utils, "commit_distribution", return_value=[]
+        ) as commit, mock.patch.object(job_utils, "_notify"):
+            job_utils.run_job(job_utils.claim_job())
+        self.assertEqual([plan], [call.args[0] for call in commit.call_args_list])
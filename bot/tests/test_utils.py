@@ -0,0 +1,86 @@
+import random
+from datetime import datetime, timedelta, timezone
+from threading import Thread
+from time import monotonic
+
+from django.test import SimpleTestCase
+
+from bot.utils.dispatch_utils import TokenBucket
+from bot.utils.interval_utils import (
+    IntervalIndex,
+    interval_times,
+    mask_intervals,
+    merge_intervals,
+)
+from bot.utils.timeslots_utils import ALL_SLOTS_MASK, SLOTS_PER_DAY, mask_to_times
+
+START = datetime(2022, 1, 30, tzinfo=timezone.utc)
+
+
+class IntervalIndexTests(SimpleTestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        self.intervals = []
+        for participant_id in range(40):
+            for _ in range(rnd.randint(1, 4)):
+                start = START + timedelta(minutes=30 * rnd.randint(0, 96))
+                end = start + timedelta(minutes=30 * rnd.randint(1, 12))
+                self.intervals.append((start, end, participant_id))
+        self.index = IntervalIndex(self.intervals)
+
+    def test_at_matches_brute_force(self):
+        for minutes in range(0, 60 * 60, 15):
+            moment = START + timedelta(minutes=minutes)
+            expected = {
+                participant_id
+                for start, end, participant_id in self.intervals
+                if start <= moment < end
+            }
+            with self.subTest(moment=moment):
+                self.assertEqual(expected, set(self.index.at(moment)))
+
+    def test_adjacent_periods_are_merged(self):
+        hour = timedelta(hours=1)
+        self.assertEqual(
+            [(START, START + 3 * hour)],
+            merge_intervals([(START + hour, START + 3 * hour), (START, START + hour)]),
+        )
+
+
+class MaskIntervalsTests(SimpleTestCase):
+    def test_round_trip_through_interval_times(self):
+        rnd = random.Random(1)
+        masks = [0, 1, ALL_SLOTS_MASK, ALL_SLOTS_MASK ^ 1, 1 | 1 << SLOTS_PER_DAY - 1]
+        masks += [rnd.getrandbits(SLOTS_PER_DAY) for _ in range(50)]
+        for mask in masks:
+            with self.subTest(mask=mask):
+                self.assertEqual(
+                    set(mask_to_times(mask)), interval_times(mask_intervals(mask))
+                )
+
+    def test_slots_across_midnight_are_one_interval(self):
+        self.assertEqual(1, len(mask_intervals(1 | 1 << SLOTS_PER_DAY - 1)))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_no_burst_after_pause(self):
+        bucket = TokenBucket(rate=50)
+        stamps = []
+
+        def worker():
+            for _ in range(5):
+                bucket.acquire()
+                stamps.append(monotonic())
+
+        threads = [Thread(target=worker) for _ in range(4)]
+        bucket.pause(0.2)
+        paused_at = monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stamps.sort()
+        self.assertGreaterEqual(stamps[0] - paused_at, 0.19)
+        # 20 токенов по 50 в секунду после паузы — не быстрее 0.38 секунды
+        self.assertGreaterEqual(stamps[-1] - stamps[0], 0.35)
@@ -0,0 +1,1098 @@
+import logging
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from datetime import datetime, time, timedelta
+from itertools import repeat
+from multiprocessing import Pool, TimeoutError
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count
+
+from bot.models import (
+    AllocationBatch,
+    AllocationStatus,
+    Cohort,
+    Participant,
+    Project,
+    TeamProject,
+    TimeSlot,
+)
+from bot.utils.availability_utils import AvailabilityIndex
+from bot.utils.constraints_utils import ConstraintIndex, load_constraints
+from bot.utils.flow_utils import FlowNetwork
+from bot.utils.optimizer_utils import optimize_teams
+from bot.utils.roster_utils import refresh_rosters
+from bot.utils.timeslots_utils import (
+    MAX_TEAM_MEMBERS,
+    PROJECTS_END_DATE,
+    PROJECTS_START_DATE,
+    STUDENTS_LEVELS,
+    get_unallocated_students,
+    update_free_slots_masks,
+)
+
+BULK_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class StalePlanError(Exception):
+    """План распределения расходится с текущим состоянием БД."""
+
+
+@dataclass
+class OpenTeam:
+    """Уже записанная в БД команда, в которой есть свободные места."""
+
+    team_project_id: int
+    pm_id: int
+    time_slot: time
+    level: str
+    student_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class AllocationSnapshot:
+    """Свободные слоты и участники, загруженные из БД одним проходом."""
+
+    students_count: int
+    pm_count: int
+    pm_ids: List[int]
+    # pm_id -> [(slot_id, time_slot)] в порядке id слотов
+    pm_slots: Dict[int, List[Tuple[int, time]]]
+    # (time_slot, level) -> {student_id: slot_id} в порядке id слотов
+    student_slots: Dict[Tuple[time, str], Dict[int, int]]
+    unallocated: Set[int]
+    project_ids: List[int]
+    constraints: ConstraintIndex = field(default_factory=ConstraintIndex)
+    far_east: Set[int] = field(default_factory=set)
+    # только для донабора: неполные команды и число команд у менеджеров
+    open_teams: List[OpenTeam] = field(default_factory=list)
+    pm_teams_count: Dict[int, int] = field(default_factory=dict)
+
+
+@dataclass
+class PlannedTeam:
+    """Команда, сформированная в памяти и еще не записанная в БД."""
+
+    pm_id: int
+    pm_slot_id: int
+    time_slot: time
+    level: str
+    project_id: int
+    student_ids: List[int] = field(default_factory=list)
+    student_slot_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class TeamAddition:
+    """Ученики, добавляемые в уже существующую команду."""
+
+    team_project_id: int
+    student_ids: List[int] = field(default_factory=list)
+    student_slot_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class AllocationPlan:
+    """План распределения: команды и ученики, оставшиеся без команды.
+    Строится без записи в БД, применяется commit_distribution."""
+
+    engine: str
+    teams: List[PlannedTeam]
+    unallocated: List[int]
+    # статистика optimize_teams, если оптимизация выполнялась
+    optimization: dict = field(default_factory=dict)
+    # пополнение существующих команд при донаборе
+    additions: List[TeamAddition] = field(default_factory=list)
+    # поток и даты проекта его команд
+    cohort_id: Optional[int] = None
+    date_start: str = PROJECTS_START_DATE
+    date_end: str = PROJECTS_END_DATE
+
+    @property
+    def stats(self):
+        return {
+            "engine": self.engine,
+            "cohort_id": self.cohort_id,
+            "teams": len(self.teams),
+            "filled_teams": len(self.additions),
+            "placed_students": sum(
+                len(team.student_ids) for team in [*self.teams, *self.additions]
+            ),
+            "unallocated_students": len(self.unallocated),
+            "optimization": self.optimization,
+        }
+
+    def to_dict(self):
+        """Представление плана, пригодное для JSON (например, для сессии)."""
+        return {
+            "engine": self.engine,
+            "teams": [
+                dict(asdict(team), time_slot=team.time_slot.isoformat())
+                for team in self.teams
+            ],
+            "unallocated": self.unallocated,
+            "optimization": self.optimization,
+            "additions": [asdict(addition) for addition in self.additions],
+            "cohort_id": self.cohort_id,
+            "date_start": self.date_start,
+            "date_end": self.date_end,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            engine=data["engine"],
+            teams=[
+                PlannedTeam(
+                    **dict(team, time_slot=time.fromisoformat(team["time_slot"]))
+                )
+                for team in data["teams"]
+            ],
+            unallocated=data["unallocated"],
+            optimization=data.get("optimization", {}),
+            additions=[
+                TeamAddition(**addition) for addition in data.get("additions", [])
+            ],
+            cohort_id=data.get("cohort_id"),
+            date_start=data.get("date_start", PROJECTS_START_DATE),
+            date_end=data.get("date_end", PROJECTS_END_DATE),
+        )
+
+    def set_cohort(self, cohort):
+        """Привязывает план к потоку cohort (None — участники без потока)."""
+        if cohort is None:
+            self.cohort_id = None
+            self.date_start = PROJECTS_START_DATE
+            self.date_end = PROJECTS_END_DATE
+        else:
+            self.cohort_id = cohort.id
+            self.date_start = cohort.date_start.isoformat()
+            self.date_end = cohort.date_end.isoformat()
+
+
+def get_cohorts():
+    """Потоки для распределения по дате начала. None означает участников
+    без потока и идет первым, если такие участники есть."""
+    cohorts = list(Cohort.objects.order_by("date_start", "id"))
+    if Participant.objects.filter(cohort=None).exists():
+        cohorts.insert(0, None)
+    return cohorts
+
+
+def load_snapshot(cohort=None):
+    """Загружает все свободные таймслоты и участников потока cohort
+    (None — участников без потока) за константное число запросов."""
+    participants = Participant.objects.filter(cohort=cohort)
+    pm_slots = defaultdict(list)
+    student_slots = defaultdict(dict)
+
+    free_timeslots = (
+        TimeSlot.objects.filter(team_project=None, participant__cohort=cohort)
+        .order_by("id")
+        .values_list(
+            "id",
+            "time_slot",
+            "participant_id",
+            "participant__role",
+            "participant__level",
+        )
+    )
+    for slot_id, time_slot, participant_id, role, level in free_timeslots:
+        if role == Participant.PRODUCT_MANAGER:
+            pm_slots[participant_id].append((slot_id, time_slot))
+        else:
+            student_slots[(time_slot, level)].setdefault(participant_id, slot_id)
+
+    pm_ids = list(
+        participants.filter(role=Participant.PRODUCT_MANAGER)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+    return AllocationSnapshot(
+        students_count=participants.filter(role=Participant.STUDENT).count(),
+        pm_count=len(pm_ids),
+        pm_ids=pm_ids,
+        pm_slots=dict(pm_slots),
+        student_slots=dict(student_slots),
+        unallocated=set(
+            get_unallocated_students()
+            .filter(cohort=cohort)
+            .values_list("id", flat=True)
+        ),
+        project_ids=list(Project.objects.values_list("id", flat=True)),
+        constraints=load_constraints(),
+        far_east=set(
+            participants.filter(
+                role=Participant.STUDENT,
+                is_far_east=True,
+            ).values_list("id", flat=True)
+        ),
+    )
+
+
+def load_incremental_snapshot(cohort=None):
+    """Снимок для донабора в потоке cohort: только нераспределенные ученики
+    и их свободные слоты, свободные слоты менеджеров в те же времена
+    и неполные команды этих времен. Запросов константное число, а объем
+    загруженного пропорционален числу нераспределенных учеников,
+    а не всему набору."""
+    participants = Participant.objects.filter(cohort=cohort)
+    unallocated_students = get_unallocated_students().filter(cohort=cohort)
+    student_slots = defaultdict(dict)
+    free_student_timeslots = (
+        TimeSlot.objects.filter(
+            team_project=None,
+            participant__in=unallocated_students,
+        )
+        .order_by("id")
+        .values_list("id", "time_slot", "participant_id", "participant__level")
+    )
+    unallocated = set()
+    for slot_id, time_slot, student_id, level in free_student_timeslots:
+        student_slots[(time_slot, level)].setdefault(student_id, slot_id)
+        unallocated.add(student_id)
+    times = set(time_slot for time_slot, _ in student_slots)
+
+    pm_slots = defaultdict(list)
+    free_pm_timeslots = (
+        TimeSlot.objects.filter(
+            team_project=None,
+            participant__role=Participant.PRODUCT_MANAGER,
+            participant__cohort=cohort,
+            time_slot__in=times,
+        )
+        .order_by("id")
+        .values_list("id", "time_slot", "participant_id")
+    )
+    for slot_id, time_slot, pm_id in free_pm_timeslots:
+        pm_slots[pm_id].append((slot_id, time_slot))
+    pm_ids = sorted(pm_slots)
+
+    # Команды считаются только у менеджеров со свободными слотами в эти
+    # времена: остальным донабор новых команд не назначит
+    now = datetime.now()
+    pm_teams_count = dict(
+        TimeSlot.objects.filter(
+            participant_id__in=pm_ids,
+            team_project__date_start__gte=now,
+        )
+        .values("participant_id")
+        .annotate(teams_count=Count("id"))
+        .values_list("participant_id", "teams_count")
+    )
+
+    # Пополнить можно только команды тех же времен, их находят по слотам
+    # менеджеров потока, а не подсчетом учеников во всех командах
+    candidate_team_project_ids = list(
+        TimeSlot.objects.filter(
+            participant__role=Participant.PRODUCT_MANAGER,
+            participant__cohort=cohort,
+            time_slot__in=times,
+            team_project__date_start__gte=now,
+            team_project__batch__cancelled_at=None,
+        ).values_list("team_project_id", flat=True)
+    )
+    open_teams = {}
+    open_team_timeslots = (
+        TimeSlot.objects.filter(team_project_id__in=candidate_team_project_ids)
+        .order_by("team_project_id", "id")
+        .values_list(
+            "team_project_id",
+            "time_slot",
+            "participant_id",
+            "participant__role",
+            "participant__level",
+        )
+    )
+    for team_project_id, time_slot, participant_id, role, level in open_team_timeslots:
+        team = open_teams.setdefault(
+            team_project_id, OpenTeam(team_project_id, None, time_slot, None)
+        )
+        if role == Participant.PRODUCT_MANAGER:
+            team.pm_id = participant_id
+        else:
+            team.level = level
+            team.student_ids.append(participant_id)
+
+    return AllocationSnapshot(
+        students_count=participants.filter(role=Participant.STUDENT).count(),
+        pm_count=participants.filter(role=Participant.PRODUCT_MANAGER).count(),
+        pm_ids=pm_ids,
+        pm_slots=dict(pm_slots),
+        student_slots=dict(student_slots),
+        unallocated=unallocated,
+        project_ids=list(Project.objects.values_list("id", flat=True)),
+        constraints=load_constraints(),
+        # Уровень команды без учеников неизвестен, такие команды не пополняются
+        open_teams=[
+            team
+            for team in open_teams.values()
+            if team.pm_id is not None
+            and team.level is not None
+            and len(team.student_ids) < MAX_TEAM_MEMBERS
+        ],
+        pm_teams_count=pm_teams_count,
+    )
+
+
+def _students_index(snapshot, unallocated):
+    """Индекс нераспределенных учеников по корзинам (time_slot, level)."""
+    index = AvailabilityIndex()
+    for bucket, bucket_slots in snapshot.student_slots.items():
+        for student_id, slot_id in bucket_slots.items():
+            if student_id in unallocated:
+                index.add(bucket, student_id, slot_id)
+    return index
+
+
+def _block_students(block, index, bucket, members):
+    """Ученики блока TOG, если весь блок можно взять из корзины индекса
+    в команду с участниками members, иначе None."""
+    students = []
+    for participant_id in block:
+        if participant_id in members:
+            continue
+        if index.slot(bucket, participant_id) is None:
+            return None
+        students.append(participant_id)
+    return students
+
+
+def _take_free_students(index, bucket, constraints, members, count=MAX_TEAM_MEMBERS):
+    """Первые count учеников корзины индекса, совместимых по ограничениям
+    между собой и с участниками команды members (менеджером и уже
+    распределенными учениками).
+    Возвращает [(slot_id, student_id)], из индекса ученики не удаляются."""
+    taken = {}
+    team_mask = 0
+    for participant_id in members:
+        team_mask |= constraints.mask(participant_id)
+    for student_id, _ in index.candidates(bucket):
+        if student_id in taken:
+            continue
+
+        block, block_mask, separated_mask = constraints.block(student_id)
+        if separated_mask & (team_mask | block_mask):
+            continue
+        students = _block_students(block, index, bucket, members)
+        if students is None or len(taken) + len(students) > count:
+            continue
+
+        for block_student_id in students:
+            taken[block_student_id] = index.slot(bucket, block_student_id)
+        team_mask |= block_mask
+        if len(taken) == count:
+            break
+
+    return [(slot_id, student_id) for student_id, slot_id in taken.items()]
+
+
+def _max_teams_of_manager(snapshot):
+    max_teams_of_manager = (
+        snapshot.students_count // MAX_TEAM_MEMBERS // snapshot.pm_count
+    )
+    if max_teams_of_manager == 0:
+        max_teams_of_manager = 1
+    return max_teams_of_manager
+
+
+def _planned_team(pm_id, pm_slot_id, bucket, team_slots, project_ids):
+    time_slot, level = bucket
+    return PlannedTeam(
+        pm_id=pm_id,
+        pm_slot_id=pm_slot_id,
+        time_slot=time_slot,
+        level=level,
+        project_id=random.choice(project_ids),
+        student_ids=[student_id for _, student_id in team_slots],
+        student_slot_ids=[slot_id for slot_id, _ in team_slots],
+    )
+
+
+def _fill_teams(snapshot, index, pm_teams_count, busy_pm_slots):
+    """Жадно формирует команды в порядке обхода make_teams: менеджеры и их
+    свободные слоты по id, уровни в порядке STUDENTS_LEVELS.
+    Распределенные ученики удаляются из индекса, pm_teams_count
+    обновляется по ходу."""
+    max_teams_of_manager = _max_teams_of_manager(snapshot)
+
+    teams = []
+    for pm_id in snapshot.pm_ids:
+        for pm_slot_id, time_slot in snapshot.pm_slots.get(pm_id, []):
+            if pm_teams_count[pm_id] >= max_teams_of_manager:
+                break
+            if pm_slot_id in busy_pm_slots:
+                continue
+
+            for level in STUDENTS_LEVELS:
+                bucket = (time_slot, level)
+                if index.count(bucket) < MAX_TEAM_MEMBERS:
+                    continue
+                team_slots = _take_free_students(
+                    index, bucket, snapshot.constraints, (pm_id,)
+                )
+                if len(team_slots) < MAX_TEAM_MEMBERS:
+                    continue
+
+                for _, student_id in team_slots:
+                    index.remove(student_id)
+                teams.append(
+                    _planned_team(
+                        pm_id, pm_slot_id, bucket, team_slots, snapshot.project_ids
+                    )
+                )
+                pm_teams_count[pm_id] += 1
+                break
+
+    return teams
+
+
+def plan_greedy(snapshot):
+    """Жадное распределение в памяти, повторяющее порядок обхода make_teams:
+    менеджеры и их слоты по id, уровни в порядке STUDENTS_LEVELS."""
+    index = _students_index(snapshot, snapshot.unallocated)
+    return _fill_teams(snapshot, index, defaultdict(int), set())
+
+
+def plan_incremental(snapshot):
+    """Донабор по снимку load_incremental_snapshot: сначала нераспределенные
+    ученики того же времени и уровня добавляются в неполные команды
+    (по id команд), затем из оставшихся жадно формируются новые команды
+    на свободных слотах менеджеров. Существующие команды не перестраиваются.
+    Возвращает (пополнения команд, новые команды)."""
+    index = _students_index(snapshot, snapshot.unallocated)
+
+    additions = []
+    for team in snapshot.open_teams:
+        team_slots = _take_free_students(
+            index,
+            (team.time_slot, team.level),
+            snapshot.constraints,
+            (team.pm_id, *team.student_ids),
+            MAX_TEAM_MEMBERS - len(team.student_ids),
+        )
+        if not team_slots:
+            continue
+        for _, student_id in team_slots:
+            index.remove(student_id)
+        additions.append(
+            TeamAddition(
+                team_project_id=team.team_project_id,
+                student_ids=[student_id for _, student_id in team_slots],
+                student_slot_ids=[slot_id for slot_id, _ in team_slots],
+            )
+        )
+
+    pm_teams_count = defaultdict(int, snapshot.pm_teams_count)
+    teams = _fill_teams(snapshot, index, pm_teams_count, set())
+    return additions, teams
+
+
+class _FlowPlanner:
+    """Две потоковые сети распределения: слоты менеджеров по корзинам
+    (time_slot, level) и ученики по тем же корзинам. Поток в корзину
+    в обеих сетях ограничен числом ее команд."""
+
+    SOURCE = 0
+    SINK = 1
+
+    def __init__(self, snapshot, max_teams_of_manager):
+        self.pm_network = FlowNetwork(2)
+        self.students_network = FlowNetwork(2)
+        # bucket -> ребро source -> корзина в сети менеджеров
+        self.pm_bucket_edges = {}
+        # bucket -> [(ребро корзина -> слот, pm_id, pm_slot_id)]
+        self.pm_slot_edges = defaultdict(list)
+        # bucket -> ребро корзина -> sink в сети учеников
+        self.students_bucket_edges = {}
+        # bucket -> [(ребро ученик -> корзина, slot_id, student_id)]
+        self.student_edges = defaultdict(list)
+
+        pm_slot_nodes_by_time = defaultdict(list)
+        for pm_id in snapshot.pm_ids:
+            pm_node = self.pm_network.add_node()
+            self.pm_network.add_edge(pm_node, self.SINK, max_teams_of_manager)
+            for pm_slot_id, time_slot in snapshot.pm_slots.get(pm_id, []):
+                pm_slot_node = self.pm_network.add_node()
+                self.pm_network.add_edge(pm_slot_node, pm_node, 1)
+                pm_slot_nodes_by_time[time_slot].append(
+                    (pm_slot_node, pm_id, pm_slot_id)
+                )
+
+        student_nodes = {}
+        for bucket, bucket_slots in snapshot.student_slots.items():
+            time_slot, _ = bucket
+            if time_slot not in pm_slot_nodes_by_time:
+                continue
+
+            bucket_node = self.pm_network.add_node()
+            self.pm_bucket_edges[bucket] = self.pm_network.add_edge(
+                self.SOURCE, bucket_node, 0
+            )
+            for pm_slot_node, pm_id, pm_slot_id in pm_slot_nodes_by_time[time_slot]:
+                edge = self.pm_network.add_edge(bucket_node, pm_slot_node, 1)
+                self.pm_slot_edges[bucket].append((edge, pm_id, pm_slot_id))
+
+            bucket_node = self.students_network.add_node()
+            self.students_bucket_edges[bucket] = self.students_network.add_edge(
+                bucket_node, self.SINK, 0
+            )
+            for student_id, slot_id in bucket_slots.items():
+                if student_id not in snapshot.unallocated:
+                    continue
+                # Блоки TOG потоком не описываются, их добирает _fill_teams
+                if snapshot.constraints.is_grouped(student_id):
+                    continue
+                if student_id not in student_nodes:
+                    student_nodes[student_id] = self.students_network.add_node()
+                    self.students_network.add_edge(
+                        self.SOURCE, student_nodes[student_id], 1
+                    )
+                edge = self.students_network.add_edge(
+                    student_nodes[student_id], bucket_node, 1
+                )
+                self.student_edges[bucket].append((edge, slot_id, student_id))
+
+    @property
+    def buckets(self):
+        return list(self.pm_bucket_edges)
+
+    def add_team(self, bucket):
+        """Пытается добавить корзине еще одну команду, перестраивая уже
+        найденные назначения. При неудаче сети остаются как были."""
+        pm_edge = self.pm_bucket_edges[bucket]
+        self.pm_network.capacities[pm_edge] += 1
+        if not self.pm_network.augment(self.SOURCE, self.SINK, 1):
+            self.pm_network.capacities[pm_edge] -= 1
+            return False
+
+        students_edge = self.students_bucket_edges[bucket]
+        self.students_network.capacities[students_edge] += MAX_TEAM_MEMBERS
+        placed_count = self.students_network.augment(
+            self.SOURCE, self.SINK, MAX_TEAM_MEMBERS, from_sink=True
+        )
+        if placed_count < MAX_TEAM_MEMBERS:
+            for _ in range(placed_count):
+                self.students_network.withdraw(self.SOURCE, self.SINK, students_edge)
+            self.students_network.capacities[students_edge] -= MAX_TEAM_MEMBERS
+            self.pm_network.withdraw(self.SOURCE, self.SINK, pm_edge)
+            self.pm_network.capacities[pm_edge] -= 1
+            return False
+
+        return True
+
+    def teams(self, snapshot):
+        """Команды по найденным потокам. Ученики корзины раскладываются
+        по ее слотам менеджеров с проверкой ограничений SEP; слот, которому
+        не хватило совместимых учеников, остается свободным."""
+        teams = []
+        for bucket in self.buckets:
+            students = AvailabilityIndex()
+            for edge, slot_id, student_id in self.student_edges[bucket]:
+                if self.students_network.flow(edge):
+                    students.add(bucket, student_id, slot_id)
+            for edge, pm_id, pm_slot_id in self.pm_slot_edges[bucket]:
+                if not self.pm_network.flow(edge):
+                    continue
+                team_slots = _take_free_students(
+                    students, bucket, snapshot.constraints, (pm_id,)
+                )
+                if len(team_slots) < MAX_TEAM_MEMBERS:
+                    continue
+                for _, student_id in team_slots:
+                    students.remove(student_id)
+                teams.append(
+                    _planned_team(
+                        pm_id, pm_slot_id, bucket, team_slots, snapshot.project_ids
+                    )
+                )
+        return teams
+
+
+def plan_max_flow(snapshot):
+    """Распределение, максимизирующее число размещенных учеников.
+
+    Команда — это MAX_TEAM_MEMBERS учеников одного уровня и слот менеджера
+    в одно время, поэтому одним потоком задача не описывается. Вместо этого
+    корзинам (time_slot, level) по кругу добавляется по команде: слот
+    менеджера и ученики ищутся увеличивающими путями, которые могут
+    переставить уже сделанные назначения. Если корзине команду добавить
+    не удалось, дальше это тоже не удастся, и корзина выбывает.
+    Корзины начинают с числа команд жадного распределения, поэтому без
+    ограничений Constraint учеников размещается не меньше, чем в plan_greedy.
+
+    Блоки TOG и оставшиеся свободными слоты затем добираются _fill_teams."""
+    planner = _FlowPlanner(snapshot, _max_teams_of_manager(snapshot))
+
+    # Сначала повторяем число команд по корзинам из жадного распределения:
+    # оно допустимо, значит каждый шаг найдет путь, и результат не хуже.
+    for team in plan_greedy(snapshot):
+        planner.add_team((team.time_slot, team.level))
+
+    buckets = planner.buckets
+    while buckets:
+        buckets = [bucket for bucket in buckets if planner.add_team(bucket)]
+
+    teams = planner.teams(snapshot)
+
+    unallocated = set(snapshot.unallocated)
+    pm_teams_count = defaultdict(int)
+    for team in teams:
+        unallocated.difference_update(team.student_ids)
+        pm_teams_count[team.pm_id] += 1
+    busy_pm_slots = set(team.pm_slot_id for team in teams)
+    index = _students_index(snapshot, unallocated)
+    teams.extend(_fill_teams(snapshot, index, pm_teams_count, busy_pm_slots))
+
+    teams.sort(key=lambda team: (team.pm_id, team.pm_slot_id))
+    return teams
+
+
+def score_teams(snapshot, teams):
+    """Качество распределения для сравнения попыток: число размещенных
+    учеников, доля команд из учеников одного уровня и число нарушенных
+    ограничений (со знаком минус). Больше — лучше."""
+    student_levels = {
+        student_id: level
+        for (_, level), bucket in snapshot.student_slots.items()
+        for student_id in bucket
+    }
+    constraints = snapshot.constraints
+
+    placed_count = 0
+    homogeneous_count = 0
+    violations_count = 0
+    for team in teams:
+        placed_count += len(team.student_ids)
+        levels = set(student_levels.get(s_id) for s_id in team.student_ids)
+        if len(levels) == 1:
+            homogeneous_count += 1
+
+        members = [team.pm_id, *team.student_ids]
+        team_mask = 0
+        for participant_id in members:
+            team_mask |= constraints.mask(participant_id)
+        for participant_id in members:
+            if constraints.separated(participant_id) & team_mask:
+                violations_count += 1
+        for student_id in team.student_ids:
+            _, block_mask, _ = constraints.block(student_id)
+            if block_mask & ~team_mask:
+                violations_count += 1
+
+    homogeneity = homogeneous_count / len(teams) if teams else 1.0
+    return placed_count, homogeneity, -violations_count
+
+
+def _perturbed_snapshot(snapshot, seed):
+    """Копия снимка с перемешанными менеджерами, их слотами и учениками
+    в корзинах — от этого порядка зависят все алгоритмы."""
+    rnd = random.Random(seed)
+    pm_ids = snapshot.pm_ids[:]
+    rnd.shuffle(pm_ids)
+    return replace(
+        snapshot,
+        pm_ids=pm_ids,
+        pm_slots={
+            pm_id: rnd.sample(pm_slots, len(pm_slots))
+            for pm_id, pm_slots in snapshot.pm_slots.items()
+        },
+        student_slots={
+            bucket: dict(rnd.sample(list(bucket_slots.items()), len(bucket_slots)))
+            for bucket, bucket_slots in snapshot.student_slots.items()
+        },
+    )
+
+
+# Соединения с БД, унаследованные дочерним процессом от родителя
+_inherited_connections = []
+
+
+def _detach_connections():
+    """В дочернем процессе отвязывает унаследованные соединения с БД,
+    не закрывая их: закрытие из дочернего процесса оборвало бы соединение
+    родителя вместе с его транзакцией. Ссылки хранятся до выхода
+    процесса, чтобы соединения не закрыл сборщик мусора."""
+    for alias in connections:
+        connection = connections[alias]
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+_search_snapshot = None
+
+
+def _init_search_worker(snapshot):
+    global _search_snapshot
+    _detach_connections()
+    _search_snapshot = snapshot
+
+
+def _search_attempt(seed, deadline):
+    if datetime.now() > deadline:
+        return None
+    random.seed(seed)
+    snapshot = _search_snapshot
+    if seed:
+        snapshot = _perturbed_snapshot(snapshot, seed)
+    teams = plan_max_flow(snapshot)
+    return score_teams(_search_snapshot, teams), seed, teams
+
+
+def plan_search(snapshot):
+    """Лучшая из settings.ALLOCATION_SEARCH_ATTEMPTS попыток plan_max_flow
+    на перемешанных копиях снимка (попытка 0 — без перемешивания).
+
+    Попытки выполняются в пуле процессов на всех ядрах; снимок передается
+    каждому процессу один раз. Попытки, не уложившиеся в
+    settings.ALLOCATION_SEARCH_SECONDS, отбрасываются, а процессы пула
+    после срока завершаются, даже если попытка еще идет."""
+    deadline = datetime.now() + timedelta(seconds=settings.ALLOCATION_SEARCH_SECONDS)
+
+    pool = Pool(initializer=_init_search_worker, initargs=(snapshot,))
+    try:
+        async_results = [
+            pool.apply_async(_search_attempt, (seed, deadline))
+            for seed in range(settings.ALLOCATION_SEARCH_ATTEMPTS)
+        ]
+        results = []
+        for async_result in async_results:
+            timeout = max((deadline - datetime.now()).total_seconds(), 0)
+            try:
+                result = async_result.get(timeout)
+            except TimeoutError:
+                continue
+            except Exception:
+                logger.exception("Попытка распределения завершилась ошибкой")
+                continue
+            if result is not None:
+                results.append(result)
+    finally:
+        pool.terminate()
+
+    if not results:
+        logger.warning("Ни одна попытка не уложилась во время, жадный план")
+        return plan_greedy(snapshot)
+
+    score, seed, teams = max(results, key=lambda result: (result[0], -result[1]))
+    logger.info(f"Попыток: {len(results)}, лучшая {seed}: {score}")
+    return teams
+
+
+ALLOCATION_ENGINES = {
+    "greedy": plan_greedy,
+    "flow": plan_max_flow,
+    "search": plan_search,
+}
+
+
+def _batches(items):
+    for start in range(0, len(items), BULK_BATCH_SIZE):
+        yield items[start : start + BULK_BATCH_SIZE]
+
+
+def check_distribution():
+    """Текст ошибки, если распределять пока некого или не из чего, иначе None."""
+    if not TimeSlot.objects.filter(participant__role=Participant.STUDENT).exists():
+        return "Нет учеников, сначала необходимо зарегистрировать учеников."
+    if not TimeSlot.objects.filter(
+        participant__role=Participant.PRODUCT_MANAGER
+    ).exists():
+        return "Нет менеджеров, сначала необходимо зарегистрировать менеджеров."
+    if not Project.objects.exists():
+        return "Нет типовых проектов, сначала необходимо добавить проекты."
+    return None
+
+
+def _plan_snapshot(snapshot, engine, optimize_seconds):
+    teams = []
+    optimization = {}
+    if snapshot.pm_ids and snapshot.student_slots:
+        teams = ALLOCATION_ENGINES[engine](snapshot)
+    if teams and optimize_seconds > 0:
+        optimization = optimize_teams(
+            snapshot, teams, _max_teams_of_manager(snapshot), optimize_seconds
+        )
+
+    placed = set(student_id for team in teams for student_id in team.student_ids)
+    return AllocationPlan(
+        engine=engine,
+        teams=teams,
+        unallocated=sorted(snapshot.unallocated - placed),
+        optimization=optimization,
+    )
+
+
+def plan_distribution(engine=None, optimize_seconds=None, cohort=None):
+    """План распределения потока cohort без записи в БД.
+
+    engine — ключ ALLOCATION_ENGINES, по умолчанию settings.ALLOCATION_ENGINE.
+    Если optimize_seconds (по умолчанию settings.ALLOCATION_OPTIMIZE_SECONDS)
+    больше нуля, команды затем улучшаются optimize_teams."""
+    engine = engine or settings.ALLOCATION_ENGINE
+    if optimize_seconds is None:
+        optimize_seconds = settings.ALLOCATION_OPTIMIZE_SECONDS
+
+    plan = _plan_snapshot(load_snapshot(cohort), engine, optimize_seconds)
+    plan.set_cohort(cohort)
+    return plan
+
+
+def _init_cohort_worker():
+    _detach_connections()
+    random.seed()
+
+
+def plan_cohorts_distribution(engine=None, optimize_seconds=None):
+    """Планы распределения всех потоков get_cohorts, по одному на поток.
+
+    Потоки не пересекаются по участникам, поэтому снимки загружаются
+    последовательно, а планируются одновременно в пуле процессов: общее
+    время близко ко времени самого большого потока. Движок search сам
+    занимает все ядра, поэтому с ним потоки планируются по очереди."""
+    engine = engine or settings.ALLOCATION_ENGINE
+    if optimize_seconds is None:
+        optimize_seconds = settings.ALLOCATION_OPTIMIZE_SECONDS
+
+    cohorts = get_cohorts()
+    snapshots = [load_snapshot(cohort) for cohort in cohorts]
+    if len(snapshots) > 1 and engine != "search":
+        with ProcessPoolExecutor(
+            max_workers=min(len(snapshots), os.cpu_count() or 1),
+            initializer=_init_cohort_worker,
+        ) as executor:
+            plans = list(
+                executor.map(
+                    _plan_snapshot, snapshots, repeat(engine), repeat(optimize_seconds)
+                )
+            )
+    else:
+        plans = [
+            _plan_snapshot(snapshot, engine, optimize_seconds) for snapshot in snapshots
+        ]
+
+    for plan, cohort in zip(plans, cohorts):
+        plan.set_cohort(cohort)
+    return plans
+
+
+def plan_late_distribution(cohort=None):
+    """План донабора потока cohort без записи в БД, см. plan_incremental."""
+    snapshot = load_incremental_snapshot(cohort)
+    additions, teams = plan_incremental(snapshot)
+
+    placed = set(
+        student_id for team in [*additions, *teams] for student_id in team.student_ids
+    )
+    plan = AllocationPlan(
+        engine="incremental",
+        teams=teams,
+        unallocated=sorted(snapshot.unallocated - placed),
+        additions=additions,
+    )
+    plan.set_cohort(cohort)
+    return plan
+
+
+def _has_overfilled_teams(additions):
+    """Не переполнит ли пополнение команды, которые успели измениться."""
+    if not additions:
+        return False
+    added_count = {
+        addition.team_project_id: len(addition.student_ids) for addition in additions
+    }
+    existing_ids = set(
+        TeamProject.objects.filter(id__in=added_count).values_list("id", flat=True)
+    )
+    if existing_ids != set(added_count):
+        return True
+    students_count = (
+        TimeSlot.objects.filter(
+            team_project_id__in=added_count,
+            participant__role=Participant.STUDENT,
+        )
+        .values("team_project_id")
+        .annotate(students_count=Count("id"))
+        .values_list("team_project_id", "students_count")
+    )
+    return any(
+        count + added_count[team_project_id] > MAX_TEAM_MEMBERS
+        for team_project_id, count in students_count
+    )
+
+
+def commit_distribution(plan):
+    """Применяет план одной транзакцией как новый запуск AllocationBatch:
+    команды создаются bulk_create, слоты обновляются bulk_update, затем
+    перезаписываются снимки составов затронутых команд и маски свободных
+    слотов участников. Если слоты плана уже заняты, ученики успели попасть
+    в другие команды или пополняемые команды заполнились, ничего
+    не записывается и поднимается StalePlanError. Пустой план запуска
+    не создает.
+    Возвращает созданные команды."""
+    if not plan.teams and not plan.additions:
+        return []
+
+    slot_ids = [
+        slot_id
+        for team in plan.teams
+        for slot_id in (team.pm_slot_id, *team.student_slot_ids)
+    ]
+    slot_ids.extend(
+        slot_id for addition in plan.additions for slot_id in addition.student_slot_ids
+    )
+    student_ids = [
+        student_id
+        for team in [*plan.teams, *plan.additions]
+        for student_id in team.student_ids
+    ]
+
+    with transaction.atomic():
+        free_slots_count = 0
+        for ids in _batches(slot_ids):
+            free_slots_count += len(
+                TimeSlot.objects.select_for_update()
+                .filter(id__in=ids, team_project=None)
+                .values_list("id", flat=True)
+            )
+        now = datetime.now()
+        has_allocated_students = False
+        for ids in _batches(student_ids):
+            # Статусы прошедших проектов больше не действуют
+            AllocationStatus.objects.filter(
+                participant_id__in=ids,
+                date_start__lt=now,
+            ).delete()
+            has_allocated_students |= AllocationStatus.objects.filter(
+                participant_id__in=ids,
+            ).exists()
+        if (
+            free_slots_count != len(slot_ids)
+            or has_allocated_students
+            or _has_overfilled_teams(plan.additions)
+        ):
+            raise StalePlanError(
+                "План устарел: часть слотов или учеников уже распределена."
+            )
+
+        batch = AllocationBatch.objects.create(
+            engine=plan.engine,
+            cohort_id=plan.cohort_id,
+            date_start=datetime.fromisoformat(plan.date_start),
+            date_end=datetime.fromisoformat(plan.date_end),
+            stats=plan.stats,
+            plan=plan.to_dict(),
+        )
+        team_projects = TeamProject.objects.bulk_create(
+            [
+                TeamProject(
+                    date_start=batch.date_start,
+                    date_end=batch.date_end,
+                    project_id=team.project_id,
+                    batch=batch,
+                )
+                for team in plan.teams
+            ],
+            batch_size=BULK_BATCH_SIZE,
+        )
+
+        timeslots = []
+        for team, team_project in zip(plan.teams, team_projects):
+            for slot_id in [team.pm_slot_id, *team.student_slot_ids]:
+                timeslots.append(
+                    TimeSlot(id=slot_id, team_project=team_project, batch=batch)
+                )
+        for addition in plan.additions:
+            for slot_id in addition.student_slot_ids:
+                timeslots.append(
+                    TimeSlot(
+                        id=slot_id,
+                        team_project_id=addition.team_project_id,
+                        batch=batch,
+                    )
+                )
+        TimeSlot.objects.bulk_update(
+            timeslots, ["team_project", "batch"], batch_size=BULK_BATCH_SIZE
+        )
+
+        team_members = [
+            (team_project.id, team.student_ids)
+            for team, team_project in zip(plan.teams, team_projects)
+        ]
+        team_members.extend(
+            (addition.team_project_id, addition.student_ids)
+            for addition in plan.additions
+        )
+        statuses = [
+            AllocationStatus(
+                participant_id=student_id,
+                cohort_id=plan.cohort_id,
+                team_project_id=team_project_id,
+                batch=batch,
+                date_start=batch.date_start,
+            )
+            for team_project_id, student_ids in team_members
+            for student_id in student_ids
+        ]
+        try:
+            # Одновременный запуск мог распределить тех же учеников:
+            # тогда сработает уникальность статусов
+            with transaction.atomic():
+                AllocationStatus.objects.bulk_create(
+                    statuses, batch_size=BULK_BATCH_SIZE
+                )
+        except IntegrityError:
+            raise StalePlanError(
+                "План устарел: часть учеников уже распределена другим запуском."
+            )
+
+        team_project_ids = [team_project_id for team_project_id, _ in team_members]
+        for ids in _batches(team_project_ids):
+            refresh_rosters(ids)
+        update_free_slots_masks(TimeSlot.objects.filter(batch=batch), free=False)
+
+    return team_projects
+
+
+def make_teams(engine=None):
+    """Распределение учеников по командам и менеджерам во всех потоках,
+    каждый поток записывается отдельной транзакцией. Устаревший план
+    потока (StalePlanError) планируется заново один раз, а если устарел
+    и он, поток пропускается: записанные потоки остаются.
+
+    engine — ключ ALLOCATION_ENGINES, по умолчанию settings.ALLOCATION_ENGINE."""
+    error = check_distribution()
+    if error:
+        return error
+
+    cohorts = {cohort.id if cohort else None: cohort for cohort in get_cohorts()}
+    skipped = []
+    for plan in plan_cohorts_distribution(engine):
+        try:
+            commit_distribution(plan)
+        except StalePlanError as error:
+            logger.warning(f"Поток {plan.cohort_id}: {error}, планируем заново")
+            plan = plan_distribution(engine, cohort=cohorts.get(plan.cohort_id))
+            try:
+                commit_distribution(plan)
+            except StalePlanError as error:
+                logger.warning(f"Поток {plan.cohort_id} пропущен: {error}")
+                skipped.append(f"{plan.date_start} - {plan.date_end}")
+                continue
+        logger.info(f"Поток {plan.cohort_id}: сформировано команд {len(plan.teams)}")
+
+    if skipped:
+        return (
+            "Распределение выполнено, кроме потоков, которые менялись "
+            f"во время записи: {', '.join(skipped)}"
+        )
+    return "Распределение успешно"
@@ -0,0 +1,152 @@
+from collections import OrderedDict, defaultdict
+from itertools import islice
+
+from bot.models import Participant
+from bot.utils.timeslots_utils import (
+    SLOTS_PER_DAY,
+    mask_to_times,
+    rotate_mask,
+    slot_time,
+)
+
+SUGGESTIONS_COUNT = 5
+
+
+class AvailabilityIndex:
+    """Свободные участники, сгруппированные по ключу (например, времени
+    или паре (time_slot, level)) в порядке добавления.
+
+    Каждый ключ хранит OrderedDict {participant_id: slot_id}, поэтому взять
+    первого участника и удалить любого можно за O(1). Участник может
+    лежать под несколькими ключами; remove убирает его отовсюду."""
+
+    def __init__(self):
+        self._buckets = defaultdict(OrderedDict)
+        self._participant_keys = defaultdict(list)
+
+    def add(self, key, participant_id, slot_id):
+        """Добавляет участника под ключ, если его там еще нет."""
+        bucket = self._buckets[key]
+        if participant_id in bucket:
+            return
+        bucket[participant_id] = slot_id
+        self._participant_keys[participant_id].append(key)
+
+    def remove(self, participant_id):
+        for key in self._participant_keys.pop(participant_id, ()):
+            bucket = self._buckets[key]
+            del bucket[participant_id]
+            if not bucket:
+                del self._buckets[key]
+
+    def pop(self, key):
+        """Первый участник под ключом как (participant_id, slot_id);
+        участник удаляется из всех ключей."""
+        participant_id, slot_id = next(iter(self._buckets[key].items()))
+        self.remove(participant_id)
+        return participant_id, slot_id
+
+    def peek(self, key, count=None):
+        """Первые count участников под ключом как [(participant_id, slot_id)]."""
+        if key not in self._buckets:
+            return []
+        return list(islice(self._buckets[key].items(), count))
+
+    def candidates(self, key):
+        """Итератор по (participant_id, slot_id) под ключом. Пока он
+        используется, участников удалять нельзя."""
+        if key not in self._buckets:
+            return iter(())
+        return iter(self._buckets[key].items())
+
+    def slot(self, key, participant_id):
+        """Слот участника под ключом или None."""
+        if key not in self._buckets:
+            return None
+        return self._buckets[key].get(participant_id)
+
+    def count(self, key):
+        if key not in self._buckets:
+            return 0
+        return len(self._buckets[key])
+
+    def keys(self):
+        return self._buckets.keys()
+
+    def __contains__(self, participant_id):
+        return participant_id in self._participant_keys
+
+    def __len__(self):
+        return len(self._participant_keys)
+
+
+def load_free_pm_times(cohort=None):
+    """Время, в которое есть свободные менеджеры потока cohort (None —
+    менеджеры без потока), по возрастанию. Берется из масок свободных
+    слотов: строка на менеджера, а не на каждый слот."""
+    free_mask = 0
+    pm_masks = Participant.objects.filter(
+        role=Participant.PRODUCT_MANAGER,
+        cohort=cohort,
+    ).values_list("free_slots_mask", flat=True)
+    for pm_mask in pm_masks:
+        free_mask |= pm_mask
+    return mask_to_times(free_mask)
+
+
+class FreePmCapacity:
+    """Свободные менеджеры по слотам дня, посчитанные один раз по маскам
+    Participant.free_slots_mask: для рассылки подсказок ученикам без
+    обращений к БД."""
+
+    def __init__(self, pm_masks=()):
+        self.mask = 0
+        self.capacity = [0] * SLOTS_PER_DAY
+        for pm_mask in pm_masks:
+            self.mask |= pm_mask
+            for slot_number in range(SLOTS_PER_DAY):
+                if pm_mask >> slot_number & 1:
+                    self.capacity[slot_number] += 1
+
+    def suggest(self, chosen_mask, count=SUGGESTIONS_COUNT):
+        """До count слотов со свободными менеджерами, кроме выбранных
+        учеником: сначала ближайшие к выбранным (по кругу суток), при
+        равном расстоянии — где свободно больше менеджеров. Без выбранных
+        слотов — просто самые свободные. Время слотов в порядке ранга."""
+        candidates = self.mask & ~chosen_mask
+        if not chosen_mask:
+            rings = [candidates]
+        else:
+            # Кольца слотов на расстоянии 1, 2, ... от выбранных
+            rings = []
+            seen = chosen_mask
+            for distance in range(1, SLOTS_PER_DAY // 2 + 1):
+                ring = (
+                    rotate_mask(chosen_mask, distance)
+                    | rotate_mask(chosen_mask, -distance)
+                ) & ~seen
+                seen |= ring
+                rings.append(ring & candidates)
+
+        suggestions = []
+        for ring in rings:
+            ring_slots = [
+                slot_number
+                for slot_number in range(SLOTS_PER_DAY)
+                if ring >> slot_number & 1
+            ]
+            ring_slots.sort(key=lambda slot_number: -self.capacity[slot_number])
+            suggestions.extend(ring_slots)
+            if len(suggestions) >= count:
+                break
+        return [slot_time(slot_number) for slot_number in suggestions[:count]]
+
+
+def load_free_pm_capacity(cohort=None):
+    """FreePmCapacity по менеджерам потока cohort (None — менеджерам
+    без потока) за один запрос: ученика распределят только к ним."""
+    return FreePmCapacity(
+        Participant.objects.filter(role=Participant.PRODUCT_MANAGER, cohort=cohort)
+        .exclude(free_slots_mask=0)
+        .values_list("free_slots_mask", flat=True)
+    )
@@ -0,0 +1,89 @@
+from bot.models import Constraint
+
+
+class ConstraintIndex:
+    """Ограничения Constraint, предрассчитанные для проверки команд за O(1).
+
+    Каждому участнику из ограничений выдается бит. Пары TOG склеиваются
+    в блоки (компоненты связности), которые распределяются только целиком.
+    Для блока хранятся маска его участников и маска всех, с кем его
+    участникам нельзя быть в одной команде (SEP), так что кандидата
+    можно проверить одной операцией AND с маской команды."""
+
+    def __init__(self, pairs=()):
+        self.bits = {}
+        self._parents = {}
+        separated_pairs = []
+        for first_id, second_id, constraint_type in pairs:
+            if constraint_type == Constraint.TOGHEDER:
+                self._union(first_id, second_id)
+            elif constraint_type == Constraint.SEPARATELY:
+                self._find(first_id)
+                self._find(second_id)
+                separated_pairs.append((first_id, second_id))
+
+        for index, participant_id in enumerate(self._parents):
+            self.bits[participant_id] = 1 << index
+
+        members = {}
+        for participant_id in self._parents:
+            members.setdefault(self._find(participant_id), []).append(participant_id)
+
+        self.separated_masks = {}
+        for first_id, second_id in separated_pairs:
+            self.separated_masks[first_id] = (
+                self.separated(first_id) | self.bits[second_id]
+            )
+            self.separated_masks[second_id] = (
+                self.separated(second_id) | self.bits[first_id]
+            )
+
+        # participant_id -> (участники блока, маска блока, маска SEP блока)
+        self.blocks = {}
+        for block in members.values():
+            block_mask = 0
+            separated_mask = 0
+            for participant_id in block:
+                block_mask |= self.bits[participant_id]
+                separated_mask |= self.separated(participant_id)
+            block_info = (tuple(block), block_mask, separated_mask)
+            for participant_id in block:
+                self.blocks[participant_id] = block_info
+
+    def block(self, participant_id):
+        """Участники, которые должны попасть в команду вместе с данным
+        (включая его самого), маска блока и маска SEP блока."""
+        return self.blocks.get(participant_id, ((participant_id,), 0, 0))
+
+    def mask(self, participant_id):
+        return self.bits.get(participant_id, 0)
+
+    def separated(self, participant_id):
+        """Маска участников, с которыми данному нельзя быть в одной команде."""
+        return self.separated_masks.get(participant_id, 0)
+
+    def is_grouped(self, participant_id):
+        return len(self.block(participant_id)[0]) > 1
+
+    def _find(self, participant_id):
+        root = self._parents.setdefault(participant_id, participant_id)
+        while self._parents[root] != root:
+            root = self._parents[root]
+        while participant_id != root:
+            parent = self._parents[participant_id]
+            self._parents[participant_id] = root
+            participant_id = parent
+        return root
+
+    def _union(self, first_id, second_id):
+        first_root = self._find(first_id)
+        second_root = self._find(second_id)
+        if first_root != second_root:
+            self._parents[second_root] = first_root
+
+
+def load_constraints():
+    """Индекс всех ограничений на пары за один запрос."""
+    return ConstraintIndex(
+        Constraint.objects.order_by("id").values_list("first_id", "second_id", "type")
+    )
@@ -0,0 +1,165 @@
+import logging
+import random
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic, sleep
+from typing import Optional
+
+from django.conf import settings
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+# Telegram: не больше сообщения в секунду в один чат
+CHAT_RATE = 1
+SEND_ATTEMPTS = 4
+RETRY_BACKOFF_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, подряд не больше capacity.
+    Потокобезопасно. Токен берется сразу, даже если его еще нет: долг
+    ставит следующих в очередь, а взявший ждет своей очереди вне
+    блокировки. Во время паузы токены не копятся, а очередь, набранная
+    до нее, строится заново от конца паузы."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        # Время последнего пополнения, во время паузы — ее конец
+        self._updated_at = monotonic()
+        self._pauses = 0
+        self._lock = Lock()
+
+    def _reserve(self):
+        with self._lock:
+            now = monotonic()
+            if now > self._updated_at:
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+            self._tokens -= 1
+            wait = self._updated_at - now + max(-self._tokens / self.rate, 0)
+            return wait, self._pauses
+
+    def acquire(self):
+        """Ждет токен, возвращает время ожидания в секундах."""
+        waited = 0.0
+        while True:
+            wait, pauses = self._reserve()
+            if wait > 0:
+                sleep(wait)
+                waited += wait
+            with self._lock:
+                if self._pauses == pauses:
+                    return waited
+            # Пока ждали, началась пауза: место в очереди занимается заново
+
+    def pause(self, seconds):
+        """Никто не получит токен ближайшие seconds секунд, после паузы
+        токены выдаются с темпом rate, без накопленного залпа."""
+        with self._lock:
+            resume_at = monotonic() + seconds
+            if resume_at > self._updated_at:
+                self._updated_at = resume_at
+                self._tokens = 0
+                self._pauses += 1
+
+
+_global_bucket = None
+_global_bucket_lock = Lock()
+
+
+def global_bucket():
+    """Общее на процесс ведро settings.NOTIFY_RATE сообщений в секунду:
+    одновременные рассылки делят лимит бота."""
+    global _global_bucket
+    with _global_bucket_lock:
+        if _global_bucket is None:
+            _global_bucket = TokenBucket(settings.NOTIFY_RATE)
+        return _global_bucket
+
+
+@dataclass
+class Delivery:
+    """Итог отправки сообщения одному получателю."""
+
+    chat_id: int
+    delivered: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+class Dispatcher:
+    """Рассылка сообщений пулом из settings.NOTIFY_WORKERS потоков
+    с общим лимитом бота и лимитом CHAT_RATE на чат. RetryAfter
+    приостанавливает всю рассылку на указанное Telegram время, сетевые
+    ошибки повторяются с экспоненциальной задержкой, остальные ошибки
+    (BadRequest, бот заблокирован) окончательные."""
+
+    def __init__(self, bot, bucket=None, **send_kwargs):
+        self.bot = bot
+        self.bucket = bucket or global_bucket()
+        self.send_kwargs = send_kwargs
+        self._chat_buckets = defaultdict(lambda: TokenBucket(CHAT_RATE))
+        self._chat_buckets_lock = Lock()
+
+    def _chat_bucket(self, chat_id):
+        with self._chat_buckets_lock:
+            return self._chat_buckets[chat_id]
+
+    def _send(self, chat_id, text):
+        delivery = Delivery(chat_id=chat_id)
+        chat_bucket = self._chat_bucket(chat_id)
+        while delivery.attempts < SEND_ATTEMPTS:
+            chat_bucket.acquire()
+            self.bucket.acquire()
+            delivery.attempts += 1
+            try:
+                self.bot.send_message(chat_id=chat_id, text=text, **self.send_kwargs)
+            except RetryAfter as error:
+                # Лимит превышен для всего бота, ждут все потоки
+                self.bucket.pause(error.retry_after)
+                delivery.error = str(error)
+            except BadRequest as error:
+                delivery.error = str(error)
+                break
+            except NetworkError as error:
+                delivery.error = str(error)
+                if delivery.attempts < SEND_ATTEMPTS:
+                    backoff = RETRY_BACKOFF_SECONDS * 2 ** (delivery.attempts - 1)
+                    sleep(backoff * random.uniform(1, 1.5))
+            except TelegramError as error:
+                delivery.error = str(error)
+                break
+            else:
+                delivery.delivered = True
+                delivery.error = None
+                break
+
+        if not delivery.delivered:
+            logger.warning(f"Сообщение в чат {chat_id} не доставлено: {delivery.error}")
+        return delivery
+
+    def send(self, messages):
+        """Отправляет messages — список (chat_id, text) — и возвращает
+        Delivery по каждому в том же порядке."""
+        if not messages:
+            return []
+        workers = min(settings.NOTIFY_WORKERS, len(messages))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda message: self._send(*message), messages))
+
+
+def delivery_summary(deliveries):
+    """Строка для админки: сколько доставлено и кому нет."""
+    failed = [delivery for delivery in deliveries if not delivery.delivered]
+    summary = f"доставлено {len(deliveries) - len(failed)} из {len(deliveries)}"
+    if failed:
+        chat_ids = ", ".join(str(delivery.chat_id) for delivery in failed)
+        summary += f", не доставлено в чаты: {chat_ids}"
+    return summary
@@ -0,0 +1,118 @@
+from collections import deque
+
+
+class FlowNetwork:
+    """Ациклическая сеть с целочисленными пропускными способностями,
+    поток в которой наращивается кратчайшими увеличивающими путями.
+
+    Ребра хранятся в плоских списках: ребро с четным индексом edge и
+    обратное к нему edge ^ 1 лежат рядом, поэтому поток по ребру равен
+    остаточной пропускной способности обратного."""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.adjacency = [[] for _ in range(size)]
+        self.heads = []
+        self.capacities = []
+
+    def add_node(self):
+        self.adjacency.append([])
+        self.size += 1
+        return self.size - 1
+
+    def add_edge(self, tail, head, capacity):
+        """Добавляет ребро и возвращает его индекс."""
+        edge = len(self.heads)
+        self.adjacency[tail].append(edge)
+        self.heads.append(head)
+        self.capacities.append(capacity)
+        self.adjacency[head].append(edge + 1)
+        self.heads.append(tail)
+        self.capacities.append(0)
+        return edge
+
+    def flow(self, edge):
+        return self.capacities[edge ^ 1]
+
+    def augment(self, source, sink, limit, from_sink=False):
+        """Увеличивает поток не более чем на limit единиц и возвращает,
+        на сколько удалось. Путь ищется поиском в ширину от истока или,
+        если from_sink, от стока — так быстрее, когда свободная
+        пропускная способность у стока есть только на одном ребре."""
+        pushed = 0
+        while pushed < limit:
+            if from_sink:
+                path = self._find_path_backward(source, sink)
+            else:
+                path = self._find_path_forward(source, sink)
+            if path is None:
+                break
+            amount = min(limit - pushed, *(self.capacities[e] for e in path))
+            for edge in path:
+                self.capacities[edge] -= amount
+                self.capacities[edge ^ 1] += amount
+            pushed += amount
+        return pushed
+
+    def withdraw(self, source, sink, edge):
+        """Снимает единицу потока с какого-нибудь пути source -> sink,
+        проходящего через ребро edge."""
+        path = [edge]
+        node = self.heads[edge]
+        while node != sink:
+            edge = next(
+                e
+                for e in self.adjacency[node]
+                if not e % 2 and self.capacities[e ^ 1] > 0
+            )
+            path.append(edge)
+            node = self.heads[edge]
+
+        node = self.heads[path[0] ^ 1]
+        while node != source:
+            reverse = next(
+                e for e in self.adjacency[node] if e % 2 and self.capacities[e] > 0
+            )
+            path.append(reverse ^ 1)
+            node = self.heads[reverse]
+
+        for edge in path:
+            self.capacities[edge] += 1
+            self.capacities[edge ^ 1] -= 1
+
+    def _find_path_forward(self, source, sink):
+        parents = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for edge in self.adjacency[node]:
+                head = self.heads[edge]
+                if self.capacities[edge] > 0 and head not in parents:
+                    parents[head] = edge
+                    if head == sink:
+                        path = []
+                        while head != source:
+                            path.append(parents[head])
+                            head = self.heads[parents[head] ^ 1]
+                        return path
+                    queue.append(head)
+        return None
+
+    def _find_path_backward(self, source, sink):
+        children = {sink: None}
+        queue = deque([sink])
+        while queue:
+            node = queue.popleft()
+            for reverse in self.adjacency[node]:
+                tail = self.heads[reverse]
+                edge = reverse ^ 1
+                if self.capacities[edge] > 0 and tail not in children:
+                    children[tail] = edge
+                    if tail == source:
+                        path = []
+                        while tail != sink:
+                            path.append(children[tail])
+                            tail = self.heads[children[tail]]
+                        return path
+                    queue.append(tail)
+        return None
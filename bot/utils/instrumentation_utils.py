@@ -0,0 +1,119 @@
+import logging
+import math
+from collections import defaultdict
+from functools import wraps
+from time import perf_counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from bot.models import CallMetric
+
+PERCENTILES = (50, 95, 99)
+
+logger = logging.getLogger(__name__)
+
+
+class QueriesTimer:
+    """Обертка выполнения запросов (connection.execute_wrapper), считающая
+    их число и суммарное время."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += perf_counter() - started_at
+
+
+def _record(name, seconds, timer, failed):
+    if seconds * 1000 >= settings.INSTRUMENTATION_SLOW_MS:
+        logger.warning(
+            f"Медленный вызов {name}: {seconds * 1000:.0f} мс, "
+            f"запросов {timer.count} на {timer.seconds * 1000:.0f} мс"
+        )
+    try:
+        CallMetric.objects.create(
+            name=name,
+            seconds=seconds,
+            queries=timer.count,
+            sql_seconds=timer.seconds,
+            failed=failed,
+        )
+    except DatabaseError:
+        # замер не должен ломать обработчик
+        logger.exception(f"Не удалось записать замер {name}")
+
+
+def instrumented(name):
+    """Декоратор обработчика бота или действия админки. Если включено
+    settings.INSTRUMENTATION, каждый вызов пишется в CallMetric: общее
+    время, число запросов и их время; вызовы дольше
+    settings.INSTRUMENTATION_SLOW_MS попадают в лог. Выключенный
+    замер стоит одной проверки настройки."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.INSTRUMENTATION:
+                return func(*args, **kwargs)
+
+            timer = QueriesTimer()
+            failed = True
+            started_at = perf_counter()
+            try:
+                with connection.execute_wrapper(timer):
+                    result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _record(name, perf_counter() - started_at, timer, failed)
+
+        return wrapper
+
+    return decorator
+
+
+def percentile(values, percent):
+    """Процентиль отсортированного непустого списка values
+    методом ближайшего ранга."""
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize_metrics(metrics=None):
+    """Сводка замеров metrics (по умолчанию всех) по обработчикам:
+    {имя: {"calls", "failed", "slow", "seconds", "queries", "sql_seconds"}},
+    где три последних — {процентиль: значение} для PERCENTILES."""
+    if metrics is None:
+        metrics = CallMetric.objects.all()
+
+    grouped = defaultdict(lambda: {"seconds": [], "queries": [], "sql_seconds": []})
+    failed = defaultdict(int)
+    rows = metrics.values_list("name", "seconds", "queries", "sql_seconds", "failed")
+    for name, seconds, queries, sql_seconds, is_failed in rows:
+        values = grouped[name]
+        values["seconds"].append(seconds)
+        values["queries"].append(queries)
+        values["sql_seconds"].append(sql_seconds)
+        failed[name] += is_failed
+
+    summary = {}
+    slow_seconds = settings.INSTRUMENTATION_SLOW_MS / 1000
+    for name, values in sorted(grouped.items()):
+        summary[name] = {
+            "calls": len(values["seconds"]),
+            "failed": failed[name],
+            "slow": sum(1 for seconds in values["seconds"] if seconds >= slow_seconds),
+        }
+        for key, key_values in values.items():
+            key_values.sort()
+            summary[name][key] = {
+                percent: percentile(key_values, percent) for percent in PERCENTILES
+            }
+    return summary
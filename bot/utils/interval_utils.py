@@ -0,0 +1,206 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+
+from django.db import transaction
+
+from bot.models import AvailabilityInterval
+from bot.utils.timeslots_utils import (
+    ALL_SLOTS_MASK,
+    CALL_TIME_MINUTES,
+    SLOTS_PER_DAY,
+    set_free_timeslots,
+)
+
+
+def merge_intervals(intervals):
+    """Объединяет пересекающиеся и смежные интервалы [start, end).
+    Результат отсортирован по началу."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def intersect_intervals(first, second):
+    """Пересечение двух отсортированных списков объединенных интервалов
+    за O(len(first) + len(second))."""
+    result = []
+    first_index = second_index = 0
+    while first_index < len(first) and second_index < len(second):
+        first_start, first_end = first[first_index]
+        second_start, second_end = second[second_index]
+        start = max(first_start, second_start)
+        end = min(first_end, second_end)
+        if start < end:
+            result.append((start, end))
+        if first_end < second_end:
+            first_index += 1
+        else:
+            second_index += 1
+    return result
+
+
+class IntervalIndex:
+    """Периоды доступности участников для запросов «кто доступен в момент
+    T» и «общее время участников» без обращений к БД.
+
+    Периоды лежат в центрированном дереве интервалов: узел хранит периоды,
+    содержащие его центр, в двух массивах — по возрастанию начала и по
+    убыванию окончания. Периоды левее центра уходят в левое поддерево,
+    правее — в правое. Центр — медиана начал, поэтому глубина O(log n),
+    а запрос в момент T — O(log n + k), где k — число найденных."""
+
+    def __init__(self, intervals=()):
+        grouped = defaultdict(list)
+        for start, end, participant_id in intervals:
+            grouped[participant_id].append((start, end))
+        self._participant_intervals = {
+            participant_id: merge_intervals(participant_intervals)
+            for participant_id, participant_intervals in grouped.items()
+        }
+
+        self._root = self._build(
+            [
+                (start, end, participant_id)
+                for participant_id, merged in self._participant_intervals.items()
+                for start, end in merged
+            ]
+        )
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        starts = sorted(start for start, _, _ in intervals)
+        center = starts[len(starts) // 2]
+
+        left, right, containing = [], [], []
+        for interval in intervals:
+            start, end, _ = interval
+            if end <= center:
+                left.append(interval)
+            elif start > center:
+                right.append(interval)
+            else:
+                containing.append(interval)
+
+        by_start = sorted(
+            (start, participant_id) for start, _, participant_id in containing
+        )
+        by_end = sorted(
+            ((end, participant_id) for _, end, participant_id in containing),
+            reverse=True,
+        )
+        return (center, by_start, by_end, self._build(left), self._build(right))
+
+    def at(self, moment):
+        """Участники, доступные в момент moment."""
+        participant_ids = []
+        node = self._root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if moment < center:
+                # Периоды узла заканчиваются позже центра, важно только начало
+                for start, participant_id in by_start:
+                    if start > moment:
+                        break
+                    participant_ids.append(participant_id)
+                node = left
+            else:
+                for end, participant_id in by_end:
+                    if end <= moment:
+                        break
+                    participant_ids.append(participant_id)
+                node = right
+        return participant_ids
+
+    def intervals(self, participant_id):
+        """Объединенные периоды участника по возрастанию."""
+        return self._participant_intervals.get(participant_id, [])
+
+    def common(self, participant_ids):
+        """Общее время доступности участников participant_ids."""
+        participant_ids = list(participant_ids)
+        if not participant_ids:
+            return []
+        result = self.intervals(participant_ids[0])
+        for participant_id in participant_ids[1:]:
+            if not result:
+                break
+            result = intersect_intervals(result, self.intervals(participant_id))
+        return result
+
+
+def load_interval_index(participants=None):
+    """Индекс периодов доступности участников participants
+    (по умолчанию всех) за один запрос."""
+    intervals = AvailabilityInterval.objects.all()
+    if participants is not None:
+        intervals = intervals.filter(participant__in=participants)
+    return IntervalIndex(intervals.values_list("start", "end", "participant_id"))
+
+
+def interval_times(intervals):
+    """Время начала созвонов, целиком помещающихся в интервалы:
+    сетка слотов дня, на которую интервалы переводятся для распределения."""
+    call_time = timedelta(minutes=CALL_TIME_MINUTES)
+    times = set()
+    for start, end in intervals:
+        day_start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        offset = (start - day_start) % call_time
+        # Первый созвон — с ближайшей границы слота не раньше start
+        current = start + (call_time - offset if offset else timedelta())
+        while current + call_time <= end:
+            times.add(current.time())
+            current += call_time
+    return times
+
+
+def mask_intervals(mask, day=date(1970, 1, 1)):
+    """Слоты маски свободных слотов как интервалы дня day в UTC, обратное
+    к interval_times: подряд идущие слоты объединяются, в том числе через
+    полночь, тогда интервал заканчивается на следующий день."""
+    call_time = timedelta(minutes=CALL_TIME_MINUTES)
+    day_start = datetime.combine(day, time(0, 0), tzinfo=timezone.utc)
+    if mask & ALL_SLOTS_MASK == ALL_SLOTS_MASK:
+        return [(day_start, day_start + SLOTS_PER_DAY * call_time)]
+
+    intervals = []
+    for slot_number in range(SLOTS_PER_DAY):
+        previous = (slot_number - 1) % SLOTS_PER_DAY
+        if not mask >> slot_number & 1 or mask >> previous & 1:
+            continue
+        length = 1
+        while mask >> (slot_number + length) % SLOTS_PER_DAY & 1:
+            length += 1
+        start = day_start + slot_number * call_time
+        intervals.append((start, start + length * call_time))
+    return intervals
+
+
+def set_availability_intervals(participant, intervals):
+    """Заменяет периоды доступности участника периодами intervals так,
+    как они заданы, и приводит к ним его свободные слоты
+    (set_free_timeslots). Смежные периоды не объединяются, чтобы их можно
+    было менять по отдельности, объединяет их IntervalIndex. Периоды
+    переводятся в UTC, поэтому слоты попадают в общую сетку UTC."""
+    intervals = sorted(
+        set(
+            (start.astimezone(timezone.utc), end.astimezone(timezone.utc))
+            for start, end in intervals
+        )
+    )
+    with transaction.atomic():
+        AvailabilityInterval.objects.filter(participant=participant).delete()
+        AvailabilityInterval.objects.bulk_create(
+            [
+                AvailabilityInterval(participant=participant, start=start, end=end)
+                for start, end in intervals
+            ]
+        )
+        # Созвон может начинаться в одном периоде и заканчиваться в смежном
+        set_free_timeslots(participant, interval_times(merge_intervals(intervals)))
+    return intervals
@@ -0,0 +1,360 @@
+import logging
+from datetime import timedelta
+from threading import Event, Thread
+
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import timezone
+
+from bot.models import Job
+from bot.utils.allocation_utils import (
+    AllocationPlan,
+    StalePlanError,
+    check_distribution,
+    commit_distribution,
+    get_cohorts,
+    plan_cohorts_distribution,
+    plan_late_distribution,
+)
+from bot.utils.instrumentation_utils import instrumented
+from bot.utils.notification_utils import notify_free_students, notify_teams
+from bot.utils.timeslots_utils import (
+    cancel_distribution,
+    get_teams,
+    get_unallocated_students,
+)
+
+# Пока задача выполняется, воркер отмечает ее с таким интервалом, даже
+# если шаг (планирование всех потоков) длится дольше
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+# Столько задача может не отмечаться, дальше ее воркер считается упавшим
+STALE_JOB_TIMEOUT = timedelta(minutes=5)
+
+logger = logging.getLogger(__name__)
+
+
+class JobAlreadyActive(Exception):
+    """Задача с тем же замком уже ждет или выполняется."""
+
+    def __init__(self, job):
+        super().__init__(f"Уже поставлена задача {job}")
+        self.job = job
+
+
+class JobLost(Exception):
+    """Задачу завершил другой воркер, сочтя ее зависшей."""
+
+
+def enqueue_job(action, payload=None):
+    """Ставит задачу action в очередь воркера и возвращает ее. Если
+    задача с тем же замком (Job.LOCKS) еще не завершилась, поднимает
+    JobAlreadyActive: проверку делает уникальность в БД, поэтому две
+    одновременные постановки не пройдут обе."""
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                action=action, lock=Job.LOCKS[action], payload=payload or {}
+            )
+    except IntegrityError:
+        active = Job.objects.filter(
+            lock=Job.LOCKS[action], status__in=Job.ACTIVE_STATUSES
+        ).first()
+        if active is None:
+            # Задача завершилась между вставкой и выборкой
+            return enqueue_job(action, payload)
+        raise JobAlreadyActive(active)
+
+
+def fail_stale_jobs():
+    """Завершает ошибкой задачи, которые дольше STALE_JOB_TIMEOUT
+    не отмечались: выполнявший их воркер упал. Сами задачи
+    не повторяются, потому что могли успеть записать часть потоков,
+    но освобождают замок для новой постановки."""
+    now = timezone.now()
+    stale_jobs = Job.objects.filter(
+        status=Job.RUNNING, heartbeat_at__lt=now - STALE_JOB_TIMEOUT
+    )
+    failed = 0
+    for job in stale_jobs:
+        job.status = Job.FAILED
+        job.errors.append("Воркер остановился, не завершив задачу.")
+        job.finished_at = now
+        failed += Job.objects.filter(id=job.id, status=Job.RUNNING).update(
+            status=job.status, errors=job.errors, finished_at=job.finished_at
+        )
+    return failed
+
+
+def claim_job():
+    """Берет в работу первую ожидающую задачу или возвращает None.
+    На PostgreSQL задачу, которую берет другой воркер, он пропускает."""
+    with transaction.atomic():
+        job = (
+            Job.objects.filter(status=Job.PENDING)
+            .order_by("id")
+            .select_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=["status", "started_at", "heartbeat_at"])
+    return job
+
+
+def save_progress(job, done=None, total=None):
+    """Записывает ход задачи: шаги, счетчики, сообщения и ошибки. Если
+    задачу уже завершил другой воркер, поднимает JobLost, чтобы она
+    не продолжалась одновременно с поставленной после нее."""
+    if done is not None:
+        job.done = done
+    if total is not None:
+        job.total = total
+    job.heartbeat_at = timezone.now()
+    updated = Job.objects.filter(id=job.id, status=Job.RUNNING).update(
+        done=job.done,
+        total=job.total,
+        counts=job.counts,
+        messages=job.messages,
+        errors=job.errors,
+        heartbeat_at=job.heartbeat_at,
+    )
+    if not updated:
+        raise JobLost(f"Задача {job.id} уже завершена другим воркером")
+
+
+def _heartbeat(job_id, stopped):
+    """Отмечает выполняемую задачу каждые HEARTBEAT_INTERVAL, пока
+    не установлен stopped. Работает в своем потоке и соединении с БД."""
+    try:
+        while not stopped.wait(HEARTBEAT_INTERVAL.total_seconds()):
+            try:
+                Job.objects.filter(id=job_id, status=Job.RUNNING).update(
+                    heartbeat_at=timezone.now()
+                )
+            except DatabaseError as error:
+                logger.warning(f"Задача {job_id} не отмечена: {error}")
+    finally:
+        connection.close()
+
+
+def job_progress(job):
+    """Ход задачи для опроса из админки."""
+    return {
+        "id": job.id,
+        "action": job.action,
+        "status": job.status,
+        "percent": job.percent,
+        "done": job.done,
+        "total": job.total,
+        "counts": job.counts,
+        "messages": job.messages,
+        "errors": job.errors,
+    }
+
+
+def _add_count(job, name, value):
+    job.counts[name] = job.counts.get(name, 0) + value
+
+
+def _commit_plans(job, plans, message):
+    """Записывает планы по потокам, устаревший план одного потока
+    не мешает остальным. Возвращает id созданных и пополненных команд."""
+    team_project_ids = []
+    for plan in plans:
+        try:
+            team_projects = commit_distribution(plan)
+        except StalePlanError as error:
+            job.errors.append(f"{plan.date_start} - {plan.date_end}: {error}")
+        else:
+            stats = plan.stats
+            job.messages.append(message.format(plan=plan, **stats))
+            _add_count(job, "teams", stats["teams"])
+            _add_count(job, "placed_students", stats["placed_students"])
+            team_project_ids.extend(team_project.id for team_project in team_projects)
+            team_project_ids.extend(
+                addition.team_project_id for addition in plan.additions
+            )
+        save_progress(job, done=job.done + 1)
+    return team_project_ids
+
+
+def _notify(job, teams):
+    enqueued = notify_teams(teams)
+    _add_count(job, "enqueued", enqueued)
+    job.messages.append(f"Команды и ПМы: поставлено в очередь оповещений {enqueued}.")
+    save_progress(job, done=job.done + 1)
+
+    enqueued = notify_free_students(get_unallocated_students())
+    _add_count(job, "enqueued", enqueued)
+    job.messages.append(
+        f"Нераспределенные ученики: поставлено в очередь оповещений {enqueued}."
+    )
+    save_progress(job, done=job.done + 1)
+
+
+@instrumented("job.distribute")
+def run_distribute(job):
+    error = check_distribution()
+    if error:
+        job.errors.append(error)
+        return
+
+    # Планирование, запись каждого потока и два вида оповещений
+    save_progress(job, total=len(get_cohorts()) + 3)
+    plans = plan_cohorts_distribution()
+    save_progress(job, done=1, total=len(plans) + 3)
+    _commit_plans(
+        job,
+        plans,
+        "{plan.date_start} - {plan.date_end}: распределение успешно, "
+        "команд {teams}, без команды {unallocated_students}.",
+    )
+    _notify(job, get_teams())
+
+
+@instrumented("job.preview_distribution")
+def run_preview_distribution(job):
+    """Строит планы по потокам без записи и сохраняет их в job.result
+    для задачи применения (run_apply_distribution)."""
+    error = check_distribution()
+    if error:
+        job.errors.append(error)
+        return
+
+    save_progress(job, total=1)
+    plans = plan_cohorts_distribution()
+    job.result = {"plans": [plan.to_dict() for plan in plans]}
+    for plan in plans:
+        stats = plan.stats
+        job.messages.append(
+            f"План распределения ({stats['engine']}) "
+            f"на {plan.date_start} - {plan.date_end}: "
+            f"команд {stats['teams']}, "
+            f"распределено учеников {stats['placed_students']}, "
+            f"без команды {stats['unallocated_students']}."
+        )
+        _add_count(job, "teams", stats["teams"])
+        _add_count(job, "placed_students", stats["placed_students"])
+    save_progress(job, done=1)
+
+
+@instrumented("job.apply_distribution")
+def run_apply_distribution(job):
+    """Записывает планы задачи предпросмотра payload["preview_job_id"]."""
+    preview_job = Job.objects.get(id=job.payload["preview_job_id"])
+    plans = [
+        AllocationPlan.from_dict(data) for data in preview_job.result.get("plans", [])
+    ]
+    save_progress(job, total=len(plans) + 2)
+    _commit_plans(
+        job,
+        plans,
+        "{plan.date_start} - {plan.date_end}: распределение успешно, "
+        "команд {teams}, без команды {unallocated_students}.",
+    )
+    _notify(job, get_teams())
+
+
+@instrumented("job.distribute_late")
+def run_distribute_late(job):
+    error = check_distribution()
+    if error:
+        job.errors.append(error)
+        return
+
+    cohorts = get_cohorts()
+    save_progress(job, total=2 * len(cohorts) + 2)
+    plans = []
+    for cohort in cohorts:
+        plans.append(plan_late_distribution(cohort))
+        save_progress(job, done=job.done + 1)
+    team_project_ids = _commit_plans(
+        job,
+        plans,
+        "Донабор на {plan.date_start} - {plan.date_end}: "
+        "новых команд {teams}, пополнено команд {filled_teams}, "
+        "распределено учеников {placed_students}, "
+        "без команды {unallocated_students}.",
+    )
+    # Оповещаем только затронутые команды, остальные уже знают свой состав
+    _notify(job, get_teams(team_project_ids=team_project_ids))
+
+
+@instrumented("job.cancel_distribution")
+def run_cancel_distribution(job):
+    save_progress(job, total=1)
+    job.messages.append(cancel_distribution())
+    save_progress(job, done=1)
+
+
+@instrumented("job.notify_teams")
+def run_notify_teams(job):
+    save_progress(job, total=1)
+    enqueued = notify_teams(get_teams())
+    _add_count(job, "enqueued", enqueued)
+    job.messages.append(f"Команды и ПМы: поставлено в очередь оповещений {enqueued}.")
+    save_progress(job, done=1)
+
+
+@instrumented("job.notify_free_students")
+def run_notify_free_students(job):
+    save_progress(job, total=1)
+    enqueued = notify_free_students(get_unallocated_students())
+    _add_count(job, "enqueued", enqueued)
+    job.messages.append(
+        f"Нераспределенные ученики: поставлено в очередь оповещений {enqueued}."
+    )
+    save_progress(job, done=1)
+
+
+JOB_HANDLERS = {
+    Job.DISTRIBUTE: run_distribute,
+    Job.PREVIEW_DISTRIBUTION: run_preview_distribution,
+    Job.APPLY_DISTRIBUTION: run_apply_distribution,
+    Job.DISTRIBUTE_LATE: run_distribute_late,
+    Job.CANCEL_DISTRIBUTION: run_cancel_distribution,
+    Job.NOTIFY_TEAMS: run_notify_teams,
+    Job.NOTIFY_FREE_STUDENTS: run_notify_free_students,
+}
+
+
+def run_job(job):
+    """Выполняет взятую задачу обработчиком JOB_HANDLERS и записывает
+    итог. Исключение обработчика завершает задачу ошибкой, а не воркер.
+    Итог не записывается, если задачу уже завершил другой воркер."""
+    stopped = Event()
+    heartbeat = Thread(target=_heartbeat, args=(job.id, stopped), daemon=True)
+    heartbeat.start()
+    try:
+        JOB_HANDLERS[job.action](job)
+    except JobLost as error:
+        logger.warning(str(error))
+        job.refresh_from_db()
+        return job
+    except Exception as error:
+        logger.exception(f"Задача {job.id} завершилась ошибкой")
+        job.errors.append(f"{type(error).__name__}: {error}")
+        job.status = Job.FAILED
+    else:
+        job.status = Job.FAILED if job.errors and not job.messages else Job.DONE
+    finally:
+        stopped.set()
+        heartbeat.join()
+
+    job.finished_at = job.heartbeat_at = timezone.now()
+    updated = Job.objects.filter(id=job.id, status=Job.RUNNING).update(
+        status=job.status,
+        done=job.done,
+        total=job.total,
+        counts=job.counts,
+        messages=job.messages,
+        errors=job.errors,
+        result=job.result,
+        heartbeat_at=job.heartbeat_at,
+        finished_at=job.finished_at,
+    )
+    if not updated:
+        logger.warning(f"Задача {job.id} уже завершена другим воркером")
+        job.refresh_from_db()
+    return job
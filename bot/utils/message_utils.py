@@ -0,0 +1,55 @@
+from string import Formatter
+
+# Символы, которые MarkdownV2 требует экранировать в тексте
+MARKDOWN_V2_SPECIAL_CHARACTERS = "\\_*[]()~`>#+-=|{}.!"
+# Разметка, которую шаблоны используют как есть: *жирный*, _курсив_,
+# ~зачеркнутый~, `код`, ||спойлер||
+TEMPLATE_MARKUP_CHARACTERS = "*_~`|"
+
+_ESCAPE_TABLE = str.maketrans(
+    {character: f"\\{character}" for character in MARKDOWN_V2_SPECIAL_CHARACTERS}
+)
+_ESCAPE_PAIRS = [
+    (character, f"\\{character}") for character in MARKDOWN_V2_SPECIAL_CHARACTERS
+]
+_TEMPLATE_ESCAPE_TABLE = str.maketrans(
+    {
+        character: f"\\{character}"
+        for character in MARKDOWN_V2_SPECIAL_CHARACTERS
+        if character not in TEMPLATE_MARKUP_CHARACTERS
+    }
+)
+
+
+def escape_markdown(value):
+    """Значение как текст MarkdownV2: все спецсимволы экранированы."""
+    value = str(value)
+    if value.isascii():
+        return value.translate(_ESCAPE_TABLE)
+    # На кириллице str.translate с заменой на две буквы идет посимвольно
+    # через словарь и в несколько раз медленнее замен только тех
+    # спецсимволов, что есть в строке
+    for character, escaped in _ESCAPE_PAIRS:
+        if character in value:
+            value = value.replace(character, escaped)
+    return value
+
+
+class MessageTemplate:
+    """Шаблон сообщения MarkdownV2 с полями {name} как у str.format.
+    Разбирается один раз при создании: текст шаблона сразу экранируется,
+    кроме разметки TEMPLATE_MARKUP_CHARACTERS, а при render экранируются
+    только подставленные значения."""
+
+    def __init__(self, template):
+        self._parts = []
+        for literal, field_name, _, _ in Formatter().parse(template):
+            self._parts.append((literal.translate(_TEMPLATE_ESCAPE_TABLE), field_name))
+
+    def render(self, **values):
+        parts = []
+        for literal, field_name in self._parts:
+            parts.append(literal)
+            if field_name is not None:
+                parts.append(escape_markdown(values[field_name]))
+        return "".join(parts)
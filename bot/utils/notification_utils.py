@@ -1,10 +1,15 @@
 import logging
 import os
 
-from telegram import Bot, ParseMode
+from django.conf import settings
+from telegram import Bot
 from telegram.utils.request import Request
 
-from bot.models import Participant, TimeSlot
+from bot.models import OutboxMessage
+from bot.utils.availability_utils import load_free_pm_capacity
+from bot.utils.message_utils import MessageTemplate
+from bot.utils.outbox_utils import enqueue_messages
+from bot.utils.timeslots_utils import to_local_key
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
@@ -15,101 +20,116 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-request = Request(connect_timeout=0.5, read_timeout=1.0)
+# Пул соединений на все потоки рассылки (Dispatcher в send_outbox)
+request = Request(
+    con_pool_size=settings.NOTIFY_WORKERS + 4,
+    connect_timeout=0.5,
+    read_timeout=5.0,
+)
 bot = Bot(
     request=request,
     token=TELEGRAM_TOKEN,
 )
 
 
-def escape_characters(text: str) -> str:
-    """Screen characters for Markdown V2"""
-    text = text.replace("\\", "")
-    characters = [".", "+", "(", ")", "-", "!", "=", "_"]
-    for character in characters:
-        text = text.replace(character, f"\{character}")
-    return text
+TEAM_PM_TEMPLATE = MessageTemplate(
+    "{name}, поздравляем! Для вас сформировалась группа студентов\n"
+    "Проект: *{project_name}*\n"
+    "Даты: *{start_date} - {end_date}*\n"
+    "Команда: \n*{team}*\n"
+    "Созвон в: *{call_time}*"
+)
+TEAM_STUDENT_TEMPLATE = MessageTemplate(
+    "На неделе с *{start_date} - {end_date}* вы участвуете в команде с:\n*{team}*\n"
+    "Ваш ПМ: *{pm}*\n"
+    "Проект: *{project_name}*\n"
+    "Созвон в: *{call_time}*"
+)
+FREE_STUDENT_TEMPLATE = MessageTemplate(
+    "*{name}*, к сожалению на выбранные вами слоты времени группы не нашлось.\n"
+    "Ближе всего к ним есть слоты на *{suggestions}*\n"
+    "Если какой-то из них устраивает Вас, добавьте его в список возможных /start\n"
+    "Спасибо!"
+)
+NO_FREE_SLOTS_TEMPLATE = MessageTemplate(
+    "*{name}*, к сожалению на выбранные вами слоты времени группы не нашлось, "
+    "а других свободных слотов у ПМов сейчас нет.\n"
+    "Выбрать другое время можно в /start"
+)
 
 
 def notify_teams(teams=None):
-
+    """Ставит в очередь оповещения ПМов и учеников команд teams,
+    отправляет их команда send_outbox. Возвращает число поставленных."""
+    messages = []
     for team in teams:
-        pm = team["pm"]
-        students = list(team["students"])
-
-        project_name = team["pm_timeslot"].team_project
-        start_date = team["pm_timeslot"].team_project.date_start.strftime("%d.%m.%Y")
-        end_date = team["pm_timeslot"].team_project.date_end.strftime("%d.%m.%Y")
-        call_time = team["pm_timeslot"].time_slot.strftime("%H:%M")
-
-        team_text = "\n".join([f"{student}" for student in students])
-        pm_text = (
-            f"{pm.name}, поздравляем! Для вас сформировалась группа студентов\n"
-            f"Проект: *{project_name}*\n"
-            f"Даты: *{start_date} - {end_date}*\n"
-            f"Команда: \n*{team_text}*\n"
-            f"Созвон в: *{call_time}*"
-        )
-        logger.error(f"{pm.tg_id=} :: {pm_text=}")
-        try:
-            bot.send_message(
-                chat_id=pm.tg_id,
-                text=escape_characters(pm_text),
-                parse_mode=ParseMode.MARKDOWN_V2,
+        pm = team.pm
+        students = team.students
+
+        project_name = team.project_name
+        start_date = team.date_start.strftime("%d.%m.%Y")
+        end_date = team.date_end.strftime("%d.%m.%Y")
+
+        if pm.tg_id:
+            pm_text = TEAM_PM_TEMPLATE.render(
+                name=pm.name,
+                project_name=project_name,
+                start_date=start_date,
+                end_date=end_date,
+                team="\n".join(str(student) for student in students),
+                call_time=to_local_key(team.time_slot, pm.utc_offset),
+            )
+            logger.info(f"{pm.tg_id=} :: {pm_text=}")
+            messages.append(
+                (pm.tg_id, team.team_project_id, OutboxMessage.TEAM_PM, pm_text)
             )
-        except:
-            pass
 
         for student in students:
             if student.tg_id:
                 my_team = students[:]
                 my_team.remove(student)
                 user_id = student.tg_id
-                team_txt = "\n".join([f"{teammate}" for teammate in my_team])
-                text = (
-                    f"На неделе с *{start_date} - {end_date}* вы участвуете в команде с:\n*{team_txt}*\n"
-                    f"Ваш ПМ: *{pm}*\n"
-                    f"Проект: *{project_name}*\n"
-                    f"Созвон в: *{call_time}*"
+                text = TEAM_STUDENT_TEMPLATE.render(
+                    start_date=start_date,
+                    end_date=end_date,
+                    team="\n".join(str(teammate) for teammate in my_team),
+                    pm=pm,
+                    project_name=project_name,
+                    call_time=to_local_key(team.time_slot, student.utc_offset),
                 )
                 logger.info(f"{user_id=} :: {text=}")
-                try:
-                    bot.send_message(
-                        chat_id=user_id,
-                        text=escape_characters(text),
-                        parse_mode=ParseMode.MARKDOWN_V2,
-                    )
-                except:
-                    pass
+                messages.append(
+                    (user_id, team.team_project_id, OutboxMessage.TEAM_STUDENT, text)
+                )
+
+    return enqueue_messages(messages)
 
 
 def notify_free_students(students=None):
-    if not students.exists():
-        return
-    for student in students:
-        if student.tg_id:
-            user_id = student.tg_id
-            free_slots = (
-                TimeSlot.objects.filter(
-                    participant__role=Participant.PRODUCT_MANAGER,
-                    team_project__isnull=True,
-                )
-                .values("time_slot")
-                .distinct()
+    """Ставит в очередь нераспределенным ученикам students подсказки:
+    свободное время менеджеров, ближайшее к выбранному учеником (см.
+    FreePmCapacity.suggest). Менеджеры берутся из потока ученика
+    и считаются один раз на поток, все сообщения готовятся до постановки
+    в очередь. Возвращает число поставленных."""
+    capacities = {}
+    rows = students.exclude(tg_id=None).values_list(
+        "tg_id", "name", "utc_offset", "free_slots_mask", "cohort_id"
+    )
+    messages = []
+    for user_id, name, utc_offset, chosen_mask, cohort_id in rows:
+        if cohort_id not in capacities:
+            capacities[cohort_id] = load_free_pm_capacity(cohort_id)
+        suggestions = [
+            to_local_key(time_slot, utc_offset)
+            for time_slot in capacities[cohort_id].suggest(chosen_mask)
+        ]
+        if suggestions:
+            text = FREE_STUDENT_TEMPLATE.render(
+                name=name, suggestions=", ".join(suggestions)
             )
-            free_times = [slot["time_slot"].strftime("%H:%M") for slot in free_slots]
-            text = (
-                f"*{student.name}*, к сожалению на выбранные вами слоты времени группы не нашлось.\n"
-                f"Есть слоты на *{', '.join(free_times)}*\n"
-                f"Если какой-то из них устраивает Вас, добавьте его в список возможных /start\n"
-                f"Спасибо!"
-            )
-            try:
-                bot.send_message(
-                    chat_id=user_id,
-                    text=escape_characters(text),
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                )
-            except:
-                pass
-            logger.info(student)
+        else:
+            text = NO_FREE_SLOTS_TEMPLATE.render(name=name)
+        logger.info(f"{user_id=} :: {text=}")
+        messages.append((user_id, None, OutboxMessage.FREE_STUDENT, text))
+
+    return enqueue_messages(messages)
@@ -0,0 +1,269 @@
+import logging
+import math
+import random
+from collections import defaultdict
+from time import monotonic
+
+LEVEL_PENALTY = 10
+FAR_EAST_PENALTY = 3
+CONSTRAINT_PENALTY = 100
+LOAD_PENALTY = 1
+
+START_TEMPERATURE = 2.0
+END_TEMPERATURE = 0.01
+DEADLINE_CHECK_MOVES = 256
+
+logger = logging.getLogger(__name__)
+
+
+class _TeamsState:
+    """Распределение в виде плоских списков, по индексу команды,
+    с дельта-оценкой ходов за O(размер команды). Ход возвращает
+    изменение общей оценки или None, если не принят."""
+
+    def __init__(self, snapshot, teams, max_teams_of_manager):
+        self.constraints = snapshot.constraints
+        self.far_east = snapshot.far_east
+        self.max_teams_of_manager = max_teams_of_manager
+
+        # student_id -> {time_slot: slot_id}, student_id -> level
+        self.student_times = defaultdict(dict)
+        self.student_levels = {}
+        for (time_slot, level), bucket in snapshot.student_slots.items():
+            for student_id, slot_id in bucket.items():
+                self.student_times[student_id].setdefault(time_slot, slot_id)
+                self.student_levels[student_id] = level
+
+        self.members = [list(team.student_ids) for team in teams]
+        self.times = [team.time_slot for team in teams]
+        self.pms = [team.pm_id for team in teams]
+        self.pm_slots = [team.pm_slot_id for team in teams]
+        self.costs = [
+            self.team_cost(members, pm_id)
+            for members, pm_id in zip(self.members, self.pms)
+        ]
+
+        self.teams_by_time = defaultdict(list)
+        for team_index, time_slot in enumerate(self.times):
+            self.teams_by_time[time_slot].append(team_index)
+
+        self.pm_teams_count = defaultdict(int)
+        for pm_id in self.pms:
+            self.pm_teams_count[pm_id] += 1
+
+        busy_pm_slots = set(self.pm_slots)
+        self.free_pm_slots = defaultdict(list)
+        for pm_id, pm_slots in snapshot.pm_slots.items():
+            for pm_slot_id, time_slot in pm_slots:
+                if pm_slot_id not in busy_pm_slots:
+                    self.free_pm_slots[time_slot].append((pm_id, pm_slot_id))
+
+        placed = set(student_id for members in self.members for student_id in members)
+        # time_slot -> [student_id] и позиции в этих списках для удаления за O(1)
+        self.free_students = defaultdict(list)
+        self.free_positions = {}
+        for student_id in snapshot.unallocated - placed:
+            self._release(student_id)
+
+    def team_cost(self, members, pm_id):
+        levels = set(self.student_levels[student_id] for student_id in members)
+        far_east_count = sum(1 for student_id in members if student_id in self.far_east)
+
+        team_mask = self.constraints.mask(pm_id)
+        for student_id in members:
+            team_mask |= self.constraints.mask(student_id)
+        violations_count = 0
+        if team_mask:
+            for participant_id in (pm_id, *members):
+                if self.constraints.separated(participant_id) & team_mask:
+                    violations_count += 1
+            for student_id in members:
+                if self.constraints.block(student_id)[1] & ~team_mask:
+                    violations_count += 1
+
+        return (
+            (len(levels) - 1) * LEVEL_PENALTY
+            + min(far_east_count, len(members) - far_east_count) * FAR_EAST_PENALTY
+            + violations_count * CONSTRAINT_PENALTY
+        )
+
+    def total_cost(self):
+        load = sum(count * count for count in self.pm_teams_count.values())
+        return sum(self.costs) + load * LOAD_PENALTY
+
+    def _release(self, student_id):
+        for time_slot in self.student_times[student_id]:
+            pool = self.free_students[time_slot]
+            self.free_positions[(time_slot, student_id)] = len(pool)
+            pool.append(student_id)
+
+    def _take(self, student_id):
+        for time_slot in self.student_times[student_id]:
+            pool = self.free_students[time_slot]
+            position = self.free_positions.pop((time_slot, student_id))
+            last_id = pool.pop()
+            if last_id != student_id:
+                pool[position] = last_id
+                self.free_positions[(time_slot, last_id)] = position
+
+    def try_swap(self, rnd, temperature):
+        """Обмен двух учеников между командами одного времени."""
+        first = rnd.randrange(len(self.members))
+        candidates = self.teams_by_time[self.times[first]]
+        second = rnd.choice(candidates)
+        if first == second:
+            return None
+        first_position = rnd.randrange(len(self.members[first]))
+        second_position = rnd.randrange(len(self.members[second]))
+
+        first_members = self.members[first][:]
+        second_members = self.members[second][:]
+        first_members[first_position], second_members[second_position] = (
+            second_members[second_position],
+            first_members[first_position],
+        )
+        first_cost = self.team_cost(first_members, self.pms[first])
+        second_cost = self.team_cost(second_members, self.pms[second])
+        delta = first_cost + second_cost - self.costs[first] - self.costs[second]
+        if not _accept(delta, rnd, temperature):
+            return None
+
+        self.members[first], self.members[second] = first_members, second_members
+        self.costs[first], self.costs[second] = first_cost, second_cost
+        return delta
+
+    def try_replace(self, rnd, temperature):
+        """Замена ученика команды нераспределенным учеником того же времени."""
+        team = rnd.randrange(len(self.members))
+        pool = self.free_students[self.times[team]]
+        if not pool:
+            return None
+        new_id = rnd.choice(pool)
+        position = rnd.randrange(len(self.members[team]))
+
+        members = self.members[team][:]
+        old_id = members[position]
+        members[position] = new_id
+        cost = self.team_cost(members, self.pms[team])
+        delta = cost - self.costs[team]
+        if not _accept(delta, rnd, temperature):
+            return None
+
+        self._take(new_id)
+        self._release(old_id)
+        self.members[team] = members
+        self.costs[team] = cost
+        return delta
+
+    def try_move_to_pm(self, rnd, temperature):
+        """Передача команды свободному слоту другого менеджера в то же время."""
+        team = rnd.randrange(len(self.members))
+        pool = self.free_pm_slots[self.times[team]]
+        if not pool:
+            return None
+        position = rnd.randrange(len(pool))
+        new_pm_id, new_pm_slot_id = pool[position]
+        old_pm_id = self.pms[team]
+        if new_pm_id == old_pm_id:
+            return None
+        if self.pm_teams_count[new_pm_id] >= self.max_teams_of_manager:
+            return None
+
+        cost = self.team_cost(self.members[team], new_pm_id)
+        load_delta = 2 * (
+            self.pm_teams_count[new_pm_id] - self.pm_teams_count[old_pm_id] + 1
+        )
+        delta = cost - self.costs[team] + load_delta * LOAD_PENALTY
+        if not _accept(delta, rnd, temperature):
+            return None
+
+        pool[position] = (old_pm_id, self.pm_slots[team])
+        self.pm_teams_count[old_pm_id] -= 1
+        self.pm_teams_count[new_pm_id] += 1
+        self.pms[team] = new_pm_id
+        self.pm_slots[team] = new_pm_slot_id
+        self.costs[team] = cost
+        return delta
+
+    def snapshot(self):
+        """Копия составов, менеджеров и их слотов для apply."""
+        return (
+            [list(members) for members in self.members],
+            list(self.pms),
+            list(self.pm_slots),
+        )
+
+    def apply(self, teams, snapshot):
+        members, pms, pm_slots = snapshot
+        for team_index, team in enumerate(teams):
+            team.pm_id = pms[team_index]
+            team.pm_slot_id = pm_slots[team_index]
+            team.student_ids = list(members[team_index])
+            team.student_slot_ids = [
+                self.student_times[student_id][team.time_slot]
+                for student_id in team.student_ids
+            ]
+
+
+def _accept(delta, rnd, temperature):
+    if delta <= 0:
+        return True
+    return rnd.random() < math.exp(-delta / temperature)
+
+
+def optimize_teams(snapshot, teams, max_teams_of_manager, seconds, seed=None):
+    """Локальный поиск (имитация отжига) поверх готового распределения.
+
+    Ходы: обмен учеников между командами одного времени, замена ученика
+    нераспределенным и передача команды другому менеджеру. Штрафуются
+    разные уровни в команде, смешение учеников с ДВ и остальных,
+    нарушения Constraint и неравномерная нагрузка менеджеров. Число
+    размещенных учеников не меняется. Запоминается лучшее из пройденных
+    состояний, а не последнее: при отжиге поиск может уйти от него
+    к худшему. Команды изменяются на месте, если лучшее состояние лучше
+    исходного. Возвращает статистику оптимизации."""
+    rnd = random.Random(seed)
+    started_at = monotonic()
+    deadline = started_at + seconds
+
+    state = _TeamsState(snapshot, teams, max_teams_of_manager)
+    initial_cost = cost = best_cost = state.total_cost()
+    best_state = None
+    moves = [state.try_swap, state.try_swap, state.try_replace, state.try_move_to_pm]
+
+    moves_count = 0
+    accepted_count = 0
+    temperature = START_TEMPERATURE
+    while teams:
+        if moves_count % DEADLINE_CHECK_MOVES == 0:
+            now = monotonic()
+            if now >= deadline:
+                break
+            progress = (now - started_at) / seconds
+            temperature = (
+                START_TEMPERATURE * (END_TEMPERATURE / START_TEMPERATURE) ** progress
+            )
+        moves_count += 1
+        delta = rnd.choice(moves)(rnd, temperature)
+        if delta is None:
+            continue
+        accepted_count += 1
+        cost += delta
+        if cost < best_cost:
+            best_cost = cost
+            best_state = state.snapshot()
+
+    if best_state is not None:
+        state.apply(teams, best_state)
+
+    elapsed = monotonic() - started_at
+    stats = {
+        "moves": moves_count,
+        "accepted_moves": accepted_count,
+        "moves_per_second": round(moves_count / elapsed) if elapsed else 0,
+        "initial_cost": initial_cost,
+        "final_cost": best_cost,
+        "seconds": round(elapsed, 3),
+    }
+    logger.info(f"Оптимизация распределения: {stats}")
+    return stats
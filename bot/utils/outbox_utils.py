@@ -0,0 +1,127 @@
+from datetime import timedelta
+from uuid import uuid4
+
+from django.db import transaction
+from django.utils import timezone
+
+from bot.models import OutboxMessage
+
+OUTBOX_BATCH_SIZE = 100
+# Столько может отправляться пачка, дальше ее отправитель считается упавшим
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_messages(messages):
+    """Ставит в очередь messages — список (chat_id, team_project_id,
+    template, text) — и возвращает число поставленных. Сообщение
+    с тем же получателем, командой и шаблоном уже в очереди: если текст
+    не изменился и оно не провалилось, повторно не ставится, иначе
+    ставится заново с новым текстом."""
+    messages = {
+        (chat_id, team_project_id, template): text
+        for chat_id, team_project_id, template, text in messages
+    }
+    if not messages:
+        return 0
+
+    existing = OutboxMessage.objects.filter(
+        chat_id__in={chat_id for chat_id, _, _ in messages}
+    ).only("id", "chat_id", "team_project_id", "template", "text", "status")
+    existing = {
+        (message.chat_id, message.team_project_id, message.template): message
+        for message in existing
+    }
+
+    new_messages = []
+    changed_messages = []
+    for key, text in messages.items():
+        message = existing.get(key)
+        if message is None:
+            chat_id, team_project_id, template = key
+            new_messages.append(
+                OutboxMessage(
+                    chat_id=chat_id,
+                    team_project_id=team_project_id,
+                    template=template,
+                    text=text,
+                )
+            )
+        elif message.text != text or message.status == OutboxMessage.FAILED:
+            message.text = text
+            message.status = OutboxMessage.PENDING
+            message.error = ""
+            changed_messages.append(message)
+
+    with transaction.atomic():
+        # Сообщения, поставленные параллельно, пропускаются
+        OutboxMessage.objects.bulk_create(
+            new_messages, batch_size=OUTBOX_BATCH_SIZE, ignore_conflicts=True
+        )
+        OutboxMessage.objects.bulk_update(
+            changed_messages,
+            ["text", "status", "error"],
+            batch_size=OUTBOX_BATCH_SIZE,
+        )
+    return len(new_messages) + len(changed_messages)
+
+
+def release_stale_messages():
+    """Возвращает в очередь сообщения, взятые на отправку дольше
+    CLAIM_TIMEOUT назад: отправлявший их процесс упал. Такие сообщения
+    могут дойти дважды, остальные после падения не повторяются."""
+    return OutboxMessage.objects.filter(
+        status=OutboxMessage.SENDING,
+        claimed_at__lt=timezone.now() - CLAIM_TIMEOUT,
+    ).update(status=OutboxMessage.PENDING, claimed_at=None, claim_token=None)
+
+
+def claim_messages(batch_size=OUTBOX_BATCH_SIZE):
+    """Берет на отправку до batch_size сообщений в порядке постановки.
+    На PostgreSQL строки, которые берет другой процесс, пропускаются.
+    Возвращаются только сообщения, переведенные в отправку этим вызовом:
+    на SQLite и при гонке между выборкой и обновлением два отправителя
+    могут выбрать одни строки, но метку claim_token получит один."""
+    claim_token = uuid4()
+    with transaction.atomic():
+        message_ids = list(
+            OutboxMessage.objects.filter(status=OutboxMessage.PENDING)
+            .order_by("id")
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:batch_size]
+        )
+        OutboxMessage.objects.filter(
+            id__in=message_ids, status=OutboxMessage.PENDING
+        ).update(
+            status=OutboxMessage.SENDING,
+            claimed_at=timezone.now(),
+            claim_token=claim_token,
+        )
+    return list(
+        OutboxMessage.objects.filter(
+            id__in=message_ids, claim_token=claim_token
+        ).order_by("id")
+    )
+
+
+def deliver_messages(messages, dispatcher):
+    """Отправляет взятые сообщения через dispatcher и записывает итог.
+    Сообщение, заново поставленное в очередь или взятое другим
+    отправителем во время отправки, не меняется. Возвращает Delivery
+    по каждому."""
+    deliveries = dispatcher.send(
+        [(message.chat_id, message.text) for message in messages]
+    )
+    sent_at = timezone.now()
+    for message, delivery in zip(messages, deliveries):
+        message.attempts += delivery.attempts
+        message.error = delivery.error or ""
+        if delivery.delivered:
+            message.status = OutboxMessage.SENT
+            message.sent_at = sent_at
+        else:
+            message.status = OutboxMessage.FAILED
+    OutboxMessage.objects.filter(
+        status=OutboxMessage.SENDING,
+        claim_token__in={message.claim_token for message in messages},
+    ).bulk_update(messages, ["status", "attempts", "error", "sent_at"])
+    return deliveries
@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from django.utils import timezone
+
+from bot.models import Participant, RosterSnapshot, TimeSlot
+
+
+def build_rosters(team_project_ids):
+    """Снимки составов команд team_project_ids по их таймслотам за один
+    запрос, без записи в БД. Команды без ПМа пропускаются."""
+    timeslots = (
+        TimeSlot.objects.filter(team_project_id__in=team_project_ids)
+        .select_related("participant", "team_project__project")
+        .order_by("team_project_id", "id")
+    )
+
+    rosters = {}
+    students = defaultdict(list)
+    for timeslot in timeslots:
+        participant = timeslot.participant
+        if participant.role != Participant.PRODUCT_MANAGER:
+            students[timeslot.team_project_id].append(
+                {
+                    "id": participant.id,
+                    "name": participant.name,
+                    "tg_id": participant.tg_id,
+                    "tg_username": participant.tg_username,
+                    "level": participant.level,
+                    "utc_offset": participant.utc_offset,
+                }
+            )
+            continue
+        if timeslot.team_project_id in rosters:
+            continue
+
+        team_project = timeslot.team_project
+        rosters[timeslot.team_project_id] = RosterSnapshot(
+            team_project=team_project,
+            project_name=team_project.project.name if team_project.project else "",
+            date_start=team_project.date_start,
+            date_end=team_project.date_end,
+            time_slot=timeslot.time_slot,
+            pm=participant,
+            pm_name=participant.name,
+            pm_tg_id=participant.tg_id,
+            pm_tg_username=participant.tg_username,
+            pm_utc_offset=participant.utc_offset,
+        )
+
+    for team_project_id, roster in rosters.items():
+        roster.students = students[team_project_id]
+    return list(rosters.values())
+
+
+def refresh_rosters(team_project_ids):
+    """Перезаписывает снимки составов команд team_project_ids и ставит
+    их ученикам Participant.roster. Удаление снимка обнуляет ссылку
+    у выбывших учеников. Вызывается внутри транзакции, записывающей
+    распределение."""
+    rosters = build_rosters(team_project_ids)
+    RosterSnapshot.objects.filter(team_project_id__in=team_project_ids).delete()
+    RosterSnapshot.objects.bulk_create(rosters)
+
+    # Прошедшая команда не отнимает ссылку у актуальной
+    now = timezone.now()
+    members = [
+        Participant(id=student["id"], roster_id=roster.team_project_id)
+        for roster in rosters
+        if roster.date_start >= now
+        for student in roster.students
+    ]
+    Participant.objects.bulk_update(members, ["roster"], batch_size=500)
+
+
+def roster_participants(roster):
+    """ПМ и ученики снимка как несохраненные Participant — для вывода
+    и рассылки без обращений к БД."""
+    pm = Participant(
+        id=roster.pm_id,
+        name=roster.pm_name,
+        tg_id=roster.pm_tg_id,
+        tg_username=roster.pm_tg_username,
+        utc_offset=roster.pm_utc_offset,
+        role=Participant.PRODUCT_MANAGER,
+    )
+    students = [
+        Participant(role=Participant.STUDENT, **student) for student in roster.students
+    ]
+    return pm, students
@@ -1,12 +1,28 @@
 import logging
-from datetime import datetime, timedelta
-from random import choice
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
 from typing import List
 
-from bot.models import Participant, Project, TeamProject, TimeSlot
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from bot.models import (
+    AllocationBatch,
+    AllocationStatus,
+    Participant,
+    RosterSnapshot,
+    TeamProject,
+    TimeSlot,
+)
+from bot.utils.roster_utils import refresh_rosters, roster_participants
 
 MAX_TEAM_MEMBERS = 3
 CALL_TIME_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // CALL_TIME_MINUTES
+ALL_SLOTS_MASK = (1 << SLOTS_PER_DAY) - 1
+MASKS_BATCH_SIZE = 500
 STUDENTS_LEVELS = (
     Participant.BEGINNER,
     Participant.BEGINNER_PLUS,
@@ -23,149 +39,225 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def make_teams():
-    """Распределение учеников по командам и менеджерам."""
-    # TODO: задавать даты проекта через аргументы
-    if not TimeSlot.objects.filter(participant__role=Participant.STUDENT).exists():
-        return "Нет учеников, сначала необходимо зарегистрировать учеников."
-    if not TimeSlot.objects.filter(
-        participant__role=Participant.PRODUCT_MANAGER
-    ).exists():
-        return "Нет менеджеров, сначала необходимо зарегистрировать менеджеров."
-
-    students_count = Participant.objects.filter(role=Participant.STUDENT).count()
-    pm_count = Participant.objects.filter(role=Participant.PRODUCT_MANAGER).count()
-    max_teams_of_manager = students_count // MAX_TEAM_MEMBERS // pm_count
-    if max_teams_of_manager == 0:
-        max_teams_of_manager = 1
-
-    for pm in Participant.objects.filter(role=Participant.PRODUCT_MANAGER):
-        pm_teams_count = 0
-        pm_timeslots = TimeSlot.objects.filter(
-            participant=pm,
-            team_project=None,
-        )
-
-        for pm_timeslot in pm_timeslots:
-            if pm_teams_count == max_teams_of_manager:
-                break
-
-            for level in STUDENTS_LEVELS:
-                if pm_teams_count == max_teams_of_manager:
-                    break
-
-                free_students_timeslots = TimeSlot.objects.filter(
-                    time_slot=pm_timeslot.time_slot,
-                    participant__role=Participant.STUDENT,
-                    participant__level=level,
-                    team_project=None,
-                ).filter(participant__in=get_unallocated_students())
-
-                if free_students_timeslots.count() < MAX_TEAM_MEMBERS:
-                    continue
-
-                team_timeslots = free_students_timeslots[:3]
-
-                typical_project = choice(Project.objects.all())
-                team_project = TeamProject.objects.create(
-                    date_start=datetime.fromisoformat(PROJECTS_START_DATE),
-                    date_end=datetime.fromisoformat(PROJECTS_END_DATE),
-                    project=typical_project,
-                )
-
-                for slot in team_timeslots:
-                    slot.team_project = team_project
-                    slot.save()
-
-                pm_timeslot.team_project = team_project
-                pm_timeslot.save()
+@dataclass
+class TeamRoster:
+    """Состав команды: проект, даты, время созвона, менеджер и ученики.
+    Все данные уже загружены, обращений к БД при чтении нет."""
 
-                pm_teams_count += 1
-                break
-
-    return "Распределение успешно"
-
-
-def get_teams(start_date=datetime.now()):
-    """Возвращает данные по командам у которых
-    дата начала проекта позднее указанной start_date."""
+    __slots__ = (
+        "team_project_id",
+        "project_name",
+        "date_start",
+        "date_end",
+        "time_slot",
+        "pm",
+        "students",
+    )
 
-    team_projects = TeamProject.objects.filter(date_start__gte=start_date)
-    if not team_projects.exists():
-        return []
+    team_project_id: int
+    project_name: str
+    date_start: datetime
+    date_end: datetime
+    time_slot: time
+    pm: Participant
+    students: List[Participant]
+
+
+def get_teams(start_date=None, team_project_ids=None):
+    """Возвращает составы команд (TeamRoster), у которых дата начала
+    проекта позднее указанной start_date (по умолчанию — текущего момента).
+    Читает только снимки RosterSnapshot, одним запросом без join.
+    Если передан team_project_ids, только по этим командам."""
+    if start_date is None:
+        start_date = datetime.now()
+
+    rosters = RosterSnapshot.objects.filter(date_start__gte=start_date).order_by(
+        "team_project_id"
+    )
+    if team_project_ids is not None:
+        rosters = rosters.filter(team_project_id__in=team_project_ids)
 
     teams = []
-    for team_project in team_projects:
-        if not team_project.timeslots.all().exists():
-            continue
-
-        pm_timeslots = team_project.timeslots.filter(
-            participant__role=Participant.PRODUCT_MANAGER
+    for roster in rosters:
+        pm, students = roster_participants(roster)
+        teams.append(
+            TeamRoster(
+                team_project_id=roster.team_project_id,
+                project_name=roster.project_name,
+                date_start=roster.date_start,
+                date_end=roster.date_end,
+                time_slot=roster.time_slot,
+                pm=pm,
+                students=students,
+            )
         )
-        if not pm_timeslots.exists():
-            continue
+    return teams
+
 
-        students_timeslots = team_project.timeslots.filter(
-            participant__role=Participant.STUDENT,
+def _drop_duplicate_slots(timeslots):
+    """Перед освобождением слотов timeslots удаляет те, что после него
+    нарушили бы unique_free_timeslot: свободные слоты участника на то же
+    время (их могли добавить в админке или make_timeslots, пока время было
+    занято) и повторы среди самих освобождаемых слотов."""
+    same_time = {
+        "participant_id": OuterRef("participant_id"),
+        "time_slot": OuterRef("time_slot"),
+    }
+    TimeSlot.objects.filter(team_project=None).filter(
+        Exists(timeslots.filter(**same_time))
+    ).delete()
+    timeslots.filter(
+        Exists(timeslots.filter(id__lt=OuterRef("id"), **same_time))
+    ).delete()
+
+
+def cancel_batch(batch):
+    """Откат запуска распределения batch несколькими массовыми запросами
+    по индексам batch: слоты запуска и слоты, добавленные позже в его
+    команды, освобождаются, снимки составов его команд удаляются. Команды
+    и план запуска остаются в истории, запуск помечается отмененным."""
+    with transaction.atomic():
+        # Команды других запусков, пополненные этим, остаются, но меняют состав
+        filled_team_project_ids = list(
+            TimeSlot.objects.filter(batch=batch)
+            .exclude(team_project__batch=batch)
+            .values_list("team_project_id", flat=True)
+            .distinct()
         )
-        teams.append(
-            {
-                "pm_timeslot": pm_timeslots.first(),
-                "pm": pm_timeslots.first().participant,
-                "students_timeslots": students_timeslots,
-                "students": Participant.objects.filter(
-                    role=Participant.STUDENT, timeslots__in=students_timeslots
-                ),
-            }
+        _drop_duplicate_slots(
+            TimeSlot.objects.filter(Q(batch=batch) | Q(team_project__batch=batch))
+        )
+        update_free_slots_masks(TimeSlot.objects.filter(batch=batch), free=True)
+        update_free_slots_masks(
+            TimeSlot.objects.filter(team_project__batch=batch).exclude(batch=batch),
+            free=True,
         )
+        TimeSlot.objects.filter(batch=batch).update(team_project=None, batch=None)
+        TimeSlot.objects.filter(team_project__batch=batch).update(
+            team_project=None, batch=None
+        )
+        AllocationStatus.objects.filter(batch=batch).delete()
+        AllocationStatus.objects.filter(team_project__batch=batch).delete()
+        RosterSnapshot.objects.filter(team_project__batch=batch).delete()
+        refresh_rosters(filled_team_project_ids)
 
-    return teams
+        batch.cancelled_at = timezone.now()
+        batch.save(update_fields=["cancelled_at"])
 
 
-def cancel_distribution(start_date=datetime.now()):
+def cancel_distribution(start_date=None):
     """Отмена распределения, для проектов у которых дата начала позднее
-    указанной start_date."""
-
+    указанной start_date (по умолчанию — текущего момента).
+
+    Запуски распределения откатываются cancel_batch, начиная с последнего,
+    и остаются в истории. Команды, распределенные до появления запусков,
+    удаляются."""
+    if start_date is None:
+        start_date = datetime.now()
+
+    batches = AllocationBatch.objects.filter(
+        cancelled_at=None,
+        date_start__gte=start_date,
+    ).order_by("-id")
     busy_timeslots = TimeSlot.objects.filter(
         team_project__date_start__gte=start_date,
+        team_project__batch=None,
     )
-    if not busy_timeslots.exists():
+    if not batches.exists() and not busy_timeslots.exists():
         return "Не найдено временных слотов!"
 
+    for batch in batches:
+        cancel_batch(batch)
+
     projects_to_delete = TeamProject.objects.filter(timeslots__in=busy_timeslots)
-    projects_to_delete.delete()
+    with transaction.atomic():
+        _drop_duplicate_slots(busy_timeslots)
+        update_free_slots_masks(busy_timeslots, free=True)
+        RosterSnapshot.objects.filter(team_project__in=projects_to_delete).delete()
+        projects_to_delete.delete()
 
     return "Отмена распределения выполнена успешно"
 
 
 def get_unallocated_students():
-    """Нераспределенные по командам ученики."""
-    slots_with_actual_project = TimeSlot.objects.filter(
-        team_project__isnull=False,
-        team_project__date_start__gte=datetime.now(),
-    )
-
-    return (
-        Participant.objects.filter(
-            role=Participant.STUDENT,
-        )
-        .exclude(
-            timeslots__in=slots_with_actual_project,
-        )
-        .distinct()
+    """Нераспределенные по командам ученики: без актуального
+    AllocationStatus. Подзапрос идет по индексу дат статусов."""
+    allocated_students = AllocationStatus.objects.filter(
+        date_start__gte=datetime.now(),
+    ).values("participant_id")
+
+    return Participant.objects.filter(
+        role=Participant.STUDENT,
+    ).exclude(
+        id__in=allocated_students,
     )
 
 
 def make_timeslots(time_start, time_end, tg_id, project=None):
-    """Создание таймслотов для ученика или менеджера."""
+    """Создание таймслотов для ученика или менеджера. Уже существующие
+    слоты пропускает база по ограничениям уникальности TimeSlot, а время,
+    занятое командами, не получает свободного слота, как в
+    set_free_timeslots."""
 
     participant = Participant.objects.get(tg_id=tg_id)
     time_stamps = _timestamps_by_range(time_start, time_end)
-    for time_stamp in time_stamps:
-        _create_timeslot(
-            time_slot=time_stamp,
-            participant=participant,
-            team_project=project,
+    if project is None:
+        busy_times = set(
+            participant.timeslots.exclude(team_project=None).values_list(
+                "time_slot", flat=True
+            )
+        )
+        time_stamps = [
+            time_stamp for time_stamp in time_stamps if time_stamp not in busy_times
+        ]
+    TimeSlot.objects.bulk_create(
+        [
+            TimeSlot(
+                time_slot=time_stamp,
+                participant=participant,
+                team_project=project,
+            )
+            for time_stamp in time_stamps
+        ],
+        ignore_conflicts=True,
+    )
+    refresh_free_slots_masks([participant.id])
+
+
+def set_free_timeslots(participant, times):
+    """Приводит свободные слоты участника к времени times одной транзакцией:
+    лишние свободные слоты удаляются одним запросом, недостающие создаются
+    одним bulk_create. Слоты, уже занятые командами, не меняются, а на их
+    время свободный слот не создается."""
+    times = set(times)
+    with transaction.atomic():
+        free_times = set()
+        busy_times = set()
+        for time_slot, team_project_id in TimeSlot.objects.filter(
+            participant=participant
+        ).values_list("time_slot", "team_project_id"):
+            if team_project_id is None:
+                free_times.add(time_slot)
+            else:
+                busy_times.add(time_slot)
+
+        if free_times - times:
+            TimeSlot.objects.filter(
+                participant=participant,
+                team_project=None,
+                time_slot__in=free_times - times,
+            ).delete()
+        new_times = times - free_times - busy_times
+        if new_times:
+            TimeSlot.objects.bulk_create(
+                [
+                    TimeSlot(time_slot=time_slot, participant=participant)
+                    for time_slot in new_times
+                ],
+                ignore_conflicts=True,
+            )
+        Participant.objects.filter(id=participant.id).update(
+            free_slots_mask=times_to_mask((free_times & times) | new_times)
         )
 
 
@@ -180,10 +272,118 @@ def _timestamps_by_range(time_start, time_end):
     return timestamps
 
 
-def _create_timeslot(time_slot=None, participant=None, team_project=None):
-    """Создает записи таймслота для заданого времени, проекта и участника."""
-    return TimeSlot.objects.get_or_create(
-        time_slot=time_slot,
-        participant=participant,
-        team_project=team_project,
+def slot_bit(time_slot):
+    """Бит слота time_slot в маске дня Participant.free_slots_mask."""
+    return 1 << (time_slot.hour * 60 + time_slot.minute) // CALL_TIME_MINUTES
+
+
+def times_to_mask(times):
+    mask = 0
+    for time_slot in times:
+        mask |= slot_bit(time_slot)
+    return mask
+
+
+def slot_time(slot_number):
+    """Время начала slot_number-го слота дня."""
+    return time(
+        hour=slot_number * CALL_TIME_MINUTES // 60,
+        minute=slot_number * CALL_TIME_MINUTES % 60,
     )
+
+
+def mask_to_times(mask):
+    """Время слотов маски по возрастанию."""
+    return [
+        slot_time(slot_number)
+        for slot_number in range(SLOTS_PER_DAY)
+        if mask >> slot_number & 1
+    ]
+
+
+def rotate_mask(mask, shift):
+    """Маска, сдвинутая по кругу суток на shift слотов позже
+    (отрицательный shift — раньше)."""
+    shift %= SLOTS_PER_DAY
+    return (mask << shift | mask >> SLOTS_PER_DAY - shift) & ALL_SLOTS_MASK
+
+
+def local_timezone(utc_offset):
+    """Пояс участника со смещением utc_offset часов от UTC."""
+    return dt_timezone(timedelta(hours=utc_offset))
+
+
+@lru_cache(maxsize=None)
+def local_time_table(utc_offset):
+    """Таблицы перевода сетки слотов для смещения utc_offset часов:
+    {время слота в UTC: "ЧЧ:ММ" местного времени} и обратная. Строятся
+    один раз на смещение, дальше перевод — поиск в словаре."""
+    to_local = {
+        time_slot: _shift_time(time_slot, utc_offset).strftime("%H:%M")
+        for time_slot in mask_to_times(ALL_SLOTS_MASK)
+    }
+    to_utc = {local_key: time_slot for time_slot, local_key in to_local.items()}
+    return to_local, to_utc
+
+
+def _shift_time(time_slot, hours):
+    moment = datetime.combine(datetime(2000, 1, 1), time_slot)
+    return (moment + timedelta(hours=hours)).time()
+
+
+def to_local_key(time_slot, utc_offset):
+    """Время слота UTC строкой "ЧЧ:ММ" в поясе участника."""
+    local_key = local_time_table(utc_offset)[0].get(time_slot)
+    if local_key is None:
+        # время вне сетки слотов, например заведенное вручную в админке
+        local_key = _shift_time(time_slot, utc_offset).strftime("%H:%M")
+    return local_key
+
+
+def to_utc_time(local_key, utc_offset):
+    """Время слота UTC по строке "ЧЧ:ММ" в поясе участника."""
+    time_slot = local_time_table(utc_offset)[1].get(local_key)
+    if time_slot is None:
+        local_time = datetime.strptime(local_key, "%H:%M").time()
+        time_slot = _shift_time(local_time, -utc_offset)
+    return time_slot
+
+
+def refresh_free_slots_masks(participant_ids):
+    """Пересчитывает маски свободных слотов участников participant_ids
+    по их слотам. Для правок слотов отдельных участников; массовые
+    распределение и отмена используют update_free_slots_masks."""
+    participant_ids = list(participant_ids)
+    for start in range(0, len(participant_ids), MASKS_BATCH_SIZE):
+        masks = dict.fromkeys(participant_ids[start : start + MASKS_BATCH_SIZE], 0)
+        free_timeslots = TimeSlot.objects.filter(
+            participant_id__in=list(masks),
+            team_project=None,
+        ).values_list("participant_id", "time_slot")
+        for participant_id, time_slot in free_timeslots:
+            masks[participant_id] |= slot_bit(time_slot)
+        Participant.objects.bulk_update(
+            [
+                Participant(id=participant_id, free_slots_mask=mask)
+                for participant_id, mask in masks.items()
+            ],
+            ["free_slots_mask"],
+        )
+
+
+def update_free_slots_masks(timeslots, free):
+    """Ставит (free=True) или снимает биты слотов timeslots в масках их
+    участников: по запросу на каждое время, без выборки участников.
+    Вызывается для слотов, которые освобождаются, до их отвязки от команд
+    и для занятых слотов — после привязки. Маска остается точной, так как
+    свободный слот у участника на каждое время один (unique_free_timeslot)."""
+    times = list(timeslots.order_by().values_list("time_slot", flat=True).distinct())
+    for time_slot in times:
+        bit = slot_bit(time_slot)
+        if free:
+            free_slots_mask = F("free_slots_mask").bitor(bit)
+        else:
+            free_slots_mask = F("free_slots_mask").bitand(ALL_SLOTS_MASK ^ bit)
+        Participant.objects.filter(
+            id__in=timeslots.filter(time_slot=time_slot).values("participant_id")
+        ).update(free_slots_mask=free_slots_mask)